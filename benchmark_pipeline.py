@@ -0,0 +1,214 @@
+"""
+Time import, ETL, feature extraction, export and training at several scales.
+
+For each --scales N a synthetic dump of N IOCs is generated
+(generate_threatfox_dump.py) and run through the pipeline stages against a
+scratch database, misp_bench_<N>, which is dropped before and after. Each
+stage records wall seconds, records/s and the process' peak RSS.
+
+Results are appended as JSON lines to --results together with the git
+commit, so running the benchmark on every version builds up a history;
+--compare prints each stage's time against the last run of the same
+scale/stage/backend recorded at a different commit, and exits 1 when any
+stage is slower than --threshold times that.
+
+Run:
+  python3 benchmark_pipeline.py --mongomock --scales 10000
+  python3 benchmark_pipeline.py --scales 10000 100000 1000000 --compare
+  python3 benchmark_pipeline.py --stages import etl --scales 100000 --mongo-uri mongodb://localhost:27017/
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+import metrics
+
+STAGE_NAMES = ("import", "etl", "features", "export", "train")
+DEFAULT_RESULTS = "benchmark_results.jsonl"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# ---------------------------
+# Stages: each returns the number of records it handled
+# ---------------------------
+def import_stage(db, paths, work_dir, batch_size):
+    from threatfox_importer import get_collections, ensure_indexes, import_file
+
+    colls = get_collections(db)
+    ensure_indexes(colls)
+    return sum(import_file(p, colls, batch_size, stream=True, force=True) for p in paths)
+
+
+def etl_stage(db, paths, work_dir, batch_size):
+    from etl_preprocess import run
+
+    return run(db, 0, batch_size=batch_size)
+
+
+def features_stage(db, paths, work_dir, batch_size):
+    from feature_extraction_advanced import fields, extract_columnar
+
+    with open(os.path.join(work_dir, "features.csv"), "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(fields)
+        return extract_columnar(db["processed_iocs"], writer)
+
+
+def export_stage(db, paths, work_dir, batch_size):
+    from export_processed_to_csv import export_csv
+
+    export_csv(db["processed_iocs"], os.path.join(work_dir, "processed_iocs.csv"))
+    return db["processed_iocs"].estimated_document_count()
+
+
+def train_stage(db, paths, work_dir, batch_size):
+    from ioc_loader import load_dataframe
+    from train_baseline_model import LOAD_FIELDS, train
+
+    df = load_dataframe(db["processed_iocs"], LOAD_FIELDS)
+    train(df, os.path.join(work_dir, "baseline.joblib"))
+    return len(df)
+
+
+STAGES = {
+    "import": import_stage,
+    "etl": etl_stage,
+    "features": features_stage,
+    "export": export_stage,
+    "train": train_stage,
+}
+
+
+def make_client(mongo_uri, use_mongomock):
+    if use_mongomock:
+        import mongomock
+        return mongomock.MongoClient()
+    from pymongo import MongoClient
+    return MongoClient(mongo_uri)
+
+
+def run_scale(client, scale, stages, batch_size, seed, verbose=False):
+    """Generate a dump of `scale` IOCs and time each stage on it; returns one result dict per stage."""
+    from generate_threatfox_dump import generate
+
+    db_name = f"misp_bench_{scale}"
+    client.drop_database(db_name)
+    db = client[db_name]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ioc_bench_") as work_dir:
+        start = time.perf_counter()
+        paths = generate(os.path.join(work_dir, "dumps"), scale, seed=seed)
+        print(f"[{scale}] generated {scale} IOCs in {time.perf_counter() - start:.1f}s")
+        try:
+            for name in stages:
+                # the scripts report progress on stdout; keep the benchmark output readable
+                quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                start = time.perf_counter()
+                with quiet, metrics.stage(name):
+                    records = STAGES[name](db, paths, work_dir, batch_size)
+                seconds = time.perf_counter() - start
+                result = {
+                    "scale": scale,
+                    "stage": name,
+                    "seconds": round(seconds, 4),
+                    "records": records,
+                    "records_per_s": round(records / seconds, 1) if seconds else None,
+                    "peak_rss_bytes": metrics.peak_rss_bytes(),
+                }
+                print(f"[{scale}] {name:<9} {seconds:9.2f}s {records:>10} records "
+                      f"{result['records_per_s'] or 0:>12.0f}/s")
+                results.append(result)
+        finally:
+            client.drop_database(db_name)
+    return results
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def append_results(path, rows):
+    with open(path, "a", encoding="utf-8") as fh:
+        for row in rows:
+            fh.write(json.dumps(row) + "\n")
+
+
+def compare(history, rows, threshold):
+    """Print each row against the last run of the same scale/stage/backend at another commit; returns regressions."""
+    regressions = []
+    print("\nscale      stage        seconds   previous   ratio  commit")
+    for row in rows:
+        key = (row["scale"], row["stage"], row["backend"])
+        previous = next((h for h in reversed(history)
+                         if (h["scale"], h["stage"], h["backend"]) == key and h["commit"] != row["commit"]), None)
+        if previous is None:
+            print(f"{row['scale']:<10} {row['stage']:<9} {row['seconds']:10.2f}          -       -  -")
+            continue
+        ratio = row["seconds"] / previous["seconds"] if previous["seconds"] else float("inf")
+        flag = "  SLOWER" if ratio > threshold else ""
+        print(f"{row['scale']:<10} {row['stage']:<9} {row['seconds']:10.2f} {previous['seconds']:10.2f} "
+              f"{ratio:7.2f}  {previous['commit']}{flag}")
+        if flag:
+            regressions.append(row)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000], help="IOC counts to benchmark")
+    parser.add_argument("--stages", nargs="+", choices=STAGE_NAMES, default=list(STAGE_NAMES))
+    parser.add_argument("--mongomock", action="store_true", help="Use in-memory mongomock instead of a mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Import / ETL bulk write size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON lines file results are appended to")
+    parser.add_argument("--compare", action="store_true", help="Compare with the previous commit's results")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Ratio --compare reports as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the stages' own output")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+
+    # keep the stages in pipeline order whatever order they were given in
+    stages = [s for s in STAGE_NAMES if s in args.stages]
+    backend = "mongomock" if args.mongomock else "mongod"
+    history = load_results(args.results)
+    run_info = {
+        "commit": git_commit(),
+        "run_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "backend": backend,
+    }
+
+    client = make_client(args.mongo_uri, args.mongomock)
+    rows = []
+    try:
+        for scale in args.scales:
+            for result in run_scale(client, scale, stages, args.batch_size, args.seed, args.verbose):
+                rows.append(dict(run_info, **result))
+    finally:
+        client.close()
+
+    append_results(args.results, rows)
+    print(f"Appended {len(rows)} results to {args.results}")
+    if args.compare and compare(history, rows, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
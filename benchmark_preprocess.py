@@ -0,0 +1,121 @@
+"""
+Benchmark the vectorized labeling/feature stage of train_baseline_model.py
+against the old per-row df.apply version.
+
+Synthetic rows are resampled from processed_iocs.csv (same ioc_type,
+threat_type, malware and confidence mix) with first_seen spread over the
+last 30 days, so the date parser cannot lean on repeated values.
+Usage:
+  python3 benchmark_preprocess.py
+  python3 benchmark_preprocess.py --rows 1000000 --source processed_iocs.csv
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from recency import RECENCY_FIELDS, days_since
+from train_baseline_model import FEATURE_FIELDS, high_risk_labels, feature_frame
+
+
+def synthetic_frame(source, rows, now, seed=42):
+    """rows IOCs shaped like load_dataframe(coll, LOAD_FIELDS) output."""
+    base = pd.read_csv(source)
+    rng = np.random.default_rng(seed)
+    df = base.iloc[rng.integers(0, len(base), rows)].reset_index(drop=True)
+
+    offsets = pd.to_timedelta(rng.integers(0, 30 * 24 * 3600, rows), unit="s")
+    first_seen = pd.Timestamp(now).tz_convert(None).floor("s") - offsets
+    first_seen_str = pd.Series(first_seen.strftime("%Y-%m-%d %H:%M:%S"), dtype=object)
+    # a few unparseable / missing values, as in real exports
+    first_seen_str[rng.random(rows) < 0.01] = None
+    first_seen_str[rng.random(rows) < 0.001] = "not a date"
+    duration = np.minimum(rng.integers(0, 5, rows), offsets.days)
+    last_seen = first_seen + pd.to_timedelta(duration, unit="D")
+    last_seen_str = pd.Series(last_seen.strftime("%Y-%m-%d %H:%M:%S"), dtype=object)
+    last_seen_str[rng.random(rows) < 0.4] = None
+
+    out = pd.DataFrame({
+        "first_seen": first_seen_str,
+        "last_seen": last_seen_str,
+        "malware": df["malware"].where(df["malware"].notna(), None),
+        "ioc_type": df["ioc_type"],
+        "threat_type": df["threat_type"],
+    })
+    for f in FEATURE_FIELDS:
+        col = "features." + f
+        if f not in RECENCY_FIELDS:
+            out[col] = df[col] if col in df.columns else None
+    out["features.seen_duration_days"] = duration
+    return out
+
+
+# ---------------------------
+# Previous implementation, kept as the baseline
+# ---------------------------
+def legacy_preprocess(df, now):
+    def compute_high_risk(row):
+        first_seen = row.get("first_seen")
+        malware = row.get("malware")
+        if not first_seen:
+            return 0
+        if isinstance(first_seen, str):
+            try:
+                first_seen_dt = datetime.strptime(first_seen, "%Y-%m-%d %H:%M:%S")
+            except Exception:
+                return 0
+        else:
+            first_seen_dt = first_seen
+        if first_seen_dt.tzinfo is None:
+            first_seen_dt = first_seen_dt.replace(tzinfo=timezone.utc)
+        delta_hours = (now - first_seen_dt).total_seconds() / 3600
+        return 1 if (delta_hours <= 48 or malware) else 0
+
+    df = df.copy()
+    df["high_risk"] = df.apply(compute_high_risk, axis=1)
+    recency = df.apply(lambda row: days_since(row, now), axis=1)
+    df["features.days_since_first_seen"] = pd.Series([r[0] for r in recency], index=df.index, dtype=object)
+    df["features.days_since_last_seen"] = pd.Series([r[1] for r in recency], index=df.index, dtype=object)
+    for col in FEATURE_FIELDS:
+        df[col] = df["features." + col]
+    for col in ("ioc_type", "threat_type"):
+        df[col] = df[col].fillna("unknown")
+    for col in ("confidence", "has_malware", "days_since_first_seen", "days_since_last_seen", "seen_duration_days"):
+        df[col] = df[col].fillna(0)
+    return df["high_risk"], df[FEATURE_FIELDS]
+
+
+def vectorized_preprocess(df, now):
+    return high_risk_labels(df, now), feature_frame(df, now)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--source", default="processed_iocs.csv")
+    args = parser.parse_args(argv)
+
+    now = datetime.now(timezone.utc)
+    df = synthetic_frame(args.source, args.rows, now)
+    print(f"Generated {len(df)} synthetic rows from {args.source}")
+
+    legacy_s, (legacy_y, legacy_x) = timed(legacy_preprocess, df, now)
+    vector_s, (vector_y, vector_x) = timed(vectorized_preprocess, df, now)
+
+    label_diffs = int((legacy_y.values != vector_y.values).sum())
+    feature_diffs = int((legacy_x.astype(str).values != vector_x.astype(str).values).any(axis=1).sum())
+    print(f"df.apply:   {legacy_s:8.2f}s  ({args.rows / legacy_s:,.0f} rows/s)")
+    print(f"vectorized: {vector_s:8.2f}s  ({args.rows / vector_s:,.0f} rows/s)")
+    print(f"speedup:    {legacy_s / vector_s:8.1f}x")
+    print(f"differing labels: {label_diffs}, differing feature rows: {feature_diffs}")
+    raise SystemExit(1 if label_diffs or feature_diffs else 0)
+
+
+if __name__ == "__main__":
+    main()
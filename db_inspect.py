@@ -1,9 +1,11 @@
 """
 Inspect MongoDB 'misp' database: list collections, counts, sample docs,
-and create unique indexes for attribute collections (value + type).
+and create unique indexes for attribute collections (value + type, or the
+digest for ioc_hashes).
 Run: python db_inspect.py
 """
 from pymongo import MongoClient, ASCENDING
+from hash_store import ensure_hash_index
 
 client = MongoClient("mongodb://localhost:27017/")
 db = client["misp"]
@@ -22,7 +24,11 @@ for name in targets:
         print("Sample document:")
         print(sample)
         # create recommended unique index for attribute collections
-        if name != "iocs":
+        if name == "ioc_hashes":
+            # keyed on the binary digest, not value + type (see hash_store.py)
+            ensure_hash_index(coll)
+            print(f"Ensured digest index on {name}")
+        elif name != "iocs":
             try:
                 idx_name = coll.create_index([("value", ASCENDING), ("type", ASCENDING)], unique=True)
                 print(f"Created/ensured index on {name}: {idx_name}")
@@ -1,26 +1,57 @@
-import argparse
-from datetime import datetime, timezone
-from pymongo import MongoClient, UpdateOne
+"""
+Compute per-attribute features from misp.iocs events into misp.processed_iocs.
+
+Run:
+  python3 etl_preprocess.py --limit 100
+  python3 etl_preprocess.py --incremental
+  python3 etl_preprocess.py --engine aggregate --incremental
+  python3 etl_preprocess.py --verify --limit 1000
+  python3 etl_preprocess.py --incremental --metrics etl.jsonl
+  python3 etl_preprocess.py --unset-recency
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["misp"]
+--incremental keeps a high-watermark (event timestamp, threatfox_id) in
+misp.etl_state and only processes events newer than it. The importer sets
+an event's timestamp when it writes a changed event, so new and changed
+events are both picked up. Events stamped within the last --settle seconds
+are left for the next run: a batch still being written when the watermark
+is saved would otherwise land below it and never be processed. Upserts are flushed every --batch-size
+attributes and the watermark advances after each flush, so an interrupted
+run resumes where it stopped.
 
-iocs = db["iocs"]
-processed = db["processed_iocs"]
+--engine aggregate computes the same documents with a server-side pipeline
+($unwind + $merge into processed_iocs), so events never leave MongoDB.
+--verify runs both engines on the same events into scratch collections and
+reports any document that differs. Both engines skip (and count) attributes
+without a value: there is nothing to key the processed_iocs document on.
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--limit", type=int, default=100, help="Number of events to process (0 = all)")
-args = parser.parse_args()
+Documents hold only time-invariant values (first_seen, last_seen,
+seen_duration_days), so reprocessing an unchanged event modifies nothing.
+days_since_first_seen / days_since_last_seen are derived from first_seen /
+last_seen when processed_iocs is read (see recency.py); --unset-recency
+removes the copies older runs stored. Writes that change processed_iocs
+are recorded in misp.etl_state (mark_written()) instead, for the training
+feature cache.
 
-limit = args.limit
-query = {}
-cursor = iocs.find(query).sort([("timestamp", -1)])
-if limit and limit > 0:
-    cursor = cursor.limit(limit)
+For continuous processing within seconds of an import, see etl_stream.py.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient, UpdateOne, ASCENDING
+import metrics
+
+DEFAULT_BATCH_SIZE = 1000
+STATE_ID = "etl_preprocess"
+# etl_state document recording the last write that changed a target collection
+WRITTEN_PREFIX = "written:"
+DAY_MS = 24 * 3600 * 1000
+# how long an import batch may take between its flush-time stamp and the end of its write
+DEFAULT_SETTLE_SECONDS = 60
+VERIFY_PREFIX = "processed_iocs_verify_"
+# every field attribute_doc() / feature_stages() write
+MERGED_FIELDS = ["value", "ioc_type", "first_seen", "last_seen", "malware", "threat_type", "reporter",
+                 "features.has_malware", "features.confidence", "features.ioc_type", "features.threat_type",
+                 "features.seen_duration_days"]
 
-ops = []
-count = 0
-now = datetime.now(timezone.utc)
 
 def to_dt(x):
     if not x:
@@ -37,61 +68,458 @@ def to_dt(x):
         return x
     return None
 
-for ev in cursor:
-    attrs = ev.get("Attribute", [])
-    for a in attrs:
-        ioc_type = a.get("type") or "unknown"
-        threat_type = a.get("threat_type") or "unknown"
-
+# Ensure both are timezone-aware (UTC)
+def make_aware(dt):
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
 
-        first_seen = to_dt(a.get("first_seen") or a.get("first_seen_utc"))
-        last_seen = to_dt(a.get("last_seen") or a.get("last_seen_utc"))
 
-        # Ensure both are timezone-aware (UTC)
-        def make_aware(dt):
-            if dt is None:
-                return None
-            if dt.tzinfo is None:
-                return dt.replace(tzinfo=timezone.utc)
-            return dt
+def attribute_doc(a):
+    """Build the processed_iocs document for one event Attribute."""
+    ioc_type = a.get("type") or "unknown"
+    threat_type = a.get("threat_type") or "unknown"
 
+    first_seen = to_dt(a.get("first_seen") or a.get("first_seen_utc"))
+    last_seen = to_dt(a.get("last_seen") or a.get("last_seen_utc"))
 
     first_seen_aware = make_aware(first_seen)
     last_seen_aware = make_aware(last_seen)
-    now_aware = make_aware(now)
-    days_since_first_seen = (now_aware - first_seen_aware).days if first_seen_aware else None
-    days_since_last_seen = (now_aware - last_seen_aware).days if last_seen_aware else days_since_first_seen
     seen_duration_days = (last_seen_aware - first_seen_aware).days if first_seen_aware and last_seen_aware else None
 
     features = {
-            "has_malware": 1 if a.get("malware") else 0,
-            "confidence": a.get("confidence_level") or 0,
-            "ioc_type": ioc_type.lower(),
-            "threat_type": threat_type.lower(),
-            "days_since_first_seen": days_since_first_seen,
-            "days_since_last_seen": days_since_last_seen,
-            "seen_duration_days": seen_duration_days
-        }
-    
-    doc = {
-            "value": a.get("value"),
-            "ioc_type": ioc_type,
-            "first_seen": first_seen,
-            "last_seen": last_seen,
-            "malware": a.get("malware"),
-            "threat_type": threat_type,
-            "reporter": a.get("reporter"),
-            "features": features,
-            "updated_at": now
-        }
-    
-    ops.append(UpdateOne({"value": a.get("value"), "ioc_type": ioc_type}, {"$set": doc}, upsert=True))
-    count += 1
-
-if ops:
-    res = processed.bulk_write(ops)
-    print(f"Processed upserts: matched={res.matched_count}, upserted={len(res.upserted_ids)}")
-else:
-    print("No attributes found to process.")
-
-print(f"Done. Processed {count} attributes.")
+        "has_malware": 1 if a.get("malware") else 0,
+        "confidence": a.get("confidence_level") or 0,
+        "ioc_type": ioc_type.lower(),
+        "threat_type": threat_type.lower(),
+        "seen_duration_days": seen_duration_days
+    }
+
+    return {
+        "value": a.get("value"),
+        "ioc_type": ioc_type,
+        "first_seen": first_seen,
+        "last_seen": last_seen,
+        "malware": a.get("malware"),
+        "threat_type": threat_type,
+        "reporter": a.get("reporter"),
+        "features": features
+    }
+
+
+def upsert_op(doc):
+    return UpdateOne({"value": doc["value"], "ioc_type": doc["ioc_type"]}, {"$set": doc}, upsert=True)
+
+
+def load_watermark(state):
+    return state.find_one({"_id": STATE_ID}) or {}
+
+
+def save_watermark(state, event, now):
+    state.update_one(
+        {"_id": STATE_ID},
+        {"$set": {"timestamp": event.get("timestamp"), "threatfox_id": event.get("threatfox_id"), "updated_at": now}},
+        upsert=True,
+    )
+
+
+def incremental_query(wm, before=None):
+    """Events past the watermark, and (if given) stamped before `before`."""
+    clauses = []
+    if wm.get("timestamp") is not None:
+        clauses.append({"$or": [
+            {"timestamp": {"$gt": wm["timestamp"]}},
+            {"timestamp": wm["timestamp"], "threatfox_id": {"$gt": wm.get("threatfox_id")}},
+        ]})
+    if before is not None:
+        clauses.append({"timestamp": {"$lt": before}})
+    if len(clauses) > 1:
+        return {"$and": clauses}
+    return clauses[0] if clauses else {}
+
+
+def settled_before(now, settle):
+    # event timestamps are naive UTC
+    return (now - timedelta(seconds=settle)).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------------------
+# Aggregation engine
+# ---------------------------
+def _truthy(expr):
+    # Python truthiness: unlike $cond, "" counts as false
+    return {"$not": [{"$in": [{"$ifNull": [expr, None]}, [None, "", 0, False]]}]}
+
+
+def _or(expr, default):
+    """Server-side equivalent of Python's `expr or default`."""
+    return {"$cond": [_truthy(expr), expr, default]}
+
+
+def _to_date(expr):
+    """Mirror to_dt(): dates pass through, strings are parsed, anything else is null."""
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": [{"$type": expr}, "date"]}, "then": expr},
+            {"case": {"$eq": [{"$type": expr}, "string"]}, "then": {"$dateFromString": {
+                "dateString": expr, "format": "%Y-%m-%d %H:%M:%S", "timezone": "UTC",
+                "onError": {"$dateFromString": {"dateString": expr, "onError": None}},
+            }}},
+        ],
+        "default": None,
+    }}
+
+
+def _days(later, earlier):
+    # timedelta.days floors the elapsed time; $dateDiff with unit "day" counts
+    # midnight crossings instead, so floor the millisecond difference
+    return {"$cond": [
+        {"$and": [later, earlier]},
+        {"$toInt": {"$floor": {"$divide": [{"$subtract": [later, earlier]}, DAY_MS]}}},
+        None,
+    ]}
+
+
+def feature_stages():
+    """Stages after the event $match/$sort/$limit; same output as attribute_doc()."""
+    return [
+        {"$unwind": "$Attribute"},
+        {"$replaceRoot": {"newRoot": "$Attribute"}},
+        # null or missing: no key to merge on (Flusher.add() skips these too)
+        {"$match": {"value": {"$ne": None}}},
+        {"$project": {
+            "_id": 0,
+            "value": {"$ifNull": ["$value", None]},
+            "ioc_type": _or("$type", "unknown"),
+            "threat_type": _or("$threat_type", "unknown"),
+            "first_seen": _to_date(_or("$first_seen", "$first_seen_utc")),
+            "last_seen": _to_date(_or("$last_seen", "$last_seen_utc")),
+            "malware": {"$ifNull": ["$malware", None]},
+            "reporter": {"$ifNull": ["$reporter", None]},
+            "confidence": _or("$confidence_level", 0),
+        }},
+        {"$set": {
+            "seen_duration_days": _days("$last_seen", "$first_seen"),
+        }},
+        {"$project": {
+            "value": 1,
+            "ioc_type": 1,
+            "first_seen": 1,
+            "last_seen": 1,
+            "malware": 1,
+            "threat_type": 1,
+            "reporter": 1,
+            "features": {
+                "has_malware": {"$cond": [_truthy("$malware"), 1, 0]},
+                "confidence": "$confidence",
+                "ioc_type": {"$toLower": "$ioc_type"},
+                "threat_type": {"$toLower": "$threat_type"},
+                "seen_duration_days": "$seen_duration_days",
+            },
+        }},
+    ]
+
+
+def feature_pipeline(target="processed_iocs"):
+    return feature_stages() + [
+        {"$merge": {"into": target, "on": ["value", "ioc_type"], "whenMatched": "merge", "whenNotMatched": "insert"}},
+    ]
+
+
+def changed_stages(target="processed_iocs"):
+    """Stages keeping only the feature_stages() documents that would change target when merged."""
+    return [
+        {"$lookup": {
+            "from": target,
+            "let": {"value": "$value", "ioc_type": "$ioc_type"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [{"$eq": ["$value", "$$value"]}, {"$eq": ["$ioc_type", "$$ioc_type"]}]}}},
+                {"$limit": 1},
+            ],
+            "as": "current",
+        }},
+        {"$set": {"current": {"$arrayElemAt": ["$current", 0]}}},
+        {"$match": {"$expr": {"$or": [{"$ne": [f"$current.{f}", f"${f}"]} for f in MERGED_FIELDS]}}},
+    ]
+
+
+def ensure_merge_index(coll):
+    # $merge needs a unique index on its "on" fields
+    try:
+        coll.create_index([("value", ASCENDING), ("ioc_type", ASCENDING)], unique=True)
+    except Exception as e:
+        print(f"Index create warning for {coll.name}: {e}")
+
+
+def upper_bound_query(event):
+    return {"$or": [
+        {"timestamp": {"$lt": event.get("timestamp")}},
+        {"timestamp": event.get("timestamp"), "threatfox_id": {"$lte": event.get("threatfox_id")}},
+    ]}
+
+
+def last_pending_event(iocs, query, limit=0):
+    """
+    The last of the first `limit` events matching query in (timestamp,
+    threatfox_id) order, which is the last one pending when fewer match;
+    the newest one when limit is 0. None when nothing matches.
+    """
+    fields = {"timestamp": 1, "threatfox_id": 1}
+    if not limit or limit <= 0:
+        return next(iocs.find(query, fields).sort([("timestamp", -1), ("threatfox_id", -1)]).limit(1), None)
+    last_event = None
+    for last_event in iocs.find(query, fields).sort([("timestamp", 1), ("threatfox_id", 1)]).limit(limit):
+        pass
+    return last_event
+
+
+def run_aggregate(db, limit=100, incremental=False, now=None, target="processed_iocs",
+                  settle=DEFAULT_SETTLE_SECONDS):
+    """Server-side engine; returns the number of events merged."""
+    iocs = db["iocs"]
+    state = db["etl_state"]
+    now = now or datetime.now(timezone.utc)
+    ensure_merge_index(db[target])
+
+    if incremental:
+        iocs.create_index([("timestamp", ASCENDING), ("threatfox_id", ASCENDING)])
+        query = incremental_query(load_watermark(state), settled_before(now, settle))
+        # pin the last event up front so the pipeline and the watermark agree
+        last_event = last_pending_event(iocs, query, limit)
+        if last_event is None:
+            print("No attributes found to process.")
+            return 0
+        match = {"$and": [query, upper_bound_query(last_event)]} if query else upper_bound_query(last_event)
+        head = [{"$match": match}]
+    else:
+        last_event = None
+        match = {}
+        head = [{"$sort": {"timestamp": -1, "threatfox_id": -1}}]
+        if limit and limit > 0:
+            head.append({"$limit": limit})
+
+    events = iocs.count_documents(match)
+    if limit and limit > 0:
+        events = min(events, limit)
+    skipped = next(iocs.aggregate(head + [
+        {"$unwind": "$Attribute"},
+        {"$match": {"Attribute.value": None}},
+        {"$count": "attributes"},
+    ]), {}).get("attributes", 0)
+    # $merge doesn't say what it changed, so count that first
+    changed = next(iocs.aggregate(head + feature_stages() + changed_stages(target) + [{"$count": "documents"}],
+                                  allowDiskUse=True), {}).get("documents", 0)
+    iocs.aggregate(head + feature_pipeline(target), allowDiskUse=True)
+    if changed:
+        mark_written(db, target, now)
+    if last_event is not None:
+        save_watermark(state, last_event, now)
+    metrics.inc("records_total", events)
+    metrics.inc("records_skipped_total", skipped)
+    if skipped:
+        print(f"Skipped {skipped} attributes without a value")
+    print(f"Done. Merged attributes of {events} events into {target} ({changed} documents changed).")
+    return events
+
+
+class Flusher:
+    """
+    Bounded bulk upserts into processed_iocs with running totals. Docs are
+    keyed on (value, ioc_type) so the last one seen in a batch wins, which
+    keeps unordered writes deterministic.
+    """
+
+    def __init__(self, processed):
+        self.processed = processed
+        self.docs = {}
+        self.matched = 0
+        self.modified = 0
+        self.upserted = 0
+        self.skipped = 0
+
+    def add(self, doc):
+        """Queue doc; returns False (and counts it) when it has no value to key on."""
+        if doc["value"] is None:
+            self.skipped += 1
+            return False
+        key = (doc["value"], doc["ioc_type"])
+        self.docs.pop(key, None)
+        self.docs[key] = doc
+        return True
+
+    def flush(self):
+        if not self.docs:
+            return
+        metrics.observe("bulk_batch_size", len(self.docs), buckets=metrics.SIZE_BUCKETS,
+                        collection=self.processed.name)
+        res = self.processed.bulk_write([upsert_op(d) for d in self.docs.values()], ordered=False)
+        self.matched += res.matched_count
+        self.modified += res.modified_count
+        self.upserted += len(res.upserted_ids)
+        self.docs = {}
+        if res.modified_count or res.upserted_ids:
+            mark_written(self.processed.database, self.processed.name)
+
+
+def run(db, limit=100, incremental=False, batch_size=DEFAULT_BATCH_SIZE, now=None, target="processed_iocs",
+        settle=DEFAULT_SETTLE_SECONDS):
+    """Process events into processed_iocs; returns the number of attributes processed."""
+    iocs = db["iocs"]
+    processed = db[target]
+    state = db["etl_state"]
+    now = now or datetime.now(timezone.utc)
+
+    if incremental:
+        iocs.create_index([("timestamp", ASCENDING), ("threatfox_id", ASCENDING)])
+        wm = load_watermark(state)
+        cursor = iocs.find(incremental_query(wm, settled_before(now, settle))).sort([("timestamp", 1), ("threatfox_id", 1)])
+    else:
+        cursor = iocs.find({}).sort([("timestamp", -1), ("threatfox_id", -1)])
+    if limit and limit > 0:
+        cursor = cursor.limit(limit)
+
+    flusher = Flusher(processed)
+    count = 0
+    last_event = None
+    for ev in cursor:
+        for a in ev.get("Attribute", []):
+            if flusher.add(attribute_doc(a)):
+                count += 1
+        last_event = ev
+        # flush on event boundaries so the watermark never splits an event
+        if len(flusher.docs) >= batch_size:
+            flusher.flush()
+            if incremental:
+                save_watermark(state, ev, now)
+
+    flusher.flush()
+    if incremental and last_event is not None:
+        save_watermark(state, last_event, now)
+
+    metrics.inc("records_total", count)
+    metrics.inc("records_skipped_total", flusher.skipped)
+    if flusher.skipped:
+        print(f"Skipped {flusher.skipped} attributes without a value")
+    if count:
+        print(f"Processed upserts: matched={flusher.matched}, modified={flusher.modified}, "
+              f"upserted={flusher.upserted}")
+    else:
+        print("No attributes found to process.")
+    print(f"Done. Processed {count} attributes.")
+    return count
+
+
+def run_events(db, threatfox_ids, batch_size=DEFAULT_BATCH_SIZE, target="processed_iocs"):
+    """
+    Process only the given events (e.g. the ones an import just wrote) and
+    return the processed_iocs documents written, for in-process consumers.
+    The --incremental watermark is left alone; a later incremental run
+    reprocesses these events harmlessly.
+    """
+    iocs = db["iocs"]
+    flusher = Flusher(db[target])
+    written = {}
+    ids = list(threatfox_ids)
+    for start in range(0, len(ids), batch_size):
+        for ev in iocs.find({"threatfox_id": {"$in": ids[start:start + batch_size]}}, {"Attribute": 1}):
+            for a in ev.get("Attribute", []):
+                doc = attribute_doc(a)
+                if flusher.add(doc):
+                    written[(doc["value"], doc["ioc_type"])] = doc
+        flusher.flush()
+    metrics.inc("records_total", len(written))
+    print(f"Processed {len(written)} attributes of {len(ids)} changed events")
+    return list(written.values())
+
+
+def unset_recency(coll):
+    """Remove the date-dependent fields older runs materialized; returns the number of documents changed."""
+    res = coll.update_many(
+        {"$or": [{"features.days_since_first_seen": {"$exists": True}}, {"updated_at": {"$exists": True}}]},
+        {"$unset": {"features.days_since_first_seen": "", "features.days_since_last_seen": "", "updated_at": ""}},
+    )
+    print(f"Removed materialized recency fields from {res.modified_count} documents")
+    return res.modified_count
+
+
+def mark_written(db, target, now=None):
+    """
+    Record that target changed. Documents carry no updated_at, so this is
+    what feature_cache.py fingerprints to tell whether cached features are stale.
+    """
+    db["etl_state"].update_one(
+        {"_id": WRITTEN_PREFIX + target},
+        {"$set": {"updated_at": now or datetime.now(timezone.utc)}, "$inc": {"writes": 1}},
+        upsert=True,
+    )
+
+
+def verify_engines(db, limit=100):
+    """
+    Run both engines on the same events into scratch collections and return
+    the number of differing documents.
+    """
+    names = {engine: VERIFY_PREFIX + engine for engine in ("python", "aggregate")}
+    for name in names.values():
+        db[name].drop()
+    run(db, limit, target=names["python"])
+    run_aggregate(db, limit, target=names["aggregate"])
+
+    def docs(name):
+        return {(d["value"], d["ioc_type"]): d for d in db[name].find({}, {"_id": 0})}
+    py_docs, agg_docs = docs(names["python"]), docs(names["aggregate"])
+    diffs = 0
+    for key in py_docs.keys() | agg_docs.keys():
+        if py_docs.get(key) != agg_docs.get(key):
+            diffs += 1
+            if diffs <= 5:
+                print(f"Mismatch for {key}:\n  python:    {py_docs.get(key)}\n  aggregate: {agg_docs.get(key)}")
+    print(f"Verify: {len(py_docs)} python docs, {len(agg_docs)} aggregate docs, {diffs} differ")
+    for name in names.values():
+        db[name].drop()
+    db["etl_state"].delete_many({"_id": {"$in": [WRITTEN_PREFIX + n for n in names.values()]}})
+    return diffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Number of events to process (0 = all; default 100, or all with --incremental)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process events past the stored watermark")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Attribute upserts per bulk_write")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="With --incremental, leave events written in the last N seconds for the next run")
+    parser.add_argument("--engine", choices=("python", "aggregate"), default="python",
+                        help="Compute features client-side or in a server-side aggregation")
+    parser.add_argument("--verify", action="store_true",
+                        help="Compare both engines on --limit events instead of writing processed_iocs")
+    parser.add_argument("--unset-recency", action="store_true",
+                        help="Drop days_since_* / updated_at stored by older runs, then exit")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+
+    limit = args.limit
+    if limit is None:
+        limit = 0 if args.incremental else 100
+
+    client = MongoClient("mongodb://localhost:27017/")
+    db = client["misp"]
+    if args.verify:
+        raise SystemExit(1 if verify_engines(db, limit) else 0)
+    if args.unset_recency:
+        unset_recency(db["processed_iocs"])
+        return
+    with metrics.stage("etl"):
+        if args.engine == "aggregate":
+            run_aggregate(db, limit, args.incremental, settle=args.settle)
+        else:
+            run(db, limit, args.incremental, args.batch_size, settle=args.settle)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Near-real-time ETL: tail a change stream on misp.iocs into processed_iocs.
+
+etl_preprocess.py is a batch job; this consumer runs continuously and turns
+every inserted, replaced or updated event into processed_iocs documents
+within seconds. Updates are only processed when they touch Attribute (the
+importer writes an event only when its content changes, so in practice
+that is every update).
+
+Changes are buffered and written as one unordered bulk upsert once
+--batch-size attributes are pending or the oldest pending change is
+--max-latency seconds old. After each write the change stream's resume
+token is saved in misp.etl_state, so a restarted consumer continues after
+the last written batch; changes between that batch and a crash are seen
+again, and since writes are upserts keyed on (value, ioc_type) replaying
+them is harmless.
+
+On the first start (no saved token), or when the saved token has fallen
+off the oplog, the stream is opened first and then an incremental batch
+run (etl_preprocess.run(incremental=True)) catches up, so nothing written
+in between is missed.
+
+Change streams need a replica set; a single node is enough:
+  mongod --replSet rs0 --dbpath /tmp/rs0 &
+  mongosh --eval 'rs.initiate()'
+
+Run:
+  python3 etl_stream.py
+  python3 etl_stream.py --batch-size 500 --max-latency 0.5
+  python3 etl_stream.py --mongo-uri "mongodb://localhost:27017/?replicaSet=rs0" --metrics etl_stream.prom
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from etl_preprocess import Flusher, attribute_doc, run
+import metrics
+
+STATE_ID = "etl_stream"
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_LATENCY = 1.0
+# server-side wait per getMore; bounds how late a time-based flush can be
+POLL_MS = 200
+# ChangeStreamHistoryLost, ChangeStreamFatalError: the token is no longer in the oplog
+HISTORY_LOST_CODES = (280, 286)
+WATCH_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+
+
+def touches_attributes(change):
+    if change["operationType"] != "update":
+        return True
+    desc = change.get("updateDescription") or {}
+    fields = list(desc.get("updatedFields") or {}) + list(desc.get("removedFields") or [])
+    return any(f == "Attribute" or f.startswith("Attribute.") for f in fields)
+
+
+def change_time(change):
+    """When the change was written (wallTime on MongoDB 6+, else the cluster time, to the second)."""
+    if change.get("wallTime"):
+        return change["wallTime"].replace(tzinfo=timezone.utc).timestamp()
+    return change["clusterTime"].time
+
+
+class StreamConsumer:
+    def __init__(self, db, batch_size=DEFAULT_BATCH_SIZE, max_latency=DEFAULT_MAX_LATENCY,
+                 target="processed_iocs"):
+        self.db = db
+        self.state = db["etl_state"]
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.flusher = Flusher(db[target])
+        # wall time of each pending change, for the latency histogram
+        self.pending_times = []
+        self.oldest = None
+        self.saved_token = None
+        self.events = 0
+        self.attributes = 0
+
+    def load_token(self):
+        self.saved_token = (self.state.find_one({"_id": STATE_ID}) or {}).get("resume_token")
+        return self.saved_token
+
+    def save_token(self, token):
+        self.state.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"resume_token": token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def clear_token(self):
+        self.state.delete_one({"_id": STATE_ID})
+        self.saved_token = None
+
+    def add(self, change):
+        event = change.get("fullDocument")
+        if event is None or not touches_attributes(change):
+            return
+        for a in event.get("Attribute", []):
+            self.flusher.add(attribute_doc(a))
+        self.pending_times.append(change_time(change))
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        self.events += 1
+
+    def due(self):
+        if not self.flusher.docs:
+            return False
+        return (len(self.flusher.docs) >= self.batch_size
+                or time.monotonic() - self.oldest >= self.max_latency)
+
+    def flush(self, token):
+        """Write the pending documents, then persist the token they were read up to."""
+        count = len(self.flusher.docs)
+        if count:
+            self.flusher.flush()
+            done = time.time()
+            for written_at in self.pending_times:
+                metrics.observe("etl_stream_latency_seconds", max(0.0, done - written_at))
+            metrics.inc("records_total", count)
+            self.attributes += count
+            print(f"Wrote {count} attributes of {len(self.pending_times)} events "
+                  f"(lag {done - self.pending_times[0]:.2f}s)")
+        self.pending_times = []
+        self.oldest = None
+        if token is not None and token != self.saved_token:
+            self.save_token(token)
+            self.saved_token = token
+        if count:
+            metrics.write()
+
+    def catch_up(self):
+        print("No usable resume token: catching up with an incremental batch run")
+        # no settle delay: writes still in flight land after the stream opened, so it sees them
+        run(self.db, 0, incremental=True, batch_size=self.batch_size, settle=0)
+
+    def open_stream(self):
+        token = self.load_token()
+        stream = self.db["iocs"].watch(WATCH_PIPELINE, full_document="updateLookup", resume_after=token,
+                                       max_await_time_ms=POLL_MS, batch_size=self.batch_size)
+        if token is None:
+            # the stream is already open, so changes made during the catch-up are seen too
+            self.catch_up()
+        return stream
+
+    def run(self, stop=None):
+        """Consume changes until interrupted (or until stop() returns True)."""
+        while True:
+            try:
+                with self.open_stream() as stream:
+                    print("Watching misp.iocs for changes")
+                    try:
+                        while stream.alive and not (stop and stop()):
+                            change = stream.try_next()
+                            if change is not None:
+                                self.add(change)
+                            if self.due() or (change is None and not self.flusher.docs):
+                                # idle: still advance the token past changes we filtered out
+                                self.flush(stream.resume_token)
+                    finally:
+                        # every change up to resume_token has been added, so this is consistent
+                        self.flush(stream.resume_token)
+                    return
+            except OperationFailure as e:
+                if e.code not in HISTORY_LOST_CODES:
+                    raise
+                print(f"Resume token no longer in the oplog ({e}); starting over")
+                self.flusher.docs = {}
+                self.pending_times = []
+                self.oldest = None
+                self.clear_token()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Write once this many attributes are pending")
+    parser.add_argument("--max-latency", type=float, default=DEFAULT_MAX_LATENCY,
+                        help="Write once the oldest pending change is this many seconds old")
+    parser.add_argument("--reset", action="store_true", help="Forget the saved resume token and catch up again")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+
+    client = MongoClient(args.mongo_uri)
+    consumer = StreamConsumer(client["misp"], args.batch_size, args.max_latency)
+    if args.reset:
+        consumer.clear_token()
+    try:
+        with metrics.stage("etl_stream"):
+            consumer.run()
+    except KeyboardInterrupt:
+        print(f"Stopped after {consumer.events} events, {consumer.attributes} attributes")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,38 +2,94 @@
 Export all documents from misp.processed_iocs to CSV for ML model training.
 Usage:
   python3 export_processed_to_csv.py
+  python3 export_processed_to_csv.py --format parquet
+  python3 export_processed_to_csv.py --metrics export.prom
 Output:
-  processed_iocs.csv in the current directory
+  processed_iocs.csv (or processed_iocs.parquet) in the current directory
+
+features.days_since_first_seen is not stored; it is computed from
+first_seen for each batch as of the start of the export (see recency.py).
 """
+import argparse
 import csv
 from pymongo import MongoClient
+from ioc_loader import iter_batches, frame_from_docs
+from recency import add_recency, utc_now
+import metrics
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["misp"]
-coll = db["processed_iocs"]
+DEFAULT_BATCH_SIZE = 50000
 
 fields = [
   "value", "ioc_type", "first_seen", "last_seen", "malware", "threat_type", "reporter",
   "features.confidence", "features.has_malware", "features.ioc_type", "features.threat_type", "features.days_since_first_seen"
 ]
+# the export columns are the projection (only these fields leave the server), minus the derived one
+SOURCE_FIELDS = [f for f in fields if f != "features.days_since_first_seen"]
+
+
+def row_for(doc, days_since_first_seen):
+    return [
+        doc.get("value"),
+        doc.get("ioc_type"),
+        doc.get("first_seen"),
+        doc.get("last_seen"),
+        doc.get("malware"),
+        doc.get("threat_type"),
+        doc.get("reporter"),
+        doc.get("features", {}).get("confidence"),
+        doc.get("features", {}).get("has_malware"),
+        doc.get("features", {}).get("ioc_type"),
+        doc.get("features", {}).get("threat_type"),
+        days_since_first_seen,
+    ]
+
+
+def iter_row_batches(coll, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    now = utc_now(now)
+    for docs in iter_batches(coll, SOURCE_FIELDS, batch_size):
+        metrics.inc("records_total", len(docs))
+        days = add_recency(frame_from_docs(docs, ["first_seen", "last_seen"]), now)["features.days_since_first_seen"]
+        yield [row_for(doc, d) for doc, d in zip(docs, days.tolist())]
+
+
+def export_csv(coll, path, batch_size=DEFAULT_BATCH_SIZE):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for rows in iter_row_batches(coll, batch_size):
+            writer.writerows(rows)
+
+
+def export_parquet(coll, path, batch_size=DEFAULT_BATCH_SIZE):
+    from parquet_export import PROCESSED_SCHEMA, ParquetBatchWriter
+
+    with ParquetBatchWriter(path, PROCESSED_SCHEMA) as writer:
+        for rows in iter_row_batches(coll, batch_size):
+            writer.write_rows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--output", default=None, help="Output path (default processed_iocs.<format>)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Rows per write (one Parquet row group each)")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+    output = args.output or f"processed_iocs.{args.format}"
+
+    client = MongoClient("mongodb://localhost:27017/")
+    db = client["misp"]
+    coll = db["processed_iocs"]
+
+    with metrics.stage("export"):
+        if args.format == "parquet":
+            export_parquet(coll, output, args.batch_size)
+        else:
+            export_csv(coll, output, args.batch_size)
+    print(f"Exported processed_iocs to {output}")
+
 
-with open("processed_iocs.csv", "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(fields)
-    for doc in coll.find({}):
-        row = [
-            doc.get("value"),
-            doc.get("ioc_type"),
-            doc.get("first_seen"),
-            doc.get("last_seen"),
-            doc.get("malware"),
-            doc.get("threat_type"),
-            doc.get("reporter"),
-            doc.get("features", {}).get("confidence"),
-            doc.get("features", {}).get("has_malware"),
-            doc.get("features", {}).get("ioc_type"),
-            doc.get("features", {}).get("threat_type"),
-            doc.get("features", {}).get("days_since_first_seen"),
-        ]
-        writer.writerow(row)
-print("Exported processed_iocs to processed_iocs.csv")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Versioned on-disk cache of the feature matrices the training scripts build.
+
+An entry holds what a script derived from its source data: NumPy arrays,
+SciPy CSR matrices and a few small fitted objects such as the encoder. It
+is stored under <cache dir>/<name>/<key>/, where key hashes the dataset
+fingerprint:
+ - the source: processed_iocs' document count and its last ETL write
+   (see etl_preprocess.mark_written()), or an input file's size and mtime
+ - the feature code version: a hash of the modules that compute the
+   features plus the script's own FEATURES_VERSION
+
+Arrays are saved as .npy files and opened memory-mapped, so loading an
+entry takes milliseconds whatever its size and pages are only read as the
+model touches them. Entries are written chunk by chunk (store_chunks()),
+so building one never needs the dataset in memory, into a temporary
+directory renamed into place, so an interrupted run never leaves half an
+entry.
+After every store, entries of the same name beyond the --cache-keep most
+recently used are deleted.
+
+Run:
+  python3 feature_cache.py list
+  python3 feature_cache.py clear
+  python3 feature_cache.py clear --name baseline
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+import joblib
+import numpy as np
+import scipy.sparse as sp
+
+CACHE_DIR = os.path.join("cache", "features")
+DEFAULT_KEEP = 3
+META_FILE = "meta.json"
+OBJECTS_FILE = "objects.joblib"
+CSR_PARTS = ("data", "indices", "indptr")
+
+
+def code_version(*modules, version=None):
+    """Hash of the given modules' source files (and an explicit version tag)."""
+    h = hashlib.sha1(str(version).encode())
+    for module in modules:
+        with open(module.__file__, "rb") as fh:
+            h.update(fh.read())
+    return h.hexdigest()[:16]
+
+
+def mongo_fingerprint(coll):
+    """Document count and last recorded ETL write of a processed_iocs-like collection."""
+    from etl_preprocess import WRITTEN_PREFIX
+
+    written = coll.database["etl_state"].find_one({"_id": WRITTEN_PREFIX + coll.name}) or {}
+    return {
+        "source": f"mongodb:{coll.database.name}.{coll.name}",
+        "count": coll.estimated_document_count(),
+        "written_at": str(written.get("updated_at")),
+        "writes": written.get("writes", 0),
+    }
+
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return {"source": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def fingerprint_key(fingerprint):
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class ArrayAppender:
+    """
+    A .npy file grown row block by row block. The header is written last,
+    into space reserved at the start, once the final shape is known.
+    """
+
+    HEADER_SIZE = 256
+
+    def __init__(self, path):
+        self.fh = open(path, "wb")
+        self.fh.write(b"\0" * self.HEADER_SIZE)
+        self.dtype = None
+        self.tail = ()
+        self.rows = 0
+
+    def append(self, arr):
+        arr = np.ascontiguousarray(arr)
+        if self.dtype is None:
+            self.dtype, self.tail = arr.dtype, arr.shape[1:]
+        elif arr.dtype != self.dtype or arr.shape[1:] != self.tail:
+            raise ValueError(f"{self.fh.name}: chunk of {arr.dtype}{arr.shape} after {self.dtype}(n, *{self.tail})")
+        self.fh.write(arr.tobytes())
+        self.rows += len(arr)
+
+    def close(self):
+        if self.fh.closed:
+            return {"kind": "dense"}
+        header = repr({
+            "descr": np.lib.format.dtype_to_descr(self.dtype if self.dtype is not None else np.dtype("float64")),
+            "fortran_order": False,
+            "shape": (self.rows,) + self.tail,
+        })
+        prefix = np.lib.format.MAGIC_PREFIX + b"\x01\x00"
+        size = self.HEADER_SIZE - len(prefix) - 2
+        self.fh.seek(0)
+        self.fh.write(prefix + size.to_bytes(2, "little") + header.ljust(size - 1).encode("latin-1") + b"\n")
+        self.fh.close()
+        return {"kind": "dense"}
+
+
+class CsrAppender:
+    """A CSR matrix grown row block by row block, as data / indices / indptr .npy files."""
+
+    def __init__(self, directory, key):
+        self.parts = {p: ArrayAppender(os.path.join(directory, f"{key}.{p}.npy")) for p in CSR_PARTS}
+        self.parts["indptr"].append(np.zeros(1, dtype=np.int64))
+        self.nnz = 0
+        self.shape = None
+
+    def append(self, m):
+        m.sort_indices()
+        if self.shape is None:
+            self.shape = [0, m.shape[1]]
+        elif m.shape[1] != self.shape[1]:
+            raise ValueError(f"CSR chunk with {m.shape[1]} columns after {self.shape[1]}")
+        self.parts["data"].append(m.data)
+        self.parts["indices"].append(m.indices.astype(np.int64))
+        self.parts["indptr"].append(m.indptr[1:].astype(np.int64) + self.nnz)
+        self.nnz += m.nnz
+        self.shape[0] += m.shape[0]
+
+    def close(self):
+        for part in self.parts.values():
+            part.close()
+        return {"kind": "csr", "shape": self.shape or [0, 0]}
+
+
+class FeatureCache:
+    def __init__(self, root=CACHE_DIR, keep=DEFAULT_KEEP):
+        # cached() hands back the stored entry, so it has to survive its own store
+        if keep < 1:
+            raise ValueError(f"keep must be at least 1, not {keep}")
+        self.root = root
+        self.keep = keep
+
+    def entry_dir(self, name, fingerprint):
+        return os.path.join(self.root, name, fingerprint_key(fingerprint))
+
+    def load(self, name, fingerprint):
+        """The stored entry as a dict (arrays memory-mapped), or None on a miss."""
+        path = self.entry_dir(name, fingerprint)
+        meta_path = os.path.join(path, META_FILE)
+        try:
+            with open(meta_path, encoding="utf-8") as fh:
+                meta = json.load(fh)
+        except FileNotFoundError:
+            return None
+        if meta["fingerprint"] != json.loads(json.dumps(fingerprint, default=str)):
+            return None
+        entry = {}
+        for key, info in meta["arrays"].items():
+            if info["kind"] == "csr":
+                parts = [np.load(os.path.join(path, f"{key}.{p}.npy"), mmap_mode="r") for p in CSR_PARTS]
+                entry[key] = sp.csr_matrix(tuple(parts), shape=tuple(info["shape"]), copy=False)
+            else:
+                entry[key] = np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r")
+        if meta["objects"]:
+            entry.update(joblib.load(os.path.join(path, OBJECTS_FILE)))
+        # the meta file's mtime is the entry's last use, for eviction
+        os.utime(meta_path)
+        return entry
+
+    def store(self, name, fingerprint, entry):
+        """Write entry (name -> array, CSR matrix or any picklable object) and evict old entries."""
+        return self.store_chunks(name, fingerprint, [entry])
+
+    def store_chunks(self, name, fingerprint, chunks):
+        """
+        Write an entry from an iterable of row chunks (dicts shaped like an
+        entry), appending each to the files as it arrives, so the entry never
+        has to fit in memory. Arrays and CSR matrices are concatenated by
+        rows; other values are taken from the last chunk.
+        """
+        path = self.entry_dir(name, fingerprint)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp)
+        writers, objects = {}, {}
+        try:
+            for chunk in chunks:
+                for key, value in chunk.items():
+                    if sp.issparse(value):
+                        writers.setdefault(key, CsrAppender(tmp, key)).append(sp.csr_matrix(value))
+                    elif isinstance(value, np.ndarray) and value.dtype != object:
+                        writers.setdefault(key, ArrayAppender(os.path.join(tmp, f"{key}.npy"))).append(value)
+                    else:
+                        objects[key] = value
+            arrays = {key: writer.close() for key, writer in writers.items()}
+        except BaseException:
+            for writer in writers.values():
+                writer.close()
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        if objects:
+            joblib.dump(objects, os.path.join(tmp, OBJECTS_FILE))
+        meta = {
+            "name": name,
+            "fingerprint": fingerprint,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "arrays": arrays,
+            "objects": sorted(objects),
+        }
+        with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, indent=1, default=str)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        self.evict(name, keep_path=path)
+        return path
+
+    def entries(self, name=None):
+        """(name, path, last used, bytes) of every stored entry, most recently used first."""
+        names = [name] if name else sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        found = []
+        for n in names:
+            base = os.path.join(self.root, n)
+            if not os.path.isdir(base):
+                continue
+            for key in os.listdir(base):
+                path = os.path.join(base, key)
+                meta_path = os.path.join(path, META_FILE)
+                if key.endswith(".tmp") or not os.path.exists(meta_path):
+                    continue
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                found.append((n, path, os.path.getmtime(meta_path), size))
+        return sorted(found, key=lambda e: e[2], reverse=True)
+
+    def evict(self, name, keep_path=None):
+        for _, path, _, _ in self.entries(name)[self.keep:]:
+            if path == keep_path:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"Evicted feature cache entry {path}")
+
+    def clear(self, name=None):
+        for _, path, _, _ in self.entries(name):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def cached(cache, name, fingerprint, build):
+    """cache.load() or, on a miss, build() stored for next time; build() alone when cache is None."""
+    if cache is None:
+        return build()
+    return cached_chunks(cache, name, fingerprint, lambda: [build()])
+
+
+def cached_chunks(cache, name, fingerprint, chunks):
+    """
+    cache.load() or, on a miss, the entry written chunk by chunk from
+    chunks() (see FeatureCache.store_chunks()) and loaded back memory-mapped.
+    """
+    start = time.perf_counter()
+    entry = cache.load(name, fingerprint)
+    if entry is not None:
+        print(f"Feature cache hit for {name} ({time.perf_counter() - start:.3f}s)")
+        return entry
+    path = cache.store_chunks(name, fingerprint, chunks())
+    print(f"Stored {name} features in {path}")
+    # hand back the memory-mapped copy so a first run behaves like later ones
+    return cache.load(name, fingerprint)
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+def add_arguments(parser):
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Feature matrix cache directory")
+    parser.add_argument("--cache-keep", type=positive_int, default=DEFAULT_KEEP,
+                        help="Cached datasets kept per script (least recently used are evicted)")
+    parser.add_argument("--no-cache", action="store_true", help="Rebuild the features and don't cache them")
+
+
+def from_args(args):
+    return None if args.no_cache else FeatureCache(args.cache_dir, args.cache_keep)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("list", "clear"))
+    parser.add_argument("--name", default=None, help="Only entries of this script (baseline, advanced)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    cache = FeatureCache(args.cache_dir)
+    if args.command == "clear":
+        cache.clear(args.name)
+        print(f"Cleared {args.name or 'all'} feature cache entries in {args.cache_dir}")
+        return
+    for name, path, used, size in cache.entries(args.name):
+        used = datetime.fromtimestamp(used, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{name:10} {size / 1e6:10.1f} MB  last used {used}  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,46 @@ Advanced feature extraction from MongoDB for ML model training.
 Reads from misp.processed_iocs and outputs a rich CSV for ML.
 Usage:
   python3 feature_extraction_advanced.py
+  python3 feature_extraction_advanced.py --engine columnar --batch-size 50000
+  python3 feature_extraction_advanced.py --engine columnar --format parquet
+  python3 feature_extraction_advanced.py --engine columnar --metrics features.prom
 Output:
-  processed_iocs_advanced.csv
+  processed_iocs_advanced.csv (or processed_iocs_advanced.parquet)
+
+The default row engine calls domain_features()/ip_features() per document.
+The columnar engine loads --batch-size documents at a time into pandas
+columns and computes the same features with vectorized string operations;
+the output file is identical. Both treat a missing or null value /
+ioc_type as "".
+
+days_since_first_seen / days_since_last_seen are computed from first_seen /
+last_seen as of the start of the run (see recency.py); processed_iocs only
+stores time-invariant features.
 """
+import argparse
 import csv
 import re
+import pandas as pd
 from pymongo import MongoClient
+from ioc_loader import iter_batches, iter_documents
+from recency import RECENCY_FIELDS, add_recency, days_since, utc_now
+import metrics
+
+OUTPUT_BASENAME = "processed_iocs_advanced"
+DEFAULT_BATCH_SIZE = 50000
+
+fields = [
+    "value", "ioc_type", "first_seen", "last_seen", "malware", "threat_type", "reporter",
+    "features.confidence", "features.has_malware", "features.ioc_type", "features.threat_type",
+    "features.days_since_first_seen", "features.days_since_last_seen", "features.seen_duration_days",
+    "domain_tld", "domain_length", "domain_digits", "domain_hyphens", "ip_octets", "ip_port"
+]
+DOC_FIELDS = ["value", "ioc_type", "first_seen", "last_seen", "malware", "threat_type", "reporter"]
+FEATURE_FIELDS = ["confidence", "has_malware", "ioc_type", "threat_type",
+                  "days_since_first_seen", "days_since_last_seen", "seen_duration_days"]
+STORED_FEATURE_FIELDS = [f for f in FEATURE_FIELDS if f not in RECENCY_FIELDS]
+# fields read from processed_iocs; everything else in `fields` is computed here
+SOURCE_FIELDS = DOC_FIELDS + ["features." + f for f in STORED_FEATURE_FIELDS]
 
 def domain_features(domain):
     # Example: extract TLD, length, digit count, hyphen count
@@ -27,51 +61,155 @@ def ip_features(ip):
         port = port_part
     return len(octets), port
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["misp"]
-coll = db["processed_iocs"]
 
-fields = [
-    "value", "ioc_type", "first_seen", "last_seen", "malware", "threat_type", "reporter",
-    "features.confidence", "features.has_malware", "features.ioc_type", "features.threat_type",
-    "features.days_since_first_seen", "features.days_since_last_seen", "features.seen_duration_days",
-    "domain_tld", "domain_length", "domain_digits", "domain_hyphens", "ip_octets", "ip_port"
-]
+def row_for(doc, now):
+    # missing and null alike are "" (as in the columnar engine)
+    value = doc.get("value") or ""
+    ioc_type = doc.get("ioc_type") or ""
+    # Domain features
+    domain_tld, domain_length, domain_digits, domain_hyphens = ("", "", "", "")
+    ip_octets, ip_port = ("", "")
+    if ioc_type == "domain":
+        domain_tld, domain_length, domain_digits, domain_hyphens = domain_features(value)
+    elif ioc_type == "ip":
+        ip_octets, ip_port = ip_features(value)
+    days_since_first_seen, days_since_last_seen = days_since(doc, now)
+    return [
+        value,
+        ioc_type,
+        doc.get("first_seen"),
+        doc.get("last_seen"),
+        doc.get("malware"),
+        doc.get("threat_type"),
+        doc.get("reporter"),
+        doc.get("features", {}).get("confidence"),
+        doc.get("features", {}).get("has_malware"),
+        doc.get("features", {}).get("ioc_type"),
+        doc.get("features", {}).get("threat_type"),
+        days_since_first_seen,
+        days_since_last_seen,
+        doc.get("features", {}).get("seen_duration_days"),
+        domain_tld,
+        domain_length,
+        domain_digits,
+        domain_hyphens,
+        ip_octets,
+        ip_port
+    ]
+
+
+def extract_rows(coll, writer, now=None):
+    now = utc_now(now)
+    count = 0
+    for doc in iter_documents(coll, SOURCE_FIELDS):
+        writer.writerow(row_for(doc, now))
+        count += 1
+    return count
+
+
+def extract_rows_parquet(coll, writer, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    now = utc_now(now)
+    for docs in iter_batches(coll, SOURCE_FIELDS, batch_size):
+        writer.write_rows([row_for(doc, now) for doc in docs])
+    return writer.rows
+
+
+# ---------------------------
+# Columnar engine
+# ---------------------------
+def frame_from_docs(docs, now=None):
+    """Columns of one batch of processed_iocs documents as an object-dtype DataFrame, recency included."""
+    columns = {f: [d.get(f) for d in docs] for f in DOC_FIELDS}
+    columns["value"] = [d.get("value") or "" for d in docs]
+    columns["ioc_type"] = [d.get("ioc_type") or "" for d in docs]
+    feats = [d.get("features", {}) for d in docs]
+    for f in STORED_FEATURE_FIELDS:
+        columns["features." + f] = [x.get(f) for x in feats]
+    df = pd.DataFrame({k: pd.Series(v, dtype=object) for k, v in columns.items()})
+    return add_recency(df, now)
+
+
+def columnar_features(df):
+    """Vectorized domain_features()/ip_features() over a batch; adds the feature columns."""
+    n = len(df)
+    for col in ("domain_tld", "domain_length", "domain_digits", "domain_hyphens", "ip_octets", "ip_port"):
+        df[col] = pd.Series([""] * n, index=df.index, dtype=object)
+
+    is_domain = df["ioc_type"] == "domain"
+    if is_domain.any():
+        # fillna first: astype(str) would turn a null into "None"
+        dom = df.loc[is_domain, "value"].fillna("").astype(str)
+        has_dot = dom.str.contains(".", regex=False)
+        df.loc[is_domain, "domain_tld"] = dom.str.rpartition(".")[2].where(has_dot, "")
+        df.loc[is_domain, "domain_length"] = dom.str.len()
+        df.loc[is_domain, "domain_digits"] = dom.str.count(r"\d")
+        df.loc[is_domain, "domain_hyphens"] = dom.str.count("-")
+
+    is_ip = df["ioc_type"] == "ip"
+    if is_ip.any():
+        ip = df.loc[is_ip, "value"].fillna("").astype(str)
+        has_port = ip.str.contains(":", regex=False)
+        df.loc[is_ip, "ip_octets"] = ip.str.count(r"\.") + 1
+        df.loc[is_ip, "ip_port"] = ip.str.partition(":")[2].where(has_port, "")
+    return df
+
+
+def extract_columnar(coll, writer, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    now = utc_now(now)
+    count = 0
+    for docs in iter_batches(coll, SOURCE_FIELDS, batch_size):
+        df = columnar_features(frame_from_docs(docs, now))
+        # tolist() hands csv plain Python objects, so cells format exactly as the row engine's
+        writer.writerows(zip(*(df[f].tolist() for f in fields)))
+        count += len(df)
+    return count
+
+
+def extract_columnar_parquet(coll, writer, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    now = utc_now(now)
+    for docs in iter_batches(coll, SOURCE_FIELDS, batch_size):
+        df = columnar_features(frame_from_docs(docs, now))
+        writer.write_columns({f: df[f].tolist() for f in fields})
+    return writer.rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=("row", "columnar"), default="row",
+                        help="Per-document Python loop or vectorized pandas batches")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Documents per batch (one Parquet row group each)")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--output", default=None, help=f"Output path (default {OUTPUT_BASENAME}.<format>)")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+    output = args.output or f"{OUTPUT_BASENAME}.{args.format}"
+
+    client = MongoClient("mongodb://localhost:27017/")
+    db = client["misp"]
+    coll = db["processed_iocs"]
+
+    with metrics.stage("features"):
+        if args.format == "parquet":
+            from parquet_export import ADVANCED_SCHEMA, ParquetBatchWriter
+
+            with ParquetBatchWriter(output, ADVANCED_SCHEMA) as writer:
+                if args.engine == "columnar":
+                    count = extract_columnar_parquet(coll, writer, args.batch_size)
+                else:
+                    count = extract_rows_parquet(coll, writer, args.batch_size)
+        else:
+            with open(output, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                if args.engine == "columnar":
+                    count = extract_columnar(coll, writer, args.batch_size)
+                else:
+                    count = extract_rows(coll, writer)
+        metrics.inc("records_total", count)
+    print(f"Exported advanced features to {output}")
+
 
-with open("processed_iocs_advanced.csv", "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(fields)
-    for doc in coll.find({}):
-        value = doc.get("value", "")
-        ioc_type = doc.get("ioc_type", "")
-        # Domain features
-        domain_tld, domain_length, domain_digits, domain_hyphens = ("", "", "", "")
-        ip_octets, ip_port = ("", "")
-        if ioc_type == "domain":
-            domain_tld, domain_length, domain_digits, domain_hyphens = domain_features(value)
-        elif ioc_type == "ip":
-            ip_octets, ip_port = ip_features(value)
-        row = [
-            value,
-            ioc_type,
-            doc.get("first_seen"),
-            doc.get("last_seen"),
-            doc.get("malware"),
-            doc.get("threat_type"),
-            doc.get("reporter"),
-            doc.get("features", {}).get("confidence"),
-            doc.get("features", {}).get("has_malware"),
-            doc.get("features", {}).get("ioc_type"),
-            doc.get("features", {}).get("threat_type"),
-            doc.get("features", {}).get("days_since_first_seen"),
-            doc.get("features", {}).get("days_since_last_seen"),
-            doc.get("features", {}).get("seen_duration_days"),
-            domain_tld,
-            domain_length,
-            domain_digits,
-            domain_hyphens,
-            ip_octets,
-            ip_port
-        ]
-        writer.writerow(row)
-print("Exported advanced features to processed_iocs_advanced.csv")
+if __name__ == "__main__":
+    main()
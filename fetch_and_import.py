@@ -1,34 +1,188 @@
 # fetch_and_import.py
+"""
+Fetch the ThreatFox JSON export and import it.
 
-import requests
-import os
+The body is streamed to disk in chunks (never held in memory) as a .part
+file, then decoded (gzip Content-Encoding, gzip or zip archives) into
+VAMF/threatfox_recent_<UTC timestamp>.json and handed to
+threatfox_importer.import_file().
+
+Requests are conditional: the ETag / Last-Modified of the last download are
+kept in <save_dir>/.fetch_state.json, and a 304 Not Modified skips both the
+download and the import. An interrupted download is resumed with a Range
+request (guarded by If-Range, so a changed export restarts from zero).
+Connection errors and 429/5xx answers are retried with exponential backoff.
+
+Run:
+  python3 fetch_and_import.py
+  python3 fetch_and_import.py --no-import
+  python3 fetch_and_import.py --url http://127.0.0.1:8000/recent.json --dir /tmp/vamf
+"""
+import argparse
 import datetime
+import gzip
+import json
+import os
+import shutil
+import time
+import zipfile
+import requests
+from urllib3.exceptions import HTTPError as TransportError
+
+DEFAULT_URL = "https://threatfox.abuse.ch/export/json/recent/"
+STATE_FILE = ".fetch_state.json"
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 2.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
 
-def fetch_recent_json(save_dir="VAMF"):
+
+def load_state(save_dir):
+    try:
+        with open(os.path.join(save_dir, STATE_FILE), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(save_dir, state):
+    path = os.path.join(save_dir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def request_headers(entry, part_size):
+    headers = {"Accept-Encoding": "gzip"}
+    partial = entry.get("partial") or {}
+    if part_size and partial.get("validator"):
+        headers["Range"] = f"bytes={part_size}-"
+        headers["If-Range"] = partial["validator"]
+    elif entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified") and "Range" not in headers:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def download(session, url, part_path, entry, timeout=60):
     """
-    Fetch recent ThreatFox JSON dump (last 48h) and save it locally.
+    Stream url into part_path, resuming a previous partial download.
+    Returns the response (status 304 means nothing was downloaded).
     """
-    url = "https://threatfox.abuse.ch/export/json/recent/"
-    
-    try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise exception for HTTP errors
-    except requests.RequestException as e:
-        print(f"[!] Failed to fetch ThreatFox data: {e}")
-        return None
+    part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    response = session.get(url, headers=request_headers(entry, part_size), stream=True, timeout=timeout)
+    if response.status_code == 304:
+        response.close()
+        return response
+    if response.status_code == 416:
+        # the partial file no longer matches the export: start over
+        response.close()
+        os.remove(part_path)
+        entry.pop("partial", None)
+        raise requests.HTTPError("range not satisfiable, restarting download", response=response)
+    if response.status_code in RETRY_STATUS:
+        response.close()
+        raise requests.HTTPError(f"retryable status {response.status_code}", response=response)
+    response.raise_for_status()
 
-    # Make sure the save directory exists
+    mode = "ab" if response.status_code == 206 else "wb"
+    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    entry["partial"] = {"validator": validator, "encoding": response.headers.get("Content-Encoding", "")}
+    with response, open(part_path, mode) as fh:
+        # raw bytes: Content-Encoding is undone after the whole body is on disk,
+        # so a resumed Range request appends to the same encoded stream
+        for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+            fh.write(chunk)
+    return response
+
+
+def decode_to_json(part_path, json_path, encoding=""):
+    """Write the JSON document held in part_path (plain, gzip or zip) to json_path."""
+    with open(part_path, "rb") as fh:
+        magic = fh.read(4)
+    if magic.startswith(b"PK"):
+        with zipfile.ZipFile(part_path) as zf:
+            name = next((n for n in zf.namelist() if n.endswith(".json")), zf.namelist()[0])
+            with zf.open(name) as src, open(json_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    elif magic.startswith(b"\x1f\x8b") or encoding == "gzip":
+        with gzip.open(part_path, "rb") as src, open(json_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    else:
+        os.replace(part_path, json_path)
+        return
+    os.remove(part_path)
+
+
+def fetch_recent_json(save_dir="VAMF", url=DEFAULT_URL, retries=DEFAULT_RETRIES, prefix="threatfox_recent"):
+    """
+    Fetch the ThreatFox JSON dump (last 48h by default) and save it locally.
+    Returns the saved path, or None when the export is unchanged or the fetch failed.
+    """
     os.makedirs(save_dir, exist_ok=True)
+    state = load_state(save_dir)
+    entry = state.setdefault(url, {})
+    part_path = os.path.join(save_dir, f"{prefix}.part")
+
+    session = requests.Session()
+    for attempt in range(retries + 1):
+        try:
+            response = download(session, url, part_path, entry)
+            break
+        except (requests.RequestException, TransportError) as e:
+            # keep whatever arrived; the next attempt resumes from there
+            save_state(save_dir, state)
+            if attempt == retries:
+                print(f"[!] Failed to fetch ThreatFox data: {e}")
+                return None
+            delay = BACKOFF_BASE ** attempt
+            print(f"[!] Fetch attempt {attempt + 1} failed ({e}); retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+    if response.status_code == 304:
+        print(f"[=] ThreatFox export unchanged since {entry.get('fetched_at')}")
+        return None
 
     # Save with timestamp in filename
     timestamp = datetime.datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    file_path = os.path.join(save_dir, f"threatfox_recent_{timestamp}.json")
+    file_path = os.path.join(save_dir, f"{prefix}_{timestamp}.json")
+    decode_to_json(part_path, file_path, entry["partial"].get("encoding", ""))
 
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(response.text)
+    entry.pop("partial", None)
+    entry["etag"] = response.headers.get("ETag")
+    entry["last_modified"] = response.headers.get("Last-Modified")
+    entry["fetched_at"] = timestamp
+    entry["path"] = file_path
+    save_state(save_dir, state)
 
-    print(f"[+] Saved ThreatFox dump to {file_path}")
+    print(f"[+] Saved ThreatFox dump to {file_path} ({os.path.getsize(file_path)} bytes)")
     return file_path
 
+
+def import_dump(path, batch_size, stream=True):
+    from pymongo import MongoClient
+    from threatfox_importer import get_collections, ensure_indexes, import_file
+
+    client = MongoClient("mongodb://localhost:27017/")
+    colls = get_collections(client["misp"])
+    ensure_indexes(colls)
+    return import_file(path, colls, batch_size, stream=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--dir", default="VAMF", help="Where dumps and the fetch state are kept")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES)
+    parser.add_argument("--no-import", action="store_true", help="Only download the export")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Importer upserts per bulk_write")
+    args = parser.parse_args(argv)
+
+    path = fetch_recent_json(args.dir, args.url, args.retries)
+    if path and not args.no_import:
+        import_dump(path, args.batch_size)
+
+
 if __name__ == "__main__":
-    fetch_recent_json()
+    main()
@@ -0,0 +1,147 @@
+"""
+Generate synthetic ThreatFox exports at any scale for benchmarks.
+
+Records follow the recent-export format ({"<id>": [record], ...}) that
+threatfox_importer.py reads. The mix of ioc_type, threat_type, malware,
+reporter and confidence is resampled from the real dumps in VAMF/ (about
+59% ip:port, 15% domain, 20% md5/sha1/sha256 hashes, 6% url; the run
+prints the mix of its templates). Values are generated fresh, so every
+IOC is unique, and first_seen is spread over the --days before now.
+
+Output is written incrementally, so 10M IOCs need no more memory than 10k.
+With --files N the IOCs are split over N dumps whose names carry
+increasing export timestamps, like a series of downloads.
+
+Run:
+  python3 generate_threatfox_dump.py --iocs 100000 --out /tmp/bench
+  python3 generate_threatfox_dump.py --iocs 10000000 --files 10 --out /tmp/bench
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import string
+from collections import Counter
+from datetime import datetime, timedelta
+
+DEFAULT_TEMPLATE_DIR = "VAMF"
+HASH_LENGTHS = {"md5_hash": 32, "sha1_hash": 40, "sha256_hash": 64}
+# shape of processed_iocs.csv, used when no template dumps are available
+FALLBACK_TEMPLATES = [
+    {"ioc_type": "ip:port", "threat_type": "botnet_cc", "malware": "win.cobalt_strike", "reporter": "abuse_ch",
+     "confidence_level": 100},
+    {"ioc_type": "domain", "threat_type": "payload_delivery", "malware": "js.clearfake", "reporter": "threatcat_ch",
+     "confidence_level": 100},
+    {"ioc_type": "sha256_hash", "threat_type": "payload", "malware": "win.lokipws", "reporter": "Grim",
+     "confidence_level": 95},
+    {"ioc_type": "md5_hash", "threat_type": "payload", "malware": "win.lokipws", "reporter": "Grim",
+     "confidence_level": 95},
+    {"ioc_type": "sha1_hash", "threat_type": "payload", "malware": "win.luca_stealer", "reporter": "Grim",
+     "confidence_level": 95},
+    {"ioc_type": "url", "threat_type": "payload_delivery", "malware": "unknown", "reporter": "abuse_ch",
+     "confidence_level": 75},
+]
+TEMPLATE_FIELDS = ("ioc_type", "threat_type", "malware", "malware_alias", "malware_printable",
+                   "confidence_level", "tags", "anonymous", "reporter")
+TLDS = ("com", "net", "org", "ru", "xyz", "top", "live", "info", "cn", "io", "online", "site")
+PORTS = (80, 443, 8080, 4444, 8443, 2222, 7443, 50050, 1337, 3333)
+
+
+def load_templates(template_dir=DEFAULT_TEMPLATE_DIR):
+    """Every record of the real dumps, reduced to the fields copied into synthetic records."""
+    templates = []
+    for path in glob.glob(os.path.join(template_dir, "*.json")):
+        with open(path, encoding="utf-8") as fh:
+            for records in json.load(fh).values():
+                templates.extend({f: r.get(f) for f in TEMPLATE_FIELDS} for r in records)
+    return templates or FALLBACK_TEMPLATES
+
+
+def type_mix(templates):
+    """Share of each ioc_type among the templates, which is the expected mix of the generated IOCs."""
+    counts = Counter(t["ioc_type"] for t in templates)
+    return {ioc_type: n / len(templates) for ioc_type, n in counts.most_common()}
+
+
+def _label(rng, lo=4, hi=14):
+    return "".join(rng.choices(string.ascii_lowercase + string.digits, k=rng.randint(lo, hi)))
+
+
+def synth_value(rng, ioc_type, seq):
+    if ioc_type == "ip:port":
+        # multiplying by an odd constant mod 2**32 is a bijection: unique, but spread over all octets
+        n = (seq * 2654435761) & 0xFFFFFFFF
+        return f"{n >> 24 & 255}.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}:{rng.choice(PORTS)}"
+    if ioc_type == "domain":
+        sub = f"{_label(rng, 2, 5)}." if rng.random() < 0.3 else ""
+        return f"{sub}{_label(rng)}{seq:x}.{rng.choice(TLDS)}"
+    if ioc_type == "url":
+        return f"https://{_label(rng)}{seq:x}.{rng.choice(TLDS)}/{_label(rng, 3, 10)}/{_label(rng, 3, 10)}.php"
+    if ioc_type in HASH_LENGTHS:
+        return f"{rng.getrandbits(HASH_LENGTHS[ioc_type] * 4):0{HASH_LENGTHS[ioc_type]}x}"
+    return f"{_label(rng)}-{seq}"
+
+
+def synth_record(rng, template, seq, end, days):
+    rec = dict(template)
+    first_seen = end - timedelta(seconds=rng.randint(0, days * 86400))
+    rec["ioc_value"] = synth_value(rng, template["ioc_type"], seq)
+    rec["first_seen_utc"] = first_seen.strftime("%Y-%m-%d %H:%M:%S")
+    rec["last_seen_utc"] = (
+        (first_seen + timedelta(seconds=rng.randint(0, 3 * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+        if rng.random() < 0.6 else None
+    )
+    rec["reference"] = None
+    return rec
+
+
+def write_dump(path, rng, templates, first_id, count, end, days):
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("{")
+        for i in range(count):
+            tf_id = first_id + i
+            rec = synth_record(rng, rng.choice(templates), tf_id, end, days)
+            fh.write(("," if i else "") + f'\n"{tf_id}": [' + json.dumps(rec) + "]")
+        fh.write("\n}\n")
+
+
+def generate(out_dir, iocs, files=1, seed=42, end=None, days=30, template_dir=DEFAULT_TEMPLATE_DIR,
+             first_id=10000000):
+    """Write `iocs` synthetic IOCs (one per ThreatFox id) into `files` dumps; returns their paths."""
+    rng = random.Random(seed)
+    templates = load_templates(template_dir)
+    end = end or datetime.utcnow().replace(microsecond=0)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    per_file = -(-iocs // files)
+    for n in range(files):
+        count = min(per_file, iocs - n * per_file)
+        if count <= 0:
+            break
+        stamp = (end - timedelta(hours=files - 1 - n)).strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(out_dir, f"threatfox_recent_{stamp}.json")
+        write_dump(path, rng, templates, first_id + n * per_file, count, end, days)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iocs", type=int, default=10000)
+    parser.add_argument("--files", type=int, default=1, help="Split the IOCs over this many dumps")
+    parser.add_argument("--out", default="synthetic", help="Output directory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--days", type=int, default=30, help="first_seen spread (days before now)")
+    parser.add_argument("--templates", default=DEFAULT_TEMPLATE_DIR, help="Real dumps to take the IOC mix from")
+    args = parser.parse_args(argv)
+
+    paths = generate(args.out, args.iocs, args.files, args.seed, days=args.days, template_dir=args.templates)
+    size = sum(os.path.getsize(p) for p in paths)
+    print(f"Wrote {args.iocs} IOCs into {len(paths)} dumps in {args.out} ({size / 1e6:.1f} MB)")
+    mix = type_mix(load_templates(args.templates))
+    print("IOC mix: " + ", ".join(f"{share:.0%} {ioc_type}" for ioc_type, share in mix.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Compact binary storage of hash IOCs (md5 / sha1 / sha256 / sha512) in ioc_hashes.
+
+ThreatFox sends hashes as hex strings typed md5_hash / sha1_hash /
+sha256_hash. ioc_hashes keeps each one as its raw digest instead:
+ - digest  16 / 20 / 32 / 64 bytes (BinData), unique index
+ - type    the ThreatFox type ("sha256_hash")
+and no hex value. A sha256 then costs 32 bytes in the document and the
+index instead of a 64-character string plus the type in a (value, type)
+index, roughly halving both; the digest length alone tells the algorithms
+apart, so one single-field index serves every lookup. At ~40 bytes per
+index entry 30M hashes keep the index well under 2 GB of RAM.
+
+Readers get the hex back with doc_value(); lookup_hex() resolves a list of
+hex hashes with one $in query per LOOKUP_BATCH digests.
+
+Run:
+  python3 hash_store.py backfill
+  python3 hash_store.py lookup 44d88612fea8a8f36de82e1278abb02f
+  python3 hash_store.py lookup --file hashes.txt
+  python3 hash_store.py stats
+"""
+import argparse
+import binascii
+from pymongo import MongoClient, UpdateOne, ASCENDING
+
+# ThreatFox type -> digest length in bytes
+HASH_TYPES = {"md5_hash": 16, "sha1_hash": 20, "sha256_hash": 32, "sha512_hash": 64}
+TYPE_BY_LENGTH = {n: t for t, n in HASH_TYPES.items()}
+LOOKUP_BATCH = 10000
+BACKFILL_BATCH = 1000
+LEGACY_INDEX = "value_1_type_1"
+
+
+def digest_of(value, ioc_type=None):
+    """Raw digest of a hex hash; None when it is not hex of a known (or the given type's) length."""
+    if not value:
+        return None
+    try:
+        digest = binascii.unhexlify(str(value).strip())
+    except (binascii.Error, ValueError):
+        return None
+    expected = HASH_TYPES.get(ioc_type) if ioc_type else None
+    if len(digest) not in TYPE_BY_LENGTH or (expected and len(digest) != expected):
+        return None
+    return digest
+
+
+def doc_value(doc):
+    """Lowercase hex of a stored hash document (or the plain value of any other attribute)."""
+    if doc.get("digest") is not None:
+        return bytes(doc["digest"]).hex()
+    return doc.get("value")
+
+
+def hash_doc(attr):
+    """ioc_hashes document for an attribute: its fields with the digest in place of the hex value."""
+    digest = digest_of(attr.get("value"), attr.get("type"))
+    if digest is None:
+        return None
+    doc = {k: v for k, v in attr.items() if k != "value" and v is not None}
+    doc["digest"] = digest
+    return doc
+
+
+def ensure_hash_index(coll):
+    try:
+        # hex documents never get here any more; a (value, type) unique index would
+        # see every digest document as (null, type) and reject all but one per type
+        if LEGACY_INDEX in coll.index_information():
+            coll.drop_index(LEGACY_INDEX)
+        coll.create_index([("digest", ASCENDING)], unique=True)
+    except Exception as e:
+        print(f"Index create warning for {coll.name}: {e}")
+
+
+def lookup_hex(coll, values, projection=None, batch_size=LOOKUP_BATCH):
+    """{hex (lowercase): document} for the given hex hashes that are stored; unknown or malformed ones are absent."""
+    if projection:
+        projection = dict(projection, digest=1)
+    keys = list({d for d in map(digest_of, values) if d is not None})
+    found = {}
+    for start in range(0, len(keys), batch_size):
+        for doc in coll.find({"digest": {"$in": keys[start:start + batch_size]}}, projection):
+            found[bytes(doc["digest"]).hex()] = doc
+    return found
+
+
+def backfill(db, batch_size=BACKFILL_BATCH):
+    """
+    Fill ioc_hashes from the hash attributes of misp.iocs events, for imports
+    made while hash types were not routed there, and drop legacy hex documents.
+    """
+    coll = db["ioc_hashes"]
+    ensure_hash_index(coll)
+    removed = coll.delete_many({"digest": {"$exists": False}}).deleted_count
+    ops = []
+    upserted = 0
+    query = {"Attribute.type": {"$in": list(HASH_TYPES)}}
+    for event in db["iocs"].find(query, {"Attribute": 1}):
+        for attr in event.get("Attribute", []):
+            doc = hash_doc(attr) if attr.get("type") in HASH_TYPES else None
+            if doc is None:
+                continue
+            ops.append(UpdateOne({"digest": doc["digest"]}, {"$set": doc}, upsert=True))
+            if len(ops) >= batch_size:
+                upserted += len(coll.bulk_write(ops, ordered=False).upserted_ids)
+                ops = []
+    if ops:
+        upserted += len(coll.bulk_write(ops, ordered=False).upserted_ids)
+    print(f"Backfilled {upserted} hash documents (removed {removed} hex documents)")
+    return upserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="Store the hashes of already imported events as digests")
+    lookup = sub.add_parser("lookup", help="Look up hex hashes")
+    lookup.add_argument("values", nargs="*")
+    lookup.add_argument("--file", default=None, help="File with one hex hash per line")
+    sub.add_parser("stats", help="Document and index sizes of ioc_hashes")
+    args = parser.parse_args(argv)
+
+    client = MongoClient("mongodb://localhost:27017/")
+    db = client["misp"]
+    if args.command == "backfill":
+        backfill(db)
+    elif args.command == "lookup":
+        values = list(args.values)
+        if args.file:
+            with open(args.file, encoding="utf-8") as fh:
+                values.extend(line.strip() for line in fh if line.strip())
+        found = lookup_hex(db["ioc_hashes"], values, {"_id": 0, "type": 1, "malware": 1, "threat_type": 1,
+                                                       "threatfox_id": 1})
+        for value in values:
+            doc = found.get(value.strip().lower())
+            if doc is None:
+                print(f"{value}\tnot found")
+            else:
+                print(f"{value}\t{doc.get('type')}\t{doc.get('malware')}\t{doc.get('threatfox_id')}")
+    else:
+        stats = db.command("collStats", "ioc_hashes")
+        print(f"documents: {stats.get('count', 0)}")
+        print(f"avg document size: {stats.get('avgObjSize', 0)} bytes")
+        print(f"index size: {stats.get('totalIndexSize', 0)} bytes")
+        for name, size in stats.get("indexSizes", {}).items():
+            print(f"  {name}: {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Compact on-disk membership index of imported IOC values.
+
+The index answers "is this value a known IOC, and of which kind" without a
+MongoDB round-trip:
+ - a Bloom filter rejects almost every miss with k bit probes
+ - a sorted uint64 array of 64-bit value hashes (with a parallel uint8 kind
+   code) confirms hits with a binary search
+
+Everything lives in one file: a JSON header followed by the raw arrays at
+8-byte aligned offsets. IocIndex.open() memory-maps the arrays read-only,
+so any number of worker processes share one copy through the page cache.
+Writers build a new file and os.replace() it in; processes holding the old
+mapping keep reading it until they reopen.
+
+refresh() is incremental: attribute documents are only ever inserted (an
+update never changes the value), so the values added since the last build
+are the ones with an _id above the per-collection watermark stored in the
+header. They are merged into the sorted array and set in the Bloom filter.
+The filter is sized with headroom; once the key count outgrows it the
+index is rebuilt from scratch.
+
+Values are normalized before hashing, on both the write and the lookup
+side: lowercased, and IP attributes reduced to the bare address, so
+ThreatFox's "1.2.3.4:80" is found by a lookup of "1.2.3.4" (or of
+"1.2.3.4:443"). The index answers "is this IP known", whatever the port.
+
+Run:
+  python3 ioc_index.py build
+  python3 ioc_index.py refresh
+  python3 ioc_index.py check 1.2.3.4 evil.example
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import numpy as np
+from bson import ObjectId
+from pymongo import MongoClient
+from hash_store import doc_value
+from ip_ranges import parse_ip_port
+
+DEFAULT_PATH = "ioc_index.bin"
+# 02: IPs are keyed on the bare address
+MAGIC = b"IOCIDX02"
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 1 << 20
+HEADROOM = 2
+READ_BATCH = 10000
+BLOOM_CHUNK = 1 << 20
+COLLECTION_KINDS = {"ioc_domains": 1, "ioc_ips": 2, "ioc_hashes": 3}
+KIND_NAMES = {code: name for name, code in COLLECTION_KINDS.items()}
+
+
+def normalize(value):
+    """Lookup key of a value: lowercased, and the bare address of an "ip" / "ip:port" / "[ipv6]:port"."""
+    value = str(value).strip().lower()
+    # only try to parse what can be an address; domains and hashes never are
+    if value[:1].isdigit() or value[:1] == "[" or ":" in value:
+        ip, _ = parse_ip_port(value)
+        if ip is not None:
+            return str(ip)
+    return value
+
+
+def hash_values(values):
+    """64-bit blake2b hash of each normalized value, as a uint64 array."""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(normalize(v).encode("utf-8"), digest_size=8).digest(), "little")
+         for v in values),
+        dtype=np.uint64, count=len(values),
+    )
+
+
+def bloom_size(capacity, rate=FALSE_POSITIVE_RATE):
+    """(bits, probes) for a Bloom filter holding capacity keys at the given false-positive rate."""
+    bits = int(math.ceil(-capacity * math.log(rate) / (math.log(2) ** 2)))
+    bits = (bits + 63) // 64 * 64
+    probes = max(1, int(round(bits / capacity * math.log(2))))
+    return bits, probes
+
+
+def bloom_positions(keys, bits, probes):
+    # double hashing: probe i is h1 + i * h2 (mod bits), h1/h2 the two halves of the key
+    h1 = keys & np.uint64(0xFFFFFFFF)
+    h2 = (keys >> np.uint64(32)) | np.uint64(1)
+    i = np.arange(probes, dtype=np.uint64)
+    return (h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(bits)
+
+
+def bloom_add(bloom, keys, bits, probes):
+    # chunked so the (keys x probes) position matrix stays small
+    for start in range(0, len(keys), BLOOM_CHUNK):
+        pos = bloom_positions(keys[start:start + BLOOM_CHUNK], bits, probes).ravel()
+        np.bitwise_or.at(bloom, (pos >> np.uint64(3)).astype(np.intp),
+                         np.left_shift(np.uint8(1), (pos & np.uint64(7)).astype(np.uint8)))
+
+
+def bloom_check(bloom, keys, bits, probes):
+    pos = bloom_positions(keys, bits, probes)
+    probe = (bloom[(pos >> np.uint64(3)).astype(np.intp)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+    return probe.all(axis=1)
+
+
+def merge_keys(keys, kinds, new_keys, new_kinds):
+    """Sorted, de-duplicated union of two (keys, kinds) pairs; the first kind seen for a key wins."""
+    all_keys = np.concatenate([keys, new_keys])
+    all_kinds = np.concatenate([kinds, new_kinds])
+    all_keys, first = np.unique(all_keys, return_index=True)
+    return all_keys, all_kinds[first]
+
+
+def write_index(path, keys, kinds, bloom, bits, probes, capacity, watermarks):
+    header = {
+        "count": int(len(keys)),
+        "bits": int(bits),
+        "probes": int(probes),
+        "capacity": int(capacity),
+        "watermarks": watermarks,
+    }
+    arrays = [("bloom", bloom), ("keys", keys), ("kinds", kinds)]
+    # the offsets are part of the header, so grow the reserved header room until it fits
+    reserved = 1024
+    while True:
+        offset = len(MAGIC) + 8 + reserved
+        header["arrays"] = {}
+        for name, arr in arrays:
+            header["arrays"][name] = {"offset": offset, "length": int(len(arr)), "dtype": arr.dtype.str}
+            offset = (offset + arr.nbytes + 7) // 8 * 8
+        meta = json.dumps(header).encode("utf-8")
+        if len(meta) <= reserved:
+            break
+        reserved *= 2
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(len(meta).to_bytes(8, "little"))
+        fh.write(meta)
+        for name, arr in arrays:
+            fh.seek(header["arrays"][name]["offset"])
+            fh.write(np.ascontiguousarray(arr).tobytes())
+    os.replace(tmp, path)
+    return header
+
+
+class IocIndex:
+    """Read-only, memory-mapped view of an index file."""
+
+    def __init__(self, path, header, bloom, keys, kinds):
+        self.path = path
+        self.header = header
+        self.bloom = bloom
+        self.keys = keys
+        self.kinds = kinds
+        self.bits = header["bits"]
+        self.probes = header["probes"]
+
+    @classmethod
+    def open(cls, path=DEFAULT_PATH):
+        with open(path, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an IOC index file of this version")
+            size = int.from_bytes(fh.read(8), "little")
+            header = json.loads(fh.read(size))
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            if spec["length"] == 0:
+                arrays[name] = np.zeros(0, dtype=spec["dtype"])
+                continue
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r",
+                                     offset=spec["offset"], shape=(spec["length"],))
+        return cls(path, header, arrays["bloom"], arrays["keys"], arrays["kinds"])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup_keys(self, keys):
+        """Kind code per hashed key (0 = not a known IOC)."""
+        result = np.zeros(len(keys), dtype=np.uint8)
+        if not len(keys) or not len(self.keys):
+            return result
+        maybe = np.flatnonzero(bloom_check(self.bloom, keys, self.bits, self.probes))
+        if len(maybe):
+            candidates = keys[maybe]
+            pos = np.searchsorted(self.keys, candidates)
+            pos[pos == len(self.keys)] = 0
+            hit = self.keys[pos] == candidates
+            result[maybe[hit]] = self.kinds[pos[hit]]
+        return result
+
+    def lookup(self, values):
+        """Kind code per value: 1 domain, 2 ip, 3 hash, 0 unknown."""
+        return self.lookup_keys(hash_values(values))
+
+    def contains(self, values):
+        return self.lookup(values) > 0
+
+
+def read_new_values(db, watermarks):
+    """Hashed keys and kind codes of attribute documents past the watermarks, plus the new watermarks."""
+    key_parts, kind_parts = [], []
+    new_marks = dict(watermarks)
+    for name, kind in COLLECTION_KINDS.items():
+        query = {"_id": {"$gt": ObjectId(watermarks[name])}} if watermarks.get(name) else {}
+        cursor = db[name].find(query, {"value": 1, "digest": 1, "ip": 1}, batch_size=READ_BATCH).sort("_id", 1)
+        values = []
+        last_id = None
+        for doc in cursor:
+            # ioc_ips documents carry the parsed address (see ip_ranges.ip_fields)
+            value = doc.get("ip") or doc_value(doc)
+            if value is not None:
+                values.append(value)
+            last_id = doc["_id"]
+        if last_id is not None:
+            new_marks[name] = str(last_id)
+        if values:
+            key_parts.append(hash_values(values))
+            kind_parts.append(np.full(len(values), kind, dtype=np.uint8))
+    if not key_parts:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint8), new_marks
+    return np.concatenate(key_parts), np.concatenate(kind_parts), new_marks
+
+
+def build(db, path=DEFAULT_PATH):
+    """Build the index from scratch; returns its header."""
+    keys, kinds, marks = read_new_values(db, {})
+    keys, kinds = merge_keys(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint8), keys, kinds)
+    capacity = max(MIN_CAPACITY, HEADROOM * len(keys))
+    bits, probes = bloom_size(capacity)
+    bloom = np.zeros(bits // 8, dtype=np.uint8)
+    bloom_add(bloom, keys, bits, probes)
+    header = write_index(path, keys, kinds, bloom, bits, probes, capacity, marks)
+    print(f"Built {path}: {len(keys)} values, {bits // 8 // 1024} KiB Bloom filter, {probes} probes")
+    return header
+
+
+def refresh(db, path=DEFAULT_PATH):
+    """Add values imported since the last build/refresh; rebuilds when the Bloom filter is full."""
+    if not os.path.exists(path):
+        return build(db, path)
+    try:
+        index = IocIndex.open(path)
+    except ValueError as e:
+        print(f"{e}; rebuilding")
+        return build(db, path)
+    new_keys, new_kinds, marks = read_new_values(db, index.header["watermarks"])
+    if not len(new_keys):
+        print(f"{path} is up to date ({len(index)} values)")
+        return index.header
+    keys, kinds = merge_keys(index.keys, index.kinds, new_keys, new_kinds)
+    if len(keys) > index.header["capacity"]:
+        return build(db, path)
+    bloom = np.array(index.bloom)
+    bloom_add(bloom, new_keys, index.bits, index.probes)
+    header = write_index(path, keys, kinds, bloom, index.bits, index.probes, index.header["capacity"], marks)
+    print(f"Refreshed {path}: +{len(keys) - len(index)} values, {len(keys)} total")
+    return header
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("build", "refresh", "check"))
+    parser.add_argument("values", nargs="*", help="Values to look up (check)")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="Index file")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        index = IocIndex.open(args.path)
+        for value, kind in zip(args.values, index.lookup(args.values)):
+            print(f"{value}: {KIND_NAMES.get(int(kind), 'unknown')}")
+        return
+
+    client = MongoClient("mongodb://localhost:27017/")
+    db = client["misp"]
+    if args.command == "build":
+        build(db, args.path)
+    else:
+        refresh(db, args.path)
+
+
+if __name__ == "__main__":
+    main()
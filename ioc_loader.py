@@ -0,0 +1,86 @@
+"""
+Shared MongoDB readers for the export, feature extraction and training scripts.
+
+Readers ask only for the fields they use (dotted names such as
+"features.confidence" are projected server-side, and _id is dropped unless
+it is one of the fields). They use a fixed cursor batch size so a large
+collection streams in a predictable number of round-trips.
+
+load_dataframe() uses PyMongoArrow when it is installed. It decodes the raw
+BSON batches straight into Arrow columns without building a Python dict
+per document. Without it, a DataFrame is built per batch and the batches
+are concatenated.
+"""
+import pandas as pd
+
+DEFAULT_CURSOR_BATCH = 5000
+DEFAULT_FRAME_BATCH = 50000
+
+
+def projection_for(fields):
+    projection = {f: 1 for f in fields}
+    projection.setdefault("_id", 0)
+    return projection
+
+
+def iter_documents(coll, fields, query=None, batch_size=DEFAULT_CURSOR_BATCH):
+    """Cursor over the projected documents."""
+    return coll.find(query or {}, projection_for(fields), batch_size=batch_size)
+
+
+def iter_batches(coll, fields, batch_size=DEFAULT_FRAME_BATCH, query=None):
+    """Yield lists of at most batch_size projected documents."""
+    batch = []
+    for doc in iter_documents(coll, fields, query, min(batch_size, DEFAULT_CURSOR_BATCH)):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _get(doc, dotted):
+    for part in dotted.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def frame_from_docs(docs, fields):
+    """Flat DataFrame with one column per (dotted) field name."""
+    return pd.DataFrame({f: [_get(d, f) for d in docs] for f in fields}, columns=fields)
+
+
+def iter_dataframes(coll, fields, batch_size=DEFAULT_FRAME_BATCH, query=None):
+    """Yield one flat DataFrame per batch; memory is bounded by batch_size."""
+    for docs in iter_batches(coll, fields, batch_size, query):
+        yield frame_from_docs(docs, fields)
+
+
+def _load_arrow(coll, fields, query):
+    try:
+        from pymongoarrow.api import find_arrow_all
+    except ImportError:
+        return None
+    table = find_arrow_all(coll, query or {}, projection=projection_for(fields), batch_size=DEFAULT_CURSOR_BATCH)
+    # nested documents come back as struct columns; flatten() names them "features.x"
+    while any(str(t).startswith("struct") for t in table.schema.types):
+        table = table.flatten()
+    df = table.to_pandas()
+    for f in fields:
+        if f not in df.columns:
+            df[f] = None
+    return df[fields]
+
+
+def load_dataframe(coll, fields, query=None, batch_size=DEFAULT_FRAME_BATCH):
+    """Load the projected fields of a collection into one flat DataFrame."""
+    df = _load_arrow(coll, fields, query)
+    if df is not None:
+        return df
+    frames = list(iter_dataframes(coll, fields, batch_size, query))
+    if not frames:
+        return pd.DataFrame(columns=fields)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,217 @@
+"""
+Normalized IP IOCs and fast CIDR / range matching.
+
+ThreatFox sends IP IOCs as "ip:port" strings ("1.2.3.4:443", "[2001:db8::1]:80").
+At import time ip_fields() splits them into:
+ - ip          canonical address string without the port
+ - ip_version  4 or 6
+ - ip_bin      16 bytes, big-endian; IPv4 is stored IPv4-mapped (::ffff:a.b.c.d)
+               so one index orders both families and ranges are byte ranges
+ - port        integer port, when present
+
+With the (ip_bin, port) index on ioc_ips a CIDR is a single index range scan
+(cidr_query()). For bulk matching IpRangeIndex loads the known addresses
+into sorted arrays: IPv4 as a numpy uint32 array, IPv6 as a sorted list of
+ints, and answers membership / CIDR / subnet-count questions with binary
+search instead of regex scans.
+
+Run:
+  python3 ip_ranges.py backfill
+  python3 ip_ranges.py cidr 185.220.0.0/16
+  python3 ip_ranges.py subnets --prefix 16 --top 20
+"""
+import argparse
+import bisect
+import ipaddress
+import numpy as np
+from pymongo import MongoClient, UpdateOne, ASCENDING
+
+IPV4_MAPPED = 0xFFFF << 32
+BACKFILL_BATCH = 1000
+
+
+def parse_ip_port(value):
+    """
+    (ip_address, port or None) for "ip", "ip:port" or "[ipv6]:port", IPv4-mapped
+    IPv6 as IPv4; (None, None) if unparseable.
+    """
+    if not value:
+        return None, None
+    value = str(value).strip()
+    host, port = value, None
+    if value.startswith("["):
+        host, _, rest = value[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else None
+    elif value.count(":") == 1:
+        host, port = value.split(":")
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return None, None
+    # ::ffff:a.b.c.d is the IPv4 host; ip_bin stores both alike, so the range index must too
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    try:
+        port = int(port) if port else None
+    except ValueError:
+        port = None
+    return ip, port
+
+
+def to_int128(ip):
+    """Address as an int in the shared IPv6 space (IPv4 mapped to ::ffff:0:0/96)."""
+    return int(ip) | IPV4_MAPPED if ip.version == 4 else int(ip)
+
+
+def to_bin(n):
+    return n.to_bytes(16, "big")
+
+
+def ip_fields(value):
+    """Normalized fields stored next to an ioc_ips value; {} when it is not an address."""
+    ip, port = parse_ip_port(value)
+    if ip is None:
+        return {}
+    fields = {"ip": str(ip), "ip_version": ip.version, "ip_bin": to_bin(to_int128(ip))}
+    if port is not None:
+        fields["port"] = port
+    return fields
+
+
+def network_bounds(cidr):
+    """(low, high) ints, inclusive, of a CIDR ("10.0.0.0/8") or single address."""
+    net = ipaddress.ip_network(cidr, strict=False)
+    lo = int(net.network_address)
+    hi = int(net.broadcast_address)
+    if net.version == 4:
+        lo, hi = lo | IPV4_MAPPED, hi | IPV4_MAPPED
+    return lo, hi
+
+
+def cidr_query(cidr):
+    """MongoDB filter matching ioc_ips documents inside a CIDR (uses the ip_bin index)."""
+    lo, hi = network_bounds(cidr)
+    return {"ip_bin": {"$gte": to_bin(lo), "$lte": to_bin(hi)}}
+
+
+def ensure_ip_index(coll):
+    try:
+        coll.create_index([("ip_bin", ASCENDING), ("port", ASCENDING)])
+    except Exception as e:
+        print(f"Index create warning for {coll.name}: {e}")
+
+
+class IpRangeIndex:
+    """Sorted in-memory arrays of known IP IOCs for bulk membership and range queries."""
+
+    def __init__(self, v4, v4_values, v6, v6_values):
+        self.v4 = v4
+        self.v4_values = v4_values
+        self.v6 = v6
+        self.v6_values = v6_values
+
+    @classmethod
+    def from_values(cls, values):
+        v4, v6 = [], []
+        for value in values:
+            ip, _ = parse_ip_port(value)
+            if ip is None:
+                continue
+            (v4 if ip.version == 4 else v6).append((int(ip), value))
+        v4.sort()
+        v6.sort()
+        return cls(np.array([n for n, _ in v4], dtype=np.uint32), [v for _, v in v4],
+                   [n for n, _ in v6], [v for _, v in v6])
+
+    @classmethod
+    def from_collection(cls, coll):
+        return cls.from_values(d["value"] for d in coll.find({}, {"value": 1, "_id": 0}, batch_size=10000)
+                               if d.get("value"))
+
+    def __len__(self):
+        return len(self.v4) + len(self.v6)
+
+    def contains(self, ips):
+        """Boolean array: which of the given addresses (with or without port) are known IOCs."""
+        out = np.zeros(len(ips), dtype=bool)
+        v4_pos, v4_ints = [], []
+        for i, value in enumerate(ips):
+            ip, _ = parse_ip_port(value)
+            if ip is None:
+                continue
+            if ip.version == 4:
+                v4_pos.append(i)
+                v4_ints.append(int(ip))
+            else:
+                j = bisect.bisect_left(self.v6, int(ip))
+                out[i] = j < len(self.v6) and self.v6[j] == int(ip)
+        if v4_ints and len(self.v4):
+            q = np.array(v4_ints, dtype=np.uint32)
+            j = np.minimum(np.searchsorted(self.v4, q), len(self.v4) - 1)
+            out[np.array(v4_pos)] = self.v4[j] == q
+        return out
+
+    def in_network(self, cidr):
+        """IOC values inside a CIDR, in address order."""
+        net = ipaddress.ip_network(cidr, strict=False)
+        lo, hi = int(net.network_address), int(net.broadcast_address)
+        if net.version == 4:
+            start = np.searchsorted(self.v4, np.uint32(lo), side="left")
+            end = np.searchsorted(self.v4, np.uint32(hi), side="right")
+            return self.v4_values[start:end]
+        return self.v6_values[bisect.bisect_left(self.v6, lo):bisect.bisect_right(self.v6, hi)]
+
+    def subnet_counts(self, prefix=24):
+        """{"a.b.c.0/prefix": IOC count} over the IPv4 IOCs."""
+        if not len(self.v4):
+            return {}
+        mask = np.uint32((0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF)
+        nets, counts = np.unique(self.v4 & mask, return_counts=True)
+        return {f"{ipaddress.IPv4Address(int(n))}/{prefix}": int(c) for n, c in zip(nets, counts)}
+
+
+def backfill(coll, batch_size=BACKFILL_BATCH):
+    """Add the normalized fields to ioc_ips documents imported before they existed."""
+    ensure_ip_index(coll)
+    ops = []
+    updated = 0
+    for doc in coll.find({"ip_bin": {"$exists": False}}, {"value": 1}):
+        fields = ip_fields(doc.get("value"))
+        if not fields:
+            continue
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(ops) >= batch_size:
+            updated += coll.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += coll.bulk_write(ops, ordered=False).modified_count
+    print(f"Backfilled normalized IP fields on {updated} documents")
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="Normalize ioc_ips documents imported before ip_bin/port existed")
+    cidr = sub.add_parser("cidr", help="List IP IOCs inside a CIDR")
+    cidr.add_argument("network")
+    subnets = sub.add_parser("subnets", help="Count IPv4 IOCs per subnet")
+    subnets.add_argument("--prefix", type=int, default=24)
+    subnets.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    client = MongoClient("mongodb://localhost:27017/")
+    coll = client["misp"]["ioc_ips"]
+    if args.command == "backfill":
+        backfill(coll)
+    elif args.command == "cidr":
+        for doc in coll.find(cidr_query(args.network), {"value": 1, "_id": 0}).sort("ip_bin", 1):
+            print(doc["value"])
+    else:
+        counts = IpRangeIndex.from_collection(coll).subnet_counts(args.prefix)
+        for net, n in sorted(counts.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"{net}\t{n}")
+
+
+if __name__ == "__main__":
+    main()
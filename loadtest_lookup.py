@@ -0,0 +1,114 @@
+"""
+Load test for lookup_service.py.
+
+Samples known values from the attribute collections of a local mongod, mixes
+in random misses, and drives the service over keep-alive connections.
+Reports client-side p50/p99 latency and throughput, then the server's own
+/stats (server-side latency excludes the network stack).
+Run:
+  python3 lookup_service.py &
+  python3 loadtest_lookup.py --requests 20000 --concurrency 16
+  python3 loadtest_lookup.py --bulk 500 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote, urlsplit
+from pymongo import MongoClient
+from hash_store import doc_value
+from lookup_service import ATTRIBUTE_COLLECTIONS
+
+
+def sample_values(db, n):
+    values = []
+    per_coll = max(1, n // len(ATTRIBUTE_COLLECTIONS))
+    for name in ATTRIBUTE_COLLECTIONS:
+        pipeline = [{"$sample": {"size": per_coll}}, {"$project": {"value": 1, "digest": 1, "_id": 0}}]
+        for doc in db[name].aggregate(pipeline):
+            # ioc_hashes documents hold a binary digest instead of the value
+            value = doc_value(doc)
+            if value:
+                values.append(value)
+    return values
+
+
+async def request(reader, writer, method, path, body=b""):
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, val = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(val)
+    return await reader.readexactly(length)
+
+
+async def worker(host, port, values, count, bulk, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            if bulk:
+                body = json.dumps({"values": random.choices(values, k=bulk)}).encode("utf-8")
+                start = time.perf_counter()
+                await request(reader, writer, "POST", "/lookup", body)
+            else:
+                start = time.perf_counter()
+                await request(reader, writer, "GET", "/lookup?value=" + quote(random.choice(values), safe=""))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))] * 1000
+
+
+async def run(args, values):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    latencies = []
+    per_worker = max(1, args.requests // args.concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(host, port, values, per_worker, args.bulk, latencies)
+                           for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    lat = sorted(latencies)
+    lookups = len(lat) * (args.bulk or 1)
+    print(f"{len(lat)} requests ({lookups} lookups) in {elapsed:.2f}s: "
+          f"{len(lat) / elapsed:,.0f} req/s, {lookups / elapsed:,.0f} lookups/s")
+    print(f"client latency: p50={percentile(lat, 0.50):.3f}ms p99={percentile(lat, 0.99):.3f}ms")
+
+    reader, writer = await asyncio.open_connection(host, port)
+    print("server /stats:", (await request(reader, writer, "GET", "/stats")).decode("utf-8"))
+    writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8088")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel keep-alive connections")
+    parser.add_argument("--bulk", type=int, default=0, help="Values per POST /lookup (0 = single GETs)")
+    parser.add_argument("--sample", type=int, default=3000, help="Known values sampled from MongoDB")
+    parser.add_argument("--miss-ratio", type=float, default=0.5, help="Share of looked-up values that are unknown")
+    args = parser.parse_args(argv)
+
+    client = MongoClient("mongodb://localhost:27017/")
+    known = sample_values(client["misp"], args.sample)
+    misses = int(len(known) * args.miss_ratio / max(1e-9, 1 - args.miss_ratio))
+    values = known + [f"{random.getrandbits(64):016x}.invalid" for _ in range(misses)]
+    print(f"Looking up from {len(known)} known and {misses} unknown values")
+    asyncio.run(run(args, values))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Local HTTP lookup service for known IOCs and their model scores.
+
+At startup the service loads every value from ioc_domains, ioc_ips and
+ioc_hashes (plus the score of each processed_iocs document) into an
+in-process dict, so an exact-match lookup never touches MongoDB. The index
+is rebuilt every --refresh seconds in a worker thread and swapped in
+whole. Answers are kept in an LRU cache with a TTL, so repeated lookups of
+hot values skip even the response assembly.
+
+Values are keyed by ioc_index.normalize(): lowercased, and IPs by their
+bare address, so a SIEM asking about an observed "1.2.3.4" finds the
+ThreatFox "1.2.3.4:80" attribute (every port's attribute is in "matches").
+
+Endpoints (HTTP/1.1, keep-alive):
+  GET  /lookup?value=<ioc>               one lookup
+  POST /lookup   {"values": [...]}       bulk lookup, answers in request order
+  GET  /stats                            request count and p50/p99 latency (ms)
+  GET  /health
+
+Run:
+  python3 lookup_service.py --port 8088
+  python3 lookup_service.py --refresh 300 --mongo-fallback
+  python3 loadtest_lookup.py --url http://127.0.0.1:8088
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+from pymongo import MongoClient
+from hash_store import doc_value, lookup_hex
+from ioc_index import normalize
+
+ATTRIBUTE_COLLECTIONS = ("ioc_domains", "ioc_ips", "ioc_hashes")
+ATTRIBUTE_FIELDS = ("value", "digest", "type", "malware", "threat_type", "confidence_level",
+                    "first_seen", "last_seen", "threatfox_id")
+DEFAULT_CACHE_SIZE = 100000
+DEFAULT_CACHE_TTL = 300
+DEFAULT_REFRESH = 600
+MAX_BULK = 10000
+LATENCY_WINDOW = 100000
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.data[key]
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+def match_doc(doc, name):
+    # ioc_hashes stores binary digests (see hash_store.py); answers carry the hex
+    if "digest" in doc:
+        doc["value"] = doc_value(doc)
+        del doc["digest"]
+    doc["collection"] = name
+    return doc
+
+
+def add_score(entry, score):
+    # several attributes (an IP on different ports) share a key: keep the riskiest score
+    if entry["score"] is None or score.get("probability", 0) > entry["score"].get("probability", 0):
+        entry["score"] = score
+
+
+def build_index(db):
+    """normalize(value) -> {"matches": [attribute docs], "score": score doc or None}."""
+    index = {}
+    projection = {f: 1 for f in ATTRIBUTE_FIELDS}
+    projection["_id"] = 0
+    for name in ATTRIBUTE_COLLECTIONS:
+        for doc in db[name].find({}, projection, batch_size=10000):
+            doc = match_doc(doc, name)
+            if doc.get("value") is None:
+                continue
+            index.setdefault(normalize(doc["value"]), {"matches": [], "score": None})["matches"].append(doc)
+    for doc in db["processed_iocs"].find({"score": {"$exists": True}}, {"value": 1, "score": 1, "_id": 0},
+                                         batch_size=10000):
+        entry = index.get(normalize(doc.get("value")))
+        if entry is not None:
+            add_score(entry, doc["score"])
+    return index
+
+
+def query_mongo(db, keys):
+    """Fallback for normalized keys the index does not know yet (written since the last refresh)."""
+    found = {}
+    projection = {f: 1 for f in ATTRIBUTE_FIELDS}
+    projection["_id"] = 0
+    raw_values = []
+    for name in ATTRIBUTE_COLLECTIONS:
+        if name == "ioc_hashes":
+            docs = lookup_hex(db[name], keys, projection).values()
+        elif name == "ioc_ips":
+            # bare addresses match every port through the parsed ip field (see ip_ranges.py)
+            docs = db[name].find({"$or": [{"value": {"$in": keys}}, {"ip": {"$in": keys}}]}, projection)
+        else:
+            docs = db[name].find({"value": {"$in": keys}}, projection)
+        for doc in docs:
+            doc = match_doc(doc, name)
+            raw_values.append(doc["value"])
+            found.setdefault(normalize(doc["value"]), {"matches": [], "score": None})["matches"].append(doc)
+    if found:
+        for doc in db["processed_iocs"].find({"value": {"$in": raw_values}, "score": {"$exists": True}},
+                                             {"value": 1, "score": 1, "_id": 0}):
+            add_score(found[normalize(doc["value"])], doc["score"])
+    return found
+
+
+def answer(value, entry):
+    if entry is None:
+        return {"value": value, "found": False, "matches": [], "score": None}
+    return {"value": value, "found": True, "matches": entry["matches"], "score": entry["score"]}
+
+
+class LookupService:
+    def __init__(self, db, cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL, mongo_fallback=False):
+        self.db = db
+        self.index = {}
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.mongo_fallback = mongo_fallback
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+
+    async def refresh(self):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        index = await loop.run_in_executor(None, build_index, self.db)
+        # swap, then drop answers computed from the old index
+        self.index = index
+        self.cache.clear()
+        print(f"Index loaded: {len(index)} values in {time.perf_counter() - start:.1f}s")
+
+    async def refresh_forever(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Index refresh failed, keeping the previous index: {e}")
+
+    async def lookup(self, values):
+        results = {}
+        unknown = []
+        for v in values:
+            cached = self.cache.get(v)
+            if cached is not None:
+                results[v] = cached
+                continue
+            entry = self.index.get(normalize(v))
+            if entry is None and self.mongo_fallback:
+                unknown.append(v)
+                continue
+            results[v] = answer(v, entry)
+            self.cache.put(v, results[v])
+        if unknown:
+            loop = asyncio.get_running_loop()
+            keys = list({normalize(v) for v in unknown})
+            found = await loop.run_in_executor(None, query_mongo, self.db, keys)
+            for v in unknown:
+                results[v] = answer(v, found.get(normalize(v)))
+                self.cache.put(v, results[v])
+        return [results[v] for v in values]
+
+    def stats(self):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 4) if lat else None
+        return {
+            "requests": self.requests,
+            "index_size": len(self.index),
+            "cache_size": len(self.cache.data),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+        }
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == "/lookup" and method == "GET":
+            value = parse_qs(url.query).get("value", [None])[0]
+            if value is None:
+                return 400, {"error": "missing ?value="}
+            return 200, (await self.lookup([value]))[0]
+        if url.path == "/lookup" and method == "POST":
+            try:
+                values = json.loads(body or b"{}").get("values")
+            except (ValueError, AttributeError):
+                return 400, {"error": "body must be JSON {\"values\": [...]}"}
+            if not isinstance(values, list) or len(values) > MAX_BULK:
+                return 400, {"error": f"values must be a list of at most {MAX_BULK} strings"}
+            return 200, {"results": await self.lookup([str(v) for v in values])}
+        if url.path == "/stats":
+            return 200, self.stats()
+        if url.path == "/health":
+            return 200, {"status": "ok", "index_size": len(self.index)}
+        return 404, {"error": "not found"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, val = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = val.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self.route(method, target, body)
+                data = json.dumps(payload, default=str).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                self.requests += 1
+                self.latencies.append(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    client = MongoClient("mongodb://localhost:27017/")
+    service = LookupService(client["misp"], args.cache_size, args.cache_ttl, args.mongo_fallback)
+    await service.refresh()
+    server = await asyncio.start_server(service.handle, args.host, args.port)
+    print(f"Serving IOC lookups on http://{args.host}:{args.port}")
+    refresher = asyncio.create_task(service.refresh_forever(args.refresh)) if args.refresh > 0 else None
+    async with server:
+        await server.serve_forever()
+    if refresher:
+        refresher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="Answers kept in the LRU cache")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL, help="Seconds a cached answer stays valid")
+    parser.add_argument("--refresh", type=float, default=DEFAULT_REFRESH,
+                        help="Seconds between index rebuilds (0 = load once)")
+    parser.add_argument("--mongo-fallback", action="store_true",
+                        help="Query MongoDB for values missing from the index")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Process-wide metrics for the import, ETL, export and training scripts.
+
+Scripts wrap their work in `with metrics.stage("import"):` and count what
+they process with metrics.inc("records_total", n). Each stage records:
+ - stage_seconds           wall time (histogram)
+ - records_total           records processed; records/s = records_total / stage_seconds_sum
+ - bytes_read_total        bytes of dumps / files read
+ - bulk_batch_size         operations per bulk_write (histogram)
+ - mongo_round_trips_total and mongo_command_seconds, per command name,
+   collected by a pymongo command listener registered in configure()
+ - peak_rss_bytes          peak resident set size of the process
+
+Nothing is collected until configure() is called (scripts call it from
+their --metrics / --profile flags, see add_arguments()). Metrics are
+written when each stage ends and at exit, as Prometheus text format
+(.prom / .txt) or JSON lines (.jsonl, one sample per line). With --profile
+DIR each stage also runs under cProfile (DIR/<stage>.prof) or, with
+--profiler pyinstrument, pyinstrument (DIR/<stage>.html).
+"""
+import atexit
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 10, 100, 500, 1000, 5000, 10000, 50000, 100000)
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.enabled = False
+        self.path = None
+        self.profile_dir = None
+        self.profiler = "cprofile"
+        self.current_stage = None
+
+    def _key(self, name, labels):
+        if self.current_stage and "stage" not in labels:
+            labels = dict(labels, stage=self.current_stage)
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        if self.enabled:
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if self.enabled:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        if self.enabled:
+            key = self._key(name, labels)
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set
+observe = REGISTRY.observe
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def _mongo_listener():
+    from pymongo import monitoring
+
+    class MongoCommandListener(monitoring.CommandListener):
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            inc("mongo_round_trips_total", command=event.command_name)
+            observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+        def failed(self, event):
+            inc("mongo_round_trips_total", command=event.command_name)
+            inc("mongo_command_failures_total", command=event.command_name)
+            observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    return MongoCommandListener()
+
+
+def configure(path=None, profile_dir=None, profiler="cprofile"):
+    """
+    Start collecting. Must run before the script creates its MongoClient, so
+    the command listener is registered for it.
+    """
+    if REGISTRY.enabled or not (path or profile_dir):
+        return
+    REGISTRY.enabled = True
+    REGISTRY.path = path
+    REGISTRY.profile_dir = profile_dir
+    REGISTRY.profiler = profiler
+    try:
+        from pymongo import monitoring
+        monitoring.register(_mongo_listener())
+    except ImportError:
+        pass
+    if path:
+        atexit.register(write)
+
+
+def add_arguments(parser):
+    parser.add_argument("--metrics", default=None,
+                        help="Write metrics to this file (.prom/.txt Prometheus text, .jsonl JSON lines)")
+    parser.add_argument("--profile", default=None, metavar="DIR", help="Profile each stage into DIR")
+    parser.add_argument("--profiler", choices=("cprofile", "pyinstrument"), default="cprofile")
+
+
+def configure_from_args(args):
+    configure(args.metrics, args.profile, args.profiler)
+
+
+@contextmanager
+def _profiled(name):
+    if not REGISTRY.profile_dir:
+        yield
+        return
+    os.makedirs(REGISTRY.profile_dir, exist_ok=True)
+    if REGISTRY.profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(os.path.join(REGISTRY.profile_dir, f"{name}.html"), "w", encoding="utf-8") as fh:
+                fh.write(profiler.output_html())
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(REGISTRY.profile_dir, f"{name}.prof"))
+
+
+@contextmanager
+def stage(name):
+    """Time a stage; metrics recorded inside it get a stage=<name> label."""
+    previous = REGISTRY.current_stage
+    REGISTRY.current_stage = name
+    start = time.perf_counter()
+    try:
+        with _profiled(name):
+            yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, buckets=STAGE_BUCKETS)
+        rss = peak_rss_bytes()
+        if rss is not None:
+            set_gauge("peak_rss_bytes", rss)
+        REGISTRY.current_stage = previous
+        if REGISTRY.path:
+            write()
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def prometheus_text():
+    lines = []
+    for (name, labels), value in sorted(REGISTRY.counters.items()):
+        lines.append(f"ioc_{name}{_labels(labels)} {value}")
+    for (name, labels), value in sorted(REGISTRY.gauges.items()):
+        lines.append(f"ioc_{name}{_labels(labels)} {value}")
+    for (name, labels), hist in sorted(REGISTRY.histograms.items()):
+        cumulative = 0
+        for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+            cumulative += count
+            lines.append(f"ioc_{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"ioc_{name}_sum{_labels(labels)} {hist.sum}")
+        lines.append(f"ioc_{name}_count{_labels(labels)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+
+def json_lines():
+    ts = time.time()
+    rows = []
+    for kind, items in (("counter", REGISTRY.counters), ("gauge", REGISTRY.gauges)):
+        for (name, labels), value in sorted(items.items()):
+            rows.append({"ts": ts, "type": kind, "name": name, "labels": dict(labels), "value": value})
+    for (name, labels), hist in sorted(REGISTRY.histograms.items()):
+        rows.append({"ts": ts, "type": "histogram", "name": name, "labels": dict(labels),
+                     "buckets": list(hist.buckets), "counts": hist.counts, "sum": hist.sum, "count": hist.count})
+    return "".join(json.dumps(r) + "\n" for r in rows)
+
+
+def write(path=None):
+    """Write a snapshot of every metric to path (default: the configured --metrics file)."""
+    path = path or REGISTRY.path
+    if not path:
+        return
+    text = json_lines() if path.endswith(".jsonl") else prometheus_text()
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(path + ".tmp", path)
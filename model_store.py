@@ -0,0 +1,57 @@
+"""
+Save and load fitted models together with everything needed to score.
+
+A bundle is a dict holding the fitted encoder and estimator, the input
+columns they expect (categorical / numeric, plus the final feature column
+order), the lexical featurizer if the model uses one, and a version tag. Bundles are written with joblib; score_iocs.py
+stamps every score with the bundle's version so newer models can find and
+rescore documents scored by older ones.
+"""
+import os
+from datetime import datetime, timezone
+import joblib
+import sklearn
+
+MODEL_DIR = "models"
+
+
+def default_path(kind):
+    return os.path.join(MODEL_DIR, f"{kind}.joblib")
+
+
+def new_version(kind):
+    return f"{kind}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+
+def save_model(path, kind, model, columns, encoder=None, categorical=(), numeric=(), version=None, lexical=None):
+    """Serialize a fitted model bundle; returns its version tag."""
+    bundle = {
+        "kind": kind,
+        "version": version or new_version(kind),
+        "created_at": datetime.now(timezone.utc),
+        "sklearn_version": sklearn.__version__,
+        "model": model,
+        "encoder": encoder,
+        "categorical": list(categorical),
+        "numeric": list(numeric),
+        "columns": list(columns),
+        # lexical_features.LexicalFeaturizer for models trained with --lexical
+        "lexical": lexical,
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    joblib.dump(bundle, tmp)
+    # readers never see a half-written file
+    os.replace(tmp, path)
+    print(f"Saved {kind} model {bundle['version']} to {path}")
+    return bundle["version"]
+
+
+def load_model(path, kind=None):
+    bundle = joblib.load(path)
+    if kind and bundle.get("kind") != kind:
+        raise ValueError(f"{path} holds a {bundle.get('kind')!r} model, expected {kind!r}")
+    if bundle.get("sklearn_version") != sklearn.__version__:
+        print(f"Warning: {path} was saved with scikit-learn {bundle.get('sklearn_version')}, "
+              f"running {sklearn.__version__}")
+    return bundle
@@ -0,0 +1,106 @@
+"""
+Parquet output for the processed_iocs exports.
+
+Both export_processed_to_csv.py and feature_extraction_advanced.py can write
+Parquet instead of CSV. Columns keep their CSV names, so the training
+scripts select the same feature columns. Each export has an explicit schema:
+ - timestamps stay timestamps (UTC)
+ - counts stay nullable integers instead of turning into floats
+ - ioc_type/threat_type/malware/reporter are dictionary (categorical) encoded
+
+Rows are written one row group per batch, so an export of millions of IOCs
+only ever holds one batch in memory.
+"""
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp("ms", tz="UTC")
+
+BASE_FIELDS = [
+    ("value", pa.string()),
+    ("ioc_type", CATEGORY),
+    ("first_seen", TIMESTAMP),
+    ("last_seen", TIMESTAMP),
+    ("malware", CATEGORY),
+    ("threat_type", CATEGORY),
+    ("reporter", CATEGORY),
+    ("features.confidence", pa.int32()),
+    ("features.has_malware", pa.int8()),
+    ("features.ioc_type", CATEGORY),
+    ("features.threat_type", CATEGORY),
+    ("features.days_since_first_seen", pa.int32()),
+]
+
+PROCESSED_SCHEMA = pa.schema(BASE_FIELDS)
+
+ADVANCED_SCHEMA = pa.schema(BASE_FIELDS + [
+    ("features.days_since_last_seen", pa.int32()),
+    ("features.seen_duration_days", pa.int32()),
+    ("domain_tld", CATEGORY),
+    ("domain_length", pa.int32()),
+    ("domain_digits", pa.int32()),
+    ("domain_hyphens", pa.int32()),
+    ("ip_octets", pa.int8()),
+    ("ip_port", pa.int32()),
+])
+
+
+def _clean(values, arrow_type):
+    # the CSV paths use "" for "not applicable"; Parquet uses nulls
+    if pa.types.is_integer(arrow_type):
+        out = []
+        for v in values:
+            if v is None or v == "":
+                out.append(None)
+                continue
+            try:
+                out.append(int(v))
+            except (TypeError, ValueError):
+                out.append(None)
+        return out
+    if arrow_type == pa.string() or pa.types.is_dictionary(arrow_type):
+        return [None if v is None or v == "" else str(v) for v in values]
+    return [v if v != "" else None for v in values]
+
+
+def table_from_columns(columns, schema):
+    """Build a Table from {column name: list of values} using the explicit schema."""
+    arrays = [pa.array(_clean(columns[f.name], f.type), type=f.type) for f in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def table_from_rows(rows, schema):
+    """Same as table_from_columns() for row lists in schema column order."""
+    columns = dict(zip(schema.names, (list(col) for col in zip(*rows)))) if rows else {n: [] for n in schema.names}
+    return table_from_columns(columns, schema)
+
+
+class ParquetBatchWriter:
+    """Write one row group per batch to a Parquet file with a fixed schema."""
+
+    def __init__(self, path, schema, compression="zstd"):
+        self.schema = schema
+        self.rows = 0
+        self._writer = pq.ParquetWriter(path, schema, compression=compression)
+
+    def write_rows(self, rows):
+        if rows:
+            self._write(table_from_rows(rows, self.schema))
+
+    def write_columns(self, columns):
+        self._write(table_from_columns(columns, self.schema))
+
+    def _write(self, table):
+        if table.num_rows:
+            self._writer.write_table(table)
+            self.rows += table.num_rows
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,211 @@
+"""
+Run fetch -> import -> ETL -> features -> (train) -> score in one process.
+
+All stages share one MongoClient (one connection pool). Instead of each
+script rescanning MongoDB or round-tripping through CSV, every stage hands
+its changed-record set to the next one in memory:
+ - import   the threatfox_ids of events whose content changed
+ - etl      the processed_iocs documents built from those events
+ - features the advanced feature frame of those documents
+ - score    scores just those documents with the saved model
+Training is opt-in (--train); it is the one stage that needs the whole
+dataset, so it loads processed_iocs once through the shared pool.
+
+Stages form a small DAG; selecting a stage pulls in the stages it needs.
+Per-stage timings and record counts are printed at the end; --metrics and
+--profile record the same per-stage metrics as the standalone scripts.
+
+Run:
+  python3 pipeline.py
+  python3 pipeline.py --no-fetch --dir VAMF
+  python3 pipeline.py --train --features-output processed_iocs_delta.parquet
+  python3 pipeline.py --stages etl --no-fetch
+"""
+import argparse
+import os
+import time
+from pymongo import MongoClient
+import metrics
+
+DEFAULT_STAGES = ("fetch", "import", "etl", "features", "score")
+
+
+class Stage:
+    def __init__(self, name, run, needs=()):
+        self.name = name
+        self.run = run
+        # stages pulled into the plan with this one
+        self.needs = needs
+
+
+class Context:
+    def __init__(self, db, args):
+        self.db = db
+        self.args = args
+        self.outputs = {}
+        self.timings = []
+
+
+# ---------------------------
+# Stages
+# ---------------------------
+def fetch_stage(ctx):
+    from fetch_and_import import fetch_recent_json
+
+    path = fetch_recent_json(ctx.args.dir, ctx.args.url)
+    return [path] if path else []
+
+
+def import_stage(ctx):
+    from threatfox_importer import get_collections, ensure_indexes, import_file, file_sort_key
+
+    if "fetch" in ctx.outputs:
+        paths = ctx.outputs["fetch"]
+    else:
+        # no fetch in this run: offer every dump, the ledger skips imported ones
+        paths = sorted((os.path.join(ctx.args.dir, f) for f in os.listdir(ctx.args.dir) if f.endswith(".json")),
+                       key=file_sort_key)
+    colls = get_collections(ctx.db)
+    ensure_indexes(colls)
+    changed = set()
+    for path in paths:
+        import_file(path, colls, ctx.args.batch_size, stream=True, changed=changed)
+    if ctx.args.index and changed:
+        from ioc_index import refresh
+        refresh(ctx.db, ctx.args.index)
+    return sorted(k[0] for k in changed)
+
+
+def etl_stage(ctx):
+    from etl_preprocess import run_events
+
+    return run_events(ctx.db, ctx.outputs["import"], ctx.args.batch_size)
+
+
+def features_stage(ctx):
+    from feature_extraction_advanced import fields, frame_from_docs, columnar_features
+
+    docs = ctx.outputs["etl"]
+    df = columnar_features(frame_from_docs(docs))
+    out = ctx.args.features_output
+    if out and docs:
+        if out.endswith(".parquet"):
+            from parquet_export import ADVANCED_SCHEMA, ParquetBatchWriter
+            with ParquetBatchWriter(out, ADVANCED_SCHEMA) as writer:
+                writer.write_columns({f: df[f].tolist() for f in fields})
+        else:
+            df[fields].to_csv(out, index=False)
+        print(f"Wrote features of {len(df)} changed IOCs to {out}")
+    return df
+
+
+def train_stage(ctx):
+    from ioc_loader import load_dataframe
+    from train_baseline_model import LOAD_FIELDS, train
+
+    df = load_dataframe(ctx.db["processed_iocs"], LOAD_FIELDS)
+    print(f"Loaded {len(df)} IOCs from MongoDB")
+    return train(df, ctx.args.model_path)
+
+
+def score_stage(ctx):
+    from model_store import load_model
+    from score_iocs import score_docs, score_collection
+
+    if not os.path.exists(ctx.args.model_path):
+        print(f"No model at {ctx.args.model_path}; skipping scoring (run with --train)")
+        return 0
+    bundle = load_model(ctx.args.model_path)
+    coll = ctx.db["processed_iocs"]
+    if "train" in ctx.outputs:
+        # a new model version: everything needs its score
+        return score_collection(coll, bundle)
+    return score_docs(coll, bundle, ctx.outputs["etl"])
+
+
+# listed in run order: fetch and train are optional, the rest follow their needs
+STAGES = [
+    Stage("fetch", fetch_stage),
+    Stage("import", import_stage),
+    Stage("etl", etl_stage, needs=("import",)),
+    Stage("features", features_stage, needs=("etl",)),
+    Stage("train", train_stage),
+    Stage("score", score_stage, needs=("etl",)),
+]
+STAGES_BY_NAME = {s.name: s for s in STAGES}
+
+
+def plan(selected):
+    """Selected stages plus everything they need, in DAG order."""
+    wanted = set()
+
+    def add(name):
+        if name not in wanted:
+            wanted.add(name)
+            for dep in STAGES_BY_NAME[name].needs:
+                add(dep)
+    for name in selected:
+        add(name)
+    return [s for s in STAGES if s.name in wanted]
+
+
+def size_of(output):
+    if output is None:
+        return ""
+    if hasattr(output, "__len__") and not isinstance(output, str):
+        return len(output)
+    return output
+
+
+def run_pipeline(db, args, stages):
+    ctx = Context(db, args)
+    for stage in plan(stages):
+        print(f"==> {stage.name}")
+        start = time.perf_counter()
+        with metrics.stage(stage.name):
+            ctx.outputs[stage.name] = stage.run(ctx)
+        ctx.timings.append((stage.name, time.perf_counter() - start, size_of(ctx.outputs[stage.name])))
+    return ctx
+
+
+def report(ctx):
+    total = sum(t for _, t, _ in ctx.timings)
+    print("\nStage       seconds   output")
+    for name, seconds, size in ctx.timings:
+        print(f"{name:<10} {seconds:8.2f}   {size}")
+    print(f"{'total':<10} {total:8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", nargs="+", choices=[s.name for s in STAGES], default=None,
+                        help=f"Stages to run (default {' '.join(DEFAULT_STAGES)}); needed stages are added")
+    parser.add_argument("--no-fetch", action="store_true", help="Import the dumps already in --dir")
+    parser.add_argument("--train", action="store_true", help="Retrain the baseline model before scoring")
+    parser.add_argument("--dir", default="VAMF", help="Directory holding ThreatFox dumps")
+    parser.add_argument("--url", default="https://threatfox.abuse.ch/export/json/recent/")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Bulk write / ETL batch size")
+    parser.add_argument("--features-output", default=None, help="CSV or .parquet file for the changed IOCs' features")
+    parser.add_argument("--model-path", default=os.path.join("models", "baseline.joblib"))
+    parser.add_argument("--index", default=None, help="Refresh this ioc_index.py file after importing")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+
+    stages = list(args.stages or DEFAULT_STAGES)
+    if args.no_fetch and "fetch" in stages:
+        stages.remove("fetch")
+    if args.train and "train" not in stages:
+        stages.append("train")
+
+    client = MongoClient(args.mongo_uri)
+    try:
+        ctx = run_pipeline(client["misp"], args, stages)
+    finally:
+        client.close()
+    report(ctx)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Recency features computed when IOCs are read, not when they are stored.
+
+processed_iocs documents hold only time-invariant values: first_seen,
+last_seen and features.seen_duration_days. days_since_first_seen and
+days_since_last_seen depend on the current date, so storing them meant
+rewriting every document daily to keep them right. Instead the export,
+feature extraction, training and scoring scripts derive them per batch with
+add_recency() (vectorized, one `now` per run); the row-based engines use
+days_since() with the same rounding (whole days, floored).
+"""
+from datetime import datetime, timezone
+import pandas as pd
+
+RECENCY_FIELDS = ["days_since_first_seen", "days_since_last_seen"]
+# processed_iocs fields add_recency() needs in the frame
+SOURCE_FIELDS = ["first_seen", "last_seen"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DAY = pd.Timedelta(days=1)
+
+
+def utc_now(now=None):
+    now = pd.Timestamp(now or datetime.now(timezone.utc))
+    return now.tz_localize("UTC") if now.tzinfo is None else now.tz_convert("UTC")
+
+
+def to_utc(col):
+    """Column of datetimes or "%Y-%m-%d %H:%M:%S" strings as tz-aware UTC; bad values become NaT."""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.dt.tz_localize("UTC") if col.dt.tz is None else col.dt.tz_convert("UTC")
+    return pd.to_datetime(col, format=TIMESTAMP_FORMAT, utc=True, errors="coerce")
+
+
+def _whole_days(delta):
+    # object column of ints, None where the timestamp was missing: the shape the stored values had
+    days = (delta // DAY).astype("Int64").astype(object)
+    return days.where(days.notna(), None)
+
+
+def add_recency(df, now=None, prefix="features."):
+    """Add <prefix>days_since_first_seen / days_since_last_seen columns computed from first_seen / last_seen."""
+    now = utc_now(now)
+    first_seen = to_utc(df["first_seen"])
+    last_seen = to_utc(df["last_seen"]) if "last_seen" in df else pd.Series(pd.NaT, index=df.index)
+    since_first = _whole_days(now - first_seen)
+    # no last_seen: the IOC was last seen when it was first seen
+    since_last = _whole_days(now - last_seen).where(last_seen.notna(), since_first)
+    df[prefix + "days_since_first_seen"] = since_first
+    df[prefix + "days_since_last_seen"] = since_last
+    return df
+
+
+def _as_utc(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value, TIMESTAMP_FORMAT)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def days_since(doc, now):
+    """(days_since_first_seen, days_since_last_seen) of one document, for row-at-a-time code."""
+    now = utc_now(now).to_pydatetime()
+    first_seen, last_seen = _as_utc(doc.get("first_seen")), _as_utc(doc.get("last_seen"))
+    since_first = (now - first_seen).days if first_seen else None
+    since_last = (now - last_seen).days if last_seen else since_first
+    return since_first, since_last
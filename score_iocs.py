@@ -0,0 +1,124 @@
+"""
+Score processed IOCs with a saved model and write the scores back.
+Usage:
+  python3 score_iocs.py
+  python3 score_iocs.py --model-path models/advanced.joblib --batch-size 50000
+  python3 score_iocs.py --all
+
+Only documents without a score from this model version are read (--all
+rescores everything). Each batch is featurized as a whole, predicted with
+one predict_proba() call and written back as one unordered bulk_write of
+{"score": {"high_risk", "probability", "version", "scored_at"}} updates.
+Recency features are computed from first_seen / last_seen as of scoring
+time (see recency.py).
+"""
+import argparse
+from datetime import datetime, timezone
+from pymongo import MongoClient, UpdateOne
+from ioc_loader import iter_batches, frame_from_docs
+from model_store import default_path, load_model
+
+DEFAULT_BATCH_SIZE = 50000
+
+
+def score_query(version, rescore_all=False):
+    return {} if rescore_all else {"score.version": {"$ne": version}}
+
+
+def baseline_matrix(bundle, docs, now=None):
+    from train_baseline_model import feature_frame, design_matrix
+
+    df = frame_from_docs(docs, source_fields("baseline"))
+    return design_matrix(feature_frame(df, now), bundle["encoder"])
+
+
+def advanced_matrix(bundle, docs, now=None):
+    from feature_extraction_advanced import frame_from_docs as advanced_frame, columnar_features
+
+    # same preparation as train_advanced_model.py
+    df = columnar_features(advanced_frame(docs, now))
+    if bundle.get("encoder") is not None:
+        from lexical_features import design_matrix
+        return design_matrix(df, bundle.get("lexical"), bundle["encoder"], bundle["numeric"], bundle["categorical"])
+    return df[bundle["columns"]].fillna(0)
+
+
+FEATURIZERS = {
+    "baseline": baseline_matrix,
+    "advanced": advanced_matrix,
+}
+
+
+def source_fields(kind):
+    if kind == "baseline":
+        from train_baseline_model import STORED_FEATURE_FIELDS
+        return ["first_seen", "last_seen"] + ["features." + f for f in STORED_FEATURE_FIELDS]
+    from feature_extraction_advanced import SOURCE_FIELDS
+    return SOURCE_FIELDS
+
+
+def positive_probabilities(model, X):
+    proba = model.predict_proba(X)
+    classes = list(model.classes_)
+    if 1 not in classes:
+        return [0.0] * X.shape[0]
+    return proba[:, classes.index(1)].tolist()
+
+
+def score_ops(bundle, docs, key_fields, now=None):
+    """UpdateOne per document, keyed on key_fields, with the model's score."""
+    featurize = FEATURIZERS.get(bundle["kind"])
+    if featurize is None:
+        raise ValueError(f"Don't know how to featurize {bundle['kind']!r} models")
+    now = now or datetime.now(timezone.utc)
+    probabilities = positive_probabilities(bundle["model"], featurize(bundle, docs, now))
+    return [
+        UpdateOne({f: d[f] for f in key_fields}, {"$set": {"score": {
+            "high_risk": int(p >= 0.5),
+            "probability": p,
+            "version": bundle["version"],
+            "scored_at": now,
+        }}})
+        for d, p in zip(docs, probabilities)
+    ]
+
+
+def score_docs(coll, bundle, docs, batch_size=DEFAULT_BATCH_SIZE):
+    """Score in-memory processed_iocs documents (e.g. fresh ETL output), matched on (value, ioc_type)."""
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start + batch_size]
+        coll.bulk_write(score_ops(bundle, batch, ("value", "ioc_type")), ordered=False)
+    return len(docs)
+
+
+def score_collection(coll, bundle, batch_size=DEFAULT_BATCH_SIZE, rescore_all=False):
+    """Score every unscored document; returns the number of documents scored."""
+    fields = ["_id"] + source_fields(bundle["kind"])
+    scored = 0
+    for docs in iter_batches(coll, fields, batch_size, score_query(bundle["version"], rescore_all)):
+        ops = score_ops(bundle, docs, ("_id",))
+        coll.bulk_write(ops, ordered=False)
+        scored += len(ops)
+        print(f"Scored {scored} IOCs...")
+    return scored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-path", default=default_path("baseline"),
+                        help="Bundle saved by train_baseline_model.py or train_advanced_model.py")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Documents per predict_proba() call and bulk_write")
+    parser.add_argument("--all", action="store_true", help="Rescore documents already scored by this version")
+    args = parser.parse_args(argv)
+
+    bundle = load_model(args.model_path)
+    client = MongoClient("mongodb://localhost:27017/")
+    coll = client["misp"]["processed_iocs"]
+
+    scored = score_collection(coll, bundle, args.batch_size, args.all)
+    print(f"Done. Scored {scored} IOCs with {bundle['kind']} model {bundle['version']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Both ETL engines against documents recorded for tests/fixtures/etl_events.json.
+
+The aggregate engine needs a real server (mongomock lacks $type /
+$dateFromString); set MONGODB_URI to run it, e.g. in CI with a mongo
+service container.
+"""
+import os
+
+import pytest
+from bson import json_util
+from bson.json_util import JSONOptions
+
+import etl_preprocess
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+FIELDS = ("value", "ioc_type", "first_seen", "last_seen", "malware", "threat_type", "reporter", "features")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as fh:
+        # pymongo hands dates back naive (UTC)
+        return json_util.loads(fh.read(), json_options=JSONOptions(tz_aware=False))
+
+
+def assert_matches_recorded(coll):
+    expected = {doc["value"]: doc for doc in load_fixture("etl_expected.json")}
+    docs = {doc["value"]: doc for doc in coll.find({}, {"_id": 0})}
+    assert sorted(docs) == sorted(expected)
+    for value, doc in docs.items():
+        for field in FIELDS:
+            assert doc.get(field) == expected[value][field], (value, field)
+        assert set(doc) == set(FIELDS), value
+
+
+def test_python_engine_matches_recorded_documents(db):
+    db["iocs"].insert_many(load_fixture("etl_events.json"))
+    assert etl_preprocess.run(db, 0) == 4
+    assert_matches_recorded(db["processed_iocs"])
+
+
+@pytest.fixture
+def server_db():
+    uri = os.environ.get("MONGODB_URI")
+    if not uri:
+        pytest.skip("MONGODB_URI not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    db = client["etl_engines_test"]
+    client.drop_database(db.name)
+    yield db
+    client.drop_database(db.name)
+    client.close()
+
+
+def test_aggregate_engine_matches_recorded_documents(server_db):
+    server_db["iocs"].insert_many(load_fixture("etl_events.json"))
+    assert etl_preprocess.run_aggregate(server_db, 0) == 3
+    assert_matches_recorded(server_db["processed_iocs"])
+
+
+def test_engines_agree(server_db):
+    server_db["iocs"].insert_many(load_fixture("etl_events.json"))
+    assert etl_preprocess.verify_engines(server_db, 0) == 0
+
+
+def test_aggregate_records_a_write_only_when_documents_change(server_db):
+    server_db["iocs"].insert_many(load_fixture("etl_events.json"))
+    written = server_db["etl_state"]
+    etl_preprocess.run_aggregate(server_db, 0)
+    assert written.find_one({"_id": etl_preprocess.WRITTEN_PREFIX + "processed_iocs"})["writes"] == 1
+    etl_preprocess.run_aggregate(server_db, 0)
+    assert written.find_one({"_id": etl_preprocess.WRITTEN_PREFIX + "processed_iocs"})["writes"] == 1
+
+
+def test_aggregate_drains_fewer_pending_events_than_the_limit(server_db):
+    server_db["iocs"].insert_many(load_fixture("etl_events.json"))
+    assert etl_preprocess.run_aggregate(server_db, 100, incremental=True, settle=0) == 3
+    assert etl_preprocess.load_watermark(server_db["etl_state"])["threatfox_id"] == "103"
+    assert etl_preprocess.run_aggregate(server_db, 100, incremental=True, settle=0) == 0
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+import etl_preprocess
+import threatfox_importer
+
+
+def import_events(db, items):
+    buffers = threatfox_importer.new_buffers(threatfox_importer.get_collections(db))
+    for event, attrs in threatfox_importer.normalize_items(items):
+        buffers["events"].add(event)
+    buffers["events"].flush()
+
+
+def test_event_timestamp_is_write_time(db):
+    before = datetime.utcnow()
+    import_events(db, [("1", [{"ioc_value": "a.example", "ioc_type": "domain"}])])
+    assert db["iocs"].find_one()["timestamp"] >= before.replace(microsecond=0)
+
+
+def test_incremental_leaves_unsettled_events(db):
+    import_events(db, [("1", [{"ioc_value": "a.example", "ioc_type": "domain"}])])
+    assert etl_preprocess.run(db, 0, incremental=True) == 0
+    later = datetime.now(timezone.utc) + timedelta(seconds=etl_preprocess.DEFAULT_SETTLE_SECONDS + 1)
+    assert etl_preprocess.run(db, 0, incremental=True, now=later) == 1
+    assert etl_preprocess.run(db, 0, incremental=True, now=later) == 0
+
+
+def insert_events(db, n, timestamp):
+    db["iocs"].insert_many([{"threatfox_id": f"{i:03d}", "timestamp": timestamp,
+                             "Attribute": [{"value": f"ioc{i}.example", "type": "domain"}]}
+                            for i in range(n)])
+
+
+def test_last_pending_event_when_fewer_than_limit_are_pending(db):
+    insert_events(db, 5, datetime(2024, 1, 1))
+    query = etl_preprocess.incremental_query({})
+    assert etl_preprocess.last_pending_event(db["iocs"], query, 100)["threatfox_id"] == "004"
+    assert etl_preprocess.last_pending_event(db["iocs"], query, 2)["threatfox_id"] == "001"
+    assert etl_preprocess.last_pending_event(db["iocs"], query, 0)["threatfox_id"] == "004"
+    assert etl_preprocess.last_pending_event(db["iocs"], {"threatfox_id": "999"}, 100) is None
+
+
+def test_limited_run_breaks_timestamp_ties_on_threatfox_id(db):
+    # one flush batch: every event carries the same timestamp
+    insert_events(db, 5, datetime(2024, 1, 1))
+    assert etl_preprocess.run(db, 2) == 2
+    assert sorted(d["value"] for d in db["processed_iocs"].find()) == ["ioc3.example", "ioc4.example"]
@@ -0,0 +1,42 @@
+import argparse
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+import feature_cache
+
+
+def test_store_chunks_appends_arrays_and_csr_rows(tmp_path):
+    cache = feature_cache.FeatureCache(str(tmp_path))
+    rng = np.random.default_rng(0)
+    chunks = [{"X": sp.random(n, 40, density=0.1, format="csr", random_state=n),
+               "y": rng.integers(0, 2, n),
+               "seen": np.array(["2024-01-01", "NaT"] * (n // 2), dtype="datetime64[ns]"),
+               "names": ["a", "b"]}
+              for n in (6, 0, 10)]
+    cache.store_chunks("test", {"k": 1}, iter(chunks))
+
+    entry = cache.load("test", {"k": 1})
+    assert (entry["X"] != sp.vstack([c["X"] for c in chunks])).nnz == 0
+    assert entry["X"].shape == (16, 40)
+    np.testing.assert_array_equal(entry["y"], np.concatenate([c["y"] for c in chunks]))
+    np.testing.assert_array_equal(entry["seen"], np.concatenate([c["seen"] for c in chunks]))
+    assert entry["names"] == ["a", "b"]
+
+
+def test_cached_returns_the_entry_it_stores(tmp_path):
+    cache = feature_cache.FeatureCache(str(tmp_path), keep=1)
+    for version in range(3):
+        entry = feature_cache.cached(cache, "test", {"v": version}, lambda: {"y": np.arange(version + 1)})
+        np.testing.assert_array_equal(entry["y"], np.arange(version + 1))
+    assert len(cache.entries("test")) == 1
+
+
+def test_keep_below_one_is_rejected():
+    with pytest.raises(ValueError):
+        feature_cache.FeatureCache(keep=0)
+    parser = argparse.ArgumentParser()
+    feature_cache.add_arguments(parser)
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--cache-keep", "0"])
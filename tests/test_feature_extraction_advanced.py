@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pandas as pd
+
+import feature_extraction_advanced as fea
+
+NOW = pd.Timestamp("2024-02-01", tz="UTC")
+DOCS = [
+    {"value": "evil-1.example", "ioc_type": "domain", "first_seen": datetime(2024, 1, 1),
+     "features": {"confidence": 50, "has_malware": 1, "ioc_type": "domain", "threat_type": "botnet_cc"}},
+    {"value": "1.2.3.4:80", "ioc_type": "ip", "last_seen": datetime(2024, 1, 30), "features": {}},
+    {"value": None, "ioc_type": "domain", "features": {}},
+    {"ioc_type": "domain", "features": {}},
+    {"value": None, "ioc_type": "ip", "features": {}},
+    {"value": "orphan.example", "ioc_type": None, "features": {}},
+]
+
+
+def cells(row):
+    # both writers render None and "" alike (csv: empty cell, parquet_export: null)
+    return ["" if v is None else v for v in row]
+
+
+def test_engines_agree_on_missing_and_null_values():
+    rows = [fea.row_for(doc, NOW) for doc in DOCS]
+    df = fea.columnar_features(fea.frame_from_docs(DOCS, NOW))
+    columnar = [list(row) for row in zip(*(df[f].tolist() for f in fea.fields))]
+    assert [cells(r) for r in columnar] == [cells(r) for r in rows]
+    assert rows[2][:2] == ["", "domain"]
+    assert rows[2][fea.fields.index("domain_length")] == 0
+    assert rows[4][fea.fields.index("ip_octets")] == 1
+    assert rows[5][:2] == ["orphan.example", ""]
+
+
+def test_columnar_features_fill_null_values_before_str():
+    df = pd.DataFrame({"value": pd.Series([None, "a-b.example"], dtype=object), "ioc_type": ["domain"] * 2})
+    df = fea.columnar_features(df)
+    assert df["domain_length"].tolist() == [0, 11]
+    assert df["domain_tld"].tolist() == ["", "example"]
@@ -0,0 +1,26 @@
+import json
+import os
+
+import generate_threatfox_dump as gen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_documented_mix_matches_the_templates():
+    mix = gen.type_mix(gen.load_templates(os.path.join(ROOT, gen.DEFAULT_TEMPLATE_DIR)))
+    hashes = sum(share for ioc_type, share in mix.items() if ioc_type.endswith("_hash"))
+    # the shares quoted in the module docstring
+    assert round(mix["ip:port"] * 100) == 59
+    assert round(mix["domain"] * 100) == 15
+    assert round(hashes * 100) == 20
+    assert round(mix["url"] * 100) == 6
+
+
+def test_generated_dump_follows_the_template_mix(tmp_path):
+    templates = gen.load_templates(os.path.join(ROOT, gen.DEFAULT_TEMPLATE_DIR))
+    (path,) = gen.generate(str(tmp_path), 20000, template_dir=os.path.join(ROOT, gen.DEFAULT_TEMPLATE_DIR))
+    with open(path, encoding="utf-8") as fh:
+        records = [r for recs in json.load(fh).values() for r in recs]
+    generated = gen.type_mix(records)
+    for ioc_type, share in gen.type_mix(templates).items():
+        assert abs(generated[ioc_type] - share) < 0.02, ioc_type
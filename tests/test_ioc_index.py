@@ -0,0 +1,31 @@
+import ioc_index
+from ip_ranges import ip_fields
+
+
+def add_ip(db, value):
+    db["ioc_ips"].insert_one(dict({"value": value, "type": "ip:port"}, **ip_fields(value)))
+
+
+def test_normalize_strips_ports():
+    assert ioc_index.normalize("1.2.3.4:80") == "1.2.3.4"
+    assert ioc_index.normalize(" 1.2.3.4 ") == "1.2.3.4"
+    assert ioc_index.normalize("[2001:DB8::1]:443") == "2001:db8::1"
+    assert ioc_index.normalize("Evil.Example") == "evil.example"
+    assert ioc_index.normalize("1.example") == "1.example"
+
+
+def test_bare_address_finds_ip_port_attribute(db, tmp_path):
+    add_ip(db, "1.2.3.4:80")
+    db["ioc_domains"].insert_one({"value": "evil.example", "type": "domain"})
+    path = str(tmp_path / "index.bin")
+    ioc_index.build(db, path)
+    index = ioc_index.IocIndex.open(path)
+    assert index.lookup(["1.2.3.4", "1.2.3.4:443", "evil.example", "5.6.7.8"]).tolist() == [2, 2, 1, 0]
+
+
+def test_refresh_rebuilds_old_format(db, tmp_path):
+    add_ip(db, "1.2.3.4:80")
+    path = tmp_path / "index.bin"
+    path.write_bytes(b"IOCIDX01" + bytes(16))
+    ioc_index.refresh(db, str(path))
+    assert ioc_index.IocIndex.open(str(path)).contains(["1.2.3.4"]).tolist() == [True]
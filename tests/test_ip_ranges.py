@@ -0,0 +1,78 @@
+import ipaddress
+
+import pytest
+
+import ip_ranges
+
+V4_NET = "10.1.2.0/24"
+V6_NET = "2001:db8::/64"
+INSIDE = ["10.1.2.0", "10.1.2.1:80", "10.1.2.255:443", "2001:db8::", "[2001:db8::ffff:ffff:ffff:ffff]:8080",
+          # IPv4-mapped IPv6 is the IPv4 host
+          "[::ffff:10.1.2.5]:80"]
+OUTSIDE = ["10.1.1.255", "10.1.3.0", "2001:db8:0:1::", "2001:db7:ffff:ffff:ffff:ffff:ffff:ffff"]
+
+
+@pytest.mark.parametrize("value, ip, port", [
+    ("1.2.3.4", "1.2.3.4", None),
+    ("1.2.3.4:443", "1.2.3.4", 443),
+    ("[2001:db8::1]:80", "2001:db8::1", 80),
+    ("2001:db8::1", "2001:db8::1", None),
+    ("[::ffff:1.2.3.4]:80", "1.2.3.4", 80),
+    ("evil.example:80", None, None),
+    ("", None, None),
+])
+def test_parse_ip_port(value, ip, port):
+    parsed, parsed_port = ip_ranges.parse_ip_port(value)
+    assert (str(parsed) if parsed else None, parsed_port) == (ip, port)
+
+
+def test_ipv4_is_stored_ipv4_mapped_and_round_trips():
+    fields = ip_ranges.ip_fields("192.0.2.7:8080")
+    assert fields == {"ip": "192.0.2.7", "ip_version": 4, "port": 8080,
+                      "ip_bin": bytes(10) + b"\xff\xff" + bytes([192, 0, 2, 7])}
+    assert ipaddress.IPv6Address(fields["ip_bin"]).ipv4_mapped == ipaddress.IPv4Address("192.0.2.7")
+    for ip in ("0.0.0.0", "255.255.255.255"):
+        assert ipaddress.IPv6Address(ip_ranges.ip_fields(ip)["ip_bin"]).ipv4_mapped == ipaddress.IPv4Address(ip)
+    mapped = ip_ranges.ip_fields("::ffff:192.0.2.7")
+    assert (mapped["ip"], mapped["ip_version"], mapped["ip_bin"]) == ("192.0.2.7", 4, fields["ip_bin"])
+
+
+def test_ipv6_is_stored_as_is():
+    fields = ip_ranges.ip_fields("[2001:db8::1]:443")
+    assert fields["ip_version"] == 6
+    assert fields["ip_bin"] == ipaddress.IPv6Address("2001:db8::1").packed
+
+
+def bin_of(value):
+    return int.from_bytes(ip_ranges.ip_fields(value)["ip_bin"], "big")
+
+
+@pytest.mark.parametrize("cidr", [V4_NET, V6_NET])
+def test_network_bounds_include_network_and_broadcast_only(cidr):
+    lo, hi = ip_ranges.network_bounds(cidr)
+    net = ipaddress.ip_network(cidr)
+    assert lo == bin_of(str(net.network_address))
+    assert hi == bin_of(str(net.broadcast_address))
+    assert bin_of(str(net.network_address - 1)) < lo
+    assert bin_of(str(net.broadcast_address + 1)) > hi
+
+
+def test_cidr_query_matches_boundaries(db):
+    coll = db["ioc_ips"]
+    coll.insert_many([dict(ip_ranges.ip_fields(v), value=v) for v in INSIDE + OUTSIDE])
+    for cidr in (V4_NET, V6_NET):
+        found = {d["value"] for d in coll.find(ip_ranges.cidr_query(cidr))}
+        net = ipaddress.ip_network(cidr)
+        assert found == {v for v in INSIDE if ip_ranges.parse_ip_port(v)[0] in net}
+    # a single address is a /32
+    assert [d["value"] for d in coll.find(ip_ranges.cidr_query("10.1.2.255"))] == ["10.1.2.255:443"]
+
+
+def test_range_index_containment_and_networks():
+    index = ip_ranges.IpRangeIndex.from_values(INSIDE + OUTSIDE)
+    assert len(index) == len(INSIDE + OUTSIDE)
+    assert index.contains(["10.1.2.255", "10.1.2.254", "2001:db8::", "2001:db8::1", "junk"]).tolist() == \
+        [True, False, True, False, False]
+    assert index.in_network(V4_NET) == ["10.1.2.0", "10.1.2.1:80", "[::ffff:10.1.2.5]:80", "10.1.2.255:443"]
+    assert index.in_network(V6_NET) == ["2001:db8::", "[2001:db8::ffff:ffff:ffff:ffff]:8080"]
+    assert index.subnet_counts(24) == {"10.1.1.0/24": 1, "10.1.2.0/24": 4, "10.1.3.0/24": 1}
@@ -0,0 +1,11 @@
+import hash_store
+import loadtest_lookup
+
+SHA256 = "dc09d93c6815646ab07908d02c810efd668179f2fb43237c588657171f06a762"
+
+
+def test_sample_values_reads_hash_digests(db):
+    db["ioc_domains"].insert_one({"value": "evil.example", "type": "domain"})
+    db["ioc_hashes"].insert_one(hash_store.hash_doc({"value": SHA256, "type": "sha256_hash"}))
+    assert "value" not in db["ioc_hashes"].find_one()
+    assert sorted(loadtest_lookup.sample_values(db, 3)) == sorted(["evil.example", SHA256])
@@ -0,0 +1,34 @@
+import asyncio
+
+import lookup_service
+from ip_ranges import ip_fields
+
+
+def add_ip(db, value):
+    db["ioc_ips"].insert_one(dict({"value": value, "type": "ip:port"}, **ip_fields(value)))
+
+
+def lookup(service, values):
+    return asyncio.run(service.lookup(values))
+
+
+def test_bare_address_matches_every_port(db):
+    add_ip(db, "1.2.3.4:80")
+    add_ip(db, "1.2.3.4:443")
+    db["processed_iocs"].insert_one({"value": "1.2.3.4:443", "score": {"probability": 0.9}})
+    service = lookup_service.LookupService(db)
+    service.index = lookup_service.build_index(db)
+    bare, other, miss = lookup(service, ["1.2.3.4", "1.2.3.4:8080", "5.6.7.8"])
+    assert bare["found"] and bare["value"] == "1.2.3.4"
+    assert sorted(m["value"] for m in bare["matches"]) == ["1.2.3.4:443", "1.2.3.4:80"]
+    assert bare["score"] == {"probability": 0.9}
+    assert other["found"]
+    assert not miss["found"]
+
+
+def test_mongo_fallback_matches_bare_address(db):
+    service = lookup_service.LookupService(db, mongo_fallback=True)
+    service.index = {}
+    add_ip(db, "1.2.3.4:80")
+    (result,) = lookup(service, ["1.2.3.4"])
+    assert result["found"] and result["matches"][0]["value"] == "1.2.3.4:80"
@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import threatfox_importer
+
+
+def write_dump(directory, stamp, records):
+    path = os.path.join(directory, f"threatfox_recent_{stamp}.json")
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({tf_id: [rec] for tf_id, rec in records.items()}, fh)
+    return path
+
+
+def record(value, threat_type="botnet_cc"):
+    return {"ioc_value": value, "ioc_type": "domain", "threat_type": threat_type,
+            "first_seen_utc": "2024-01-01 00:00:00", "confidence_level": 50}
+
+
+def test_identical_dumps_in_one_batch_are_imported_once(db, tmp_path):
+    colls = threatfox_importer.get_collections(db)
+    first = write_dump(str(tmp_path), "20240101_000000", {"1": record("a.example")})
+    copy = str(tmp_path / "threatfox_recent_20240102_000000.json")
+    shutil.copy(first, copy)
+    other = write_dump(str(tmp_path), "20240103_000000", {"2": record("b.example")})
+    todo = threatfox_importer.dedupe_by_content([first, copy, other], colls)
+    assert [path for path, _ in todo] == [first, other]
+    assert all("sha256" in stat_doc for _, stat_doc in todo)
+
+
+def test_documents_record_their_export_time(db, tmp_path):
+    colls = threatfox_importer.get_collections(db)
+    path = write_dump(str(tmp_path), "20240101_120000", {"1": record("a.example")})
+    threatfox_importer.import_file(path, colls, stream=True)
+    assert colls["iocs"].find_one()["export_at"].isoformat() == "2024-01-01T12:00:00"
+    assert colls["domains"].find_one()["export_at"].isoformat() == "2024-01-01T12:00:00"
+
+
+def test_parallel_import_keeps_the_newest_export(tmp_path):
+    uri = os.environ.get("MONGODB_URI")
+    if not uri:
+        pytest.skip("MONGODB_URI not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    client.drop_database("importer_test")
+    colls = threatfox_importer.get_collections(client["importer_test"])
+    threatfox_importer.ensure_indexes(colls)
+    # the newer dump is big enough to be written first, the older one last
+    newer = write_dump(str(tmp_path), "20240102_000000",
+                       {str(i): record(f"n{i}.example") for i in range(2, 5000)} | {"1": record("a.example", "payload")})
+    older = write_dump(str(tmp_path), "20240101_000000", {"1": record("a.example")})
+    try:
+        threatfox_importer.import_parallel([newer, older], colls, 2, mongo_uri=uri)
+        assert colls["domains"].find_one({"value": "a.example"})["threat_type"] == "payload"
+        assert colls["iocs"].find_one({"threatfox_id": "1"})["Attribute"][0]["threat_type"] == "payload"
+    finally:
+        client.drop_database("importer_test")
+        client.close()
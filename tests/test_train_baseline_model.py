@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import feature_cache
+import train_baseline_model as baseline
+
+
+def insert_iocs(db, n=60):
+    now = datetime.utcnow()
+    db["processed_iocs"].insert_many([{
+        "value": f"ioc{i}.example",
+        "first_seen": now - timedelta(hours=12 * i),
+        "last_seen": now,
+        "malware": "win.emotet" if i % 4 == 0 else None,
+        "features": {"confidence": i % 100, "has_malware": int(i % 4 == 0),
+                     "ioc_type": ["domain", "url", "ip:port"][i % 3],
+                     "threat_type": None if i % 5 == 0 else "botnet_cc"},
+    } for i in range(n)])
+
+
+def test_cached_entry_is_built_chunk_by_chunk(db, tmp_path):
+    insert_iocs(db)
+    coll = db["processed_iocs"]
+    cache = feature_cache.FeatureCache(str(tmp_path))
+    prepared = baseline.load_prepared(coll, cache, chunk_size=7)
+
+    whole = baseline.prepare(baseline.load_dataframe(coll, baseline.LOAD_FIELDS))
+    assert prepared["onehot"].shape == whole["onehot"].shape
+    assert (prepared["onehot"] != whole["onehot"]).nnz == 0
+    np.testing.assert_array_equal(prepared["first_seen"], whole["first_seen"])
+    np.testing.assert_array_equal(prepared["stored"], whole["stored"])
+    assert list(prepared["encoder"].categories_[0]) == ["domain", "ip:port", "unknown", "url"]
+
+
+def test_incremental_training_streams_from_mongo(db, tmp_path):
+    insert_iocs(db)
+    coll = db["processed_iocs"]
+    encoder = baseline.collection_encoder(coll)
+    read = []
+
+    def chunks():
+        for chunk in baseline.streamed_chunks(coll, encoder, chunk_size=8)():
+            read.append(len(chunk["first_seen"]))
+            yield chunk
+
+    path = tmp_path / "baseline.joblib"
+    baseline.train_chunks(chunks, encoder, str(path), mode="incremental", epochs=2)
+    assert path.exists()
+    # scaler pass, two epochs and the evaluation pass, never more than a chunk at a time
+    assert max(read) == 8
+    assert sum(read) == 4 * 60
+
+
+def test_editing_this_module_invalidates_the_cache(db, tmp_path, monkeypatch, capsys):
+    insert_iocs(db)
+    coll = db["processed_iocs"]
+    cache = feature_cache.FeatureCache(str(tmp_path / "cache"))
+    baseline.load_prepared(coll, cache)
+    baseline.load_prepared(coll, cache)
+    assert "Feature cache hit" in capsys.readouterr().out
+
+    edited = tmp_path / "train_baseline_model.py"
+    edited.write_text(open(baseline.__file__, encoding="utf-8").read() + "\n# prepare() changed\n")
+    monkeypatch.setattr(baseline, "__file__", str(edited))
+    baseline.load_prepared(coll, cache)
+    assert "Stored baseline features" in capsys.readouterr().out
@@ -6,35 +6,90 @@ import attributes into MongoDB collections:
  - misp.iocs (one event per ThreatFox id)
  - misp.ioc_domains
  - misp.ioc_ips
- - misp.ioc_hashes
+ - misp.ioc_hashes (md5/sha1/sha256 hashes as binary digests, see hash_store.py)
 
-The script creates unique indexes on (value,type) for attribute collections
-and upserts attribute documents to avoid duplicates.
+The script creates unique indexes on (value,type) for domains and IPs and on
+the digest for hashes, and upserts attribute documents to avoid duplicates. Event and attribute
+upserts are flushed as unordered bulk writes of --batch-size operations.
+IP attributes also get normalized ip/ip_version/ip_bin/port fields
+(see ip_ranges.py), indexed for CIDR and range queries.
+
+Imports are incremental: misp.import_ledger records every imported file
+(path, size, mtime, sha256, ids) so unchanged dumps are skipped, and each
+event/attribute carries a content_hash so records that did not change since
+the last import generate no writes. Use --force to re-import ledgered files.
+
+Dumps are imported oldest first (by the timestamp in the file name), so the
+newest export wins; every document records its dump's export time in
+export_at. With --workers N, N processes each import a whole dump through
+their own client, streaming it like --stream, and hand back counts only,
+so memory stays flat whatever N is. As dumps are then written
+concurrently, those writes are update pipelines that keep a stored
+document coming from a later export (newest_wins_update()). Dumps with
+identical content are imported once per run.
+
+With --stream the id -> [records] mapping is parsed one entry at a time
+instead of json.load()-ing the whole dump, so memory stays flat for the
+full (hundreds of MB) ThreatFox exports.
+
+With --index PATH the memory-mapped membership index (see ioc_index.py) is
+refreshed with the newly imported values once all dumps are written.
 
 Run:
   python3 threatfox_importer.py
+  python3 threatfox_importer.py --stream --batch-size 5000
+  python3 threatfox_importer.py --force
+  python3 threatfox_importer.py --workers 4
+  python3 threatfox_importer.py --index ioc_index.bin
+  python3 threatfox_importer.py --metrics import.prom --profile profiles/
 
 """
+import argparse
+import hashlib
 import os
 import json
+import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+from ip_ranges import ip_fields, ensure_ip_index
+from hash_store import HASH_TYPES, hash_doc, ensure_hash_index
+import metrics
 
 VAMF_DIR = "/home/esra/misp_ioc/VAMF"
+MONGO_URI = "mongodb://localhost:27017/"
+DEFAULT_BATCH_SIZE = 1000
+STREAM_CHUNK_SIZE = 64 * 1024
+# ledger entries keep the imported ids only up to this many (16MB doc limit)
+LEDGER_MAX_IDS = 100000
+EVENT_VOLATILE = ("timestamp",)
+FILE_TS_RE = re.compile(r"(\d{8}_\d{6})")
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["misp"]
-collection_iocs = db["iocs"]
-domains_coll = db["ioc_domains"]
-ips_coll = db["ioc_ips"]
-hashes_coll = db["ioc_hashes"]
 
-# ensure indexes
-for coll in (domains_coll, ips_coll, hashes_coll):
-    try:
-        coll.create_index([("value", ASCENDING), ("type", ASCENDING)], unique=True)
-    except Exception as e:
-        print(f"Index create warning for {coll.name}: {e}")
+def get_collections(db):
+    return {
+        "iocs": db["iocs"],
+        "domains": db["ioc_domains"],
+        "ips": db["ioc_ips"],
+        "hashes": db["ioc_hashes"],
+        "ledger": db["import_ledger"],
+    }
+
+
+def ensure_indexes(colls):
+    for coll in (colls["domains"], colls["ips"]):
+        try:
+            coll.create_index([("value", ASCENDING), ("type", ASCENDING)], unique=True)
+        except Exception as e:
+            print(f"Index create warning for {coll.name}: {e}")
+    for coll, field in ((colls["iocs"], "threatfox_id"), (colls["ledger"], "sha256")):
+        try:
+            coll.create_index([(field, ASCENDING)])
+        except Exception as e:
+            print(f"Index create warning for {coll.name}: {e}")
+    ensure_ip_index(colls["ips"])
+    ensure_hash_index(colls["hashes"])
 
 # helper: normalize type mapping
 def map_type(ioc_type):
@@ -45,9 +100,11 @@ def map_type(ioc_type):
         return "ip"
     if it in ("url", "uri"):
         return "url"
-    # hashes
-    if it in ("md5", "sha1", "sha256", "sha512"):
+    # hashes: ThreatFox sends "md5_hash" etc.; bare algorithm names get the same type
+    if it in HASH_TYPES:
         return it
+    if f"{it}_hash" in HASH_TYPES:
+        return f"{it}_hash"
     # fallback
     return it or "unknown"
 
@@ -62,32 +119,224 @@ def parse_ts(ts_str):
         except Exception:
             return None
 
-files = [f for f in os.listdir(VAMF_DIR) if f.endswith('.json')]
-if not files:
-    print("No JSON files found in VAMF/ to import.")
-    raise SystemExit(0)
 
-for fname in files:
-    path = os.path.join(VAMF_DIR, fname)
-    print(f"Processing {path}...")
-    with open(path, 'r', encoding='utf-8') as fh:
-        data = json.load(fh)
+def iter_threatfox_items(fh, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Incrementally parse a ThreatFox export ({"id": [records], ...}) and yield
+    (id, records) pairs. Only the current entry plus one read chunk is held
+    in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+
+    def more():
+        nonlocal buf, pos
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def next_char():
+        # skip whitespace and return the next significant character
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not more():
+                return ""
+
+    def next_value():
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # value is cut at the chunk boundary: read more and retry
+                if not more():
+                    raise
+                continue
+            pos = end
+            return value
+
+    if next_char() != "{":
+        raise ValueError("ThreatFox export must be a JSON object of id -> [records]")
+    pos += 1
+    if next_char() == "}":
+        return
+    while True:
+        key = next_value()
+        if next_char() != ":":
+            raise ValueError(f"Malformed ThreatFox export near id {key!r}")
+        pos += 1
+        yield key, next_value()
+        sep = next_char()
+        pos += 1
+        if sep == "}":
+            return
+        if sep != ",":
+            raise ValueError(f"Malformed ThreatFox export after id {key!r}")
+
+
+def content_hash(doc, volatile=()):
+    """Stable digest of a document, ignoring volatile fields such as timestamps."""
+    stable = {k: v for k, v in doc.items() if k not in volatile and k != "content_hash"}
+    raw = json.dumps(stable, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-    # ThreatFox recent format: mapping of 'id' -> [ { ioc_value, ioc_type, ...}, ... ]
-    domain_ops = []
-    ip_ops = []
-    hash_ops = []
-    events_written = 0
 
-    for tf_id, entries in data.items():
+def newest_wins_update(doc):
+    """Update pipeline that $sets doc unless the stored document has a later export_at."""
+    return [{"$replaceWith": {"$cond": [
+        {"$gt": [{"$ifNull": ["$export_at", None]}, doc["export_at"]]},
+        "$$ROOT",
+        {"$mergeObjects": ["$$ROOT", {"$literal": doc}]},
+    ]}}]
+
+
+class BulkBuffer:
+    """
+    Collect upserts for one collection and flush them in bounded, unordered
+    batches. Docs are keyed on key_fields so a repeated key within a batch
+    keeps only its last version, which makes unordered execution safe.
+
+    Every document gets a content_hash; before a batch is written the stored
+    hashes for its keys are fetched in one query and unchanged documents are
+    dropped, so re-imports of overlapping dumps cost a read, not a write.
+
+    If `changed` is a set, the keys of every document written are added to it.
+
+    If `stamp` names a field, every document written gets it set to the
+    batch's flush time (not its parse time, which under --workers can be
+    long before the write and out of order), so readers such as the
+    incremental ETL watermark see it increase with the writes.
+
+    export_at (the dump's export time) is set on every document; with
+    newest_wins the upserts leave a stored document from a later export
+    alone, for dumps written concurrently.
+    """
+
+    def __init__(self, coll, label, key_fields, batch_size=DEFAULT_BATCH_SIZE, volatile=(), changed=None,
+                 stamp=None, export_at=None, newest_wins=False):
+        self.coll = coll
+        self.label = label
+        self.key_fields = key_fields
+        self.batch_size = batch_size
+        self.volatile = tuple(volatile) + ("export_at",)
+        self.export_at = export_at
+        self.newest_wins = newest_wins
+        self.docs = {}
+        self.matched = 0
+        self.upserted = 0
+        self.written = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.changed = changed
+        self.stamp = stamp
+
+    def add(self, doc):
+        if self.export_at is not None:
+            doc["export_at"] = self.export_at
+        if "content_hash" not in doc:
+            doc["content_hash"] = content_hash(doc, self.volatile)
+        key = tuple(doc.get(f) for f in self.key_fields)
+        self.docs.pop(key, None)
+        self.docs[key] = doc
+        if len(self.docs) >= self.batch_size:
+            self.flush()
+
+    def _stored_hashes(self, keys):
+        first = self.key_fields[0]
+        projection = {f: 1 for f in self.key_fields}
+        projection.update({"content_hash": 1, "_id": 0})
+        stored = {}
+        try:
+            cursor = self.coll.find({first: {"$in": list({k[0] for k in keys})}}, projection)
+            for d in cursor:
+                stored[tuple(d.get(f) for f in self.key_fields)] = d.get("content_hash")
+        except Exception as e:
+            # change detection is an optimisation: fall back to writing everything
+            print(f"{self.label} change lookup failed: {e}")
+        return stored
+
+    def flush(self):
+        if not self.docs:
+            return
+        docs = self.docs
+        self.docs = {}
+        stored = self._stored_hashes(docs.keys())
+        ops = []
+        written_at = datetime.utcnow()
+        for key, doc in docs.items():
+            if stored.get(key) == doc["content_hash"]:
+                self.unchanged += 1
+                continue
+            if self.stamp:
+                doc[self.stamp] = written_at
+            filt = dict(zip(self.key_fields, key))
+            update = newest_wins_update(doc) if self.newest_wins else {"$set": doc}
+            ops.append(UpdateOne(filt, update, upsert=True))
+        if not ops:
+            return
+        metrics.observe("bulk_batch_size", len(ops), buckets=metrics.SIZE_BUCKETS, collection=self.coll.name)
+        if self.changed is not None:
+            self.changed.update(k for k, d in docs.items() if stored.get(k) != d["content_hash"])
+        try:
+            res = self.coll.bulk_write(ops, ordered=False)
+            self.matched += res.matched_count
+            self.upserted += len(res.upserted_ids)
+            self.written += len(ops)
+        except BulkWriteError as e:
+            # unordered: everything but the reported ops was applied
+            details = e.details
+            failed = details.get("writeErrors", [])
+            self.matched += details.get("nMatched", 0)
+            self.upserted += details.get("nUpserted", 0)
+            self.written += len(ops) - len(failed)
+            self.errors += len(failed)
+            first = failed[0].get("errmsg") if failed else e
+            print(f"{self.label} bulk write: {len(failed)}/{len(ops)} ops failed (first error: {first})")
+        except Exception as e:
+            self.errors += len(ops)
+            print(f"{self.label} bulk write error: {e}")
+
+    def report(self):
+        if self.matched or self.upserted or self.unchanged:
+            print(f"{self.label} bulk_write: matched={self.matched}, upserted={self.upserted}, "
+                  f"unchanged={self.unchanged}")
+        if self.errors:
+            print(f"{self.label} bulk_write: {self.errors} ops failed")
+        self.matched = self.upserted = self.written = self.unchanged = self.errors = 0
+
+
+def normalize_items(items):
+    """
+    Turn (id, records) pairs into (event, [(buffer name, attribute doc), ...])
+    tuples. Pure CPU work, so it can run in the --workers process pool.
+    """
+    for tf_id, entries in items:
         # Build an Event-like doc to store in misp.iocs
         event = {
             "threatfox_id": tf_id,
             "source": "threatfox",
             "info": f"ThreatFox import {tf_id}",
-            "timestamp": datetime.utcnow(),
+            # "timestamp" is set when the event is written (BulkBuffer stamp)
             "Attribute": []
         }
+        attrs = []
 
         for rec in entries:
             value = rec.get("ioc_value") or rec.get("ioc") or rec.get("value")
@@ -112,45 +361,250 @@ for fname in files:
 
             # Upsert into attribute collections based on normalized type
             if ioc_type == "domain":
-                doc = {k: v for k, v in attr.items() if v is not None}
-                domain_ops.append(UpdateOne({"value": value, "type": ioc_type}, {"$set": doc}, upsert=True))
+                target = "domains"
             elif ioc_type == "ip":
-                doc = {k: v for k, v in attr.items() if v is not None}
-                ip_ops.append(UpdateOne({"value": value, "type": ioc_type}, {"$set": doc}, upsert=True))
-            elif ioc_type in ("md5", "sha1", "sha256", "sha512"):
-                doc = {k: v for k, v in attr.items() if v is not None}
-                hash_ops.append(UpdateOne({"value": value, "type": ioc_type}, {"$set": doc}, upsert=True))
+                target = "ips"
+            elif ioc_type in HASH_TYPES:
+                # stored as a binary digest, keyed on it (see hash_store.py)
+                doc = hash_doc(attr)
+                if doc is not None:
+                    attrs.append(("hashes", doc))
+                continue
             else:
                 # For other types (url, unknown), insert into iocs only
-                pass
+                continue
+            doc = {k: v for k, v in attr.items() if v is not None}
+            if target == "ips":
+                # ip / ip_version / ip_bin / port for CIDR and range queries (see ip_ranges.py)
+                doc.update(ip_fields(value))
+            attrs.append((target, doc))
+
+        yield event, attrs
+
+
+def open_items(fh, stream=False):
+    # ThreatFox recent format: mapping of 'id' -> [ { ioc_value, ioc_type, ...}, ... ]
+    if stream:
+        return iter_threatfox_items(fh)
+    return json.load(fh).items()
 
+
+def file_stat(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime": st.st_mtime}
+
+
+def file_sort_key(path):
+    """
+    Order dumps by the export timestamp in their name (threatfox_recent_
+    YYYYmmdd_HHMMSS.json), falling back to mtime, so later exports win.
+    """
+    m = FILE_TS_RE.search(os.path.basename(path))
+    if m:
+        ts = datetime.strptime(m.group(1), "%Y%m%d_%H%M%S")
+    else:
+        ts = datetime.utcfromtimestamp(os.path.getmtime(path))
+    return ts, os.path.basename(path)
+
+
+def ledger_lookup(colls, path):
+    """
+    Return (skip, stat_doc) for a dump. A file is skipped when the ledger has
+    the same path with identical size and mtime, or any entry with the same
+    content hash (e.g. a copy or a re-downloaded identical export).
+    """
+    stat_doc = file_stat(path)
+    entry = colls["ledger"].find_one({"_id": stat_doc["path"]})
+    if entry and entry.get("size") == stat_doc["size"] and entry.get("mtime") == stat_doc["mtime"]:
+        return True, stat_doc
+    stat_doc["sha256"] = file_sha256(path)
+    if colls["ledger"].find_one({"sha256": stat_doc["sha256"]}, {"_id": 1}):
+        return True, stat_doc
+    return False, stat_doc
+
+
+def check_ledger(colls, path, force=False):
+    """Return the stat doc to ledger after importing, or None to skip the file."""
+    if force:
+        return file_stat(path)
+    skip, stat_doc = ledger_lookup(colls, path)
+    if skip:
+        print(f"Skipping {path}: already imported")
+        return None
+    return stat_doc
+
+
+def record_ledger(colls, stat_doc, ids, events_written):
+    entry = dict(stat_doc)
+    if "sha256" not in entry:
+        entry["sha256"] = file_sha256(entry["path"])
+    entry.update({
+        "id_count": len(ids),
+        "ids": ids if len(ids) <= LEDGER_MAX_IDS else None,
+        "events_written": events_written,
+        "imported_at": datetime.utcnow(),
+    })
+    colls["ledger"].replace_one({"_id": entry["path"]}, entry, upsert=True)
+
+
+def new_buffers(colls, batch_size=DEFAULT_BATCH_SIZE, changed=None, export_at=None, newest_wins=False):
+    attr_key = ("value", "type")
+    order = {"export_at": export_at, "newest_wins": newest_wins}
+    return {
+        "events": BulkBuffer(colls["iocs"], "Events", ("threatfox_id",), batch_size, volatile=EVENT_VOLATILE,
+                             changed=changed, stamp="timestamp", **order),
+        "domains": BulkBuffer(colls["domains"], "Domains", attr_key, batch_size, **order),
+        "ips": BulkBuffer(colls["ips"], "IPs", attr_key, batch_size, **order),
+        "hashes": BulkBuffer(colls["hashes"], "Hashes", ("digest",), batch_size, **order),
+    }
+
+
+def write_records(path, records, colls, stat_doc, batch_size=DEFAULT_BATCH_SIZE, changed=None, newest_wins=False):
+    """
+    Write normalized (event, attrs) records of one dump; returns events written.
+    With a `changed` set, the (threatfox_id,) keys of written events are added to it.
+    """
+    buffers = new_buffers(colls, batch_size, changed, file_sort_key(path)[0], newest_wins)
+    ids = []
+    for event, attrs in records:
+        ids.append(event["threatfox_id"])
+        for name, doc in attrs:
+            buffers[name].add(doc)
         # Upsert event into iocs collection (use threatfox_id as unique key)
-        try:
-            collection_iocs.update_one({"threatfox_id": tf_id}, {"$set": event}, upsert=True)
-            events_written += 1
-        except Exception as e:
-            print(f"Failed to upsert event {tf_id}: {e}")
+        buffers["events"].add(event)
 
-    # Bulk write attribute ops
-    if domain_ops:
-        try:
-            res = domains_coll.bulk_write(domain_ops)
-            print(f"Domains bulk_write: matched={res.matched_count}, upserted={len(res.upserted_ids)}")
-        except Exception as e:
-            print(f"Domain bulk write error: {e}")
-    if ip_ops:
-        try:
-            res = ips_coll.bulk_write(ip_ops)
-            print(f"IPs bulk_write: matched={res.matched_count}, upserted={len(res.upserted_ids)}")
-        except Exception as e:
-            print(f"IP bulk write error: {e}")
-    if hash_ops:
-        try:
-            res = hashes_coll.bulk_write(hash_ops)
-            print(f"Hashes bulk_write: matched={res.matched_count}, upserted={len(res.upserted_ids)}")
-        except Exception as e:
-            print(f"Hash bulk write error: {e}")
+    # Flush the remaining ops
+    for buf in buffers.values():
+        buf.flush()
+    events_written = buffers["events"].written
+    failed = sum(buf.errors for buf in buffers.values())
+    metrics.inc("records_total", len(ids))
+    metrics.inc("bytes_read_total", stat_doc.get("size", 0))
+    for buf in buffers.values():
+        buf.report()
+
+    # only ledger files whose writes all went through, so failures are retried
+    if not failed:
+        record_ledger(colls, stat_doc, ids, events_written)
+
+    print(f"Finished importing {os.path.basename(path)}: events={events_written}")
+    return events_written
+
+
+def import_file(path, colls, batch_size=DEFAULT_BATCH_SIZE, stream=False, force=False, changed=None):
+    stat_doc = check_ledger(colls, path, force)
+    if stat_doc is None:
+        return 0
+    print(f"Processing {path}...")
+    with open(path, 'r', encoding='utf-8') as fh:
+        return write_records(path, normalize_items(open_items(fh, stream)), colls, stat_doc, batch_size, changed)
+
+
+def import_worker(path, stat_doc, mongo_uri, db_name, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Worker side of --workers: stream one dump into MongoDB through this
+    process' own client and ledger it; returns (events written, records).
+    """
+    client = MongoClient(mongo_uri)
+    try:
+        colls = get_collections(client[db_name])
+        records = 0
+
+        def counted(items):
+            nonlocal records
+            for item in items:
+                records += 1
+                yield item
+        with open(path, 'r', encoding='utf-8') as fh:
+            events = write_records(path, counted(normalize_items(iter_threatfox_items(fh))), colls, stat_doc,
+                                   batch_size, newest_wins=True)
+        return events, records
+    finally:
+        client.close()
+
+
+def dedupe_by_content(paths, colls, force=False):
+    """
+    (path, stat doc) of the paths check_ledger() lets through, minus any
+    whose content (sha256) repeats an earlier path of the same run: the
+    ledger only learns of a dump once it is written, too late for a batch.
+    """
+    seen = {}
+    todo = []
+    for path in paths:
+        stat_doc = check_ledger(colls, path, force)
+        if stat_doc is None:
+            continue
+        stat_doc.setdefault("sha256", file_sha256(path))
+        if stat_doc["sha256"] in seen:
+            print(f"Skipping {path}: same content as {seen[stat_doc['sha256']]}")
+            continue
+        seen[stat_doc["sha256"]] = path
+        todo.append((path, stat_doc))
+    return todo
+
+
+def import_parallel(paths, colls, workers, batch_size=DEFAULT_BATCH_SIZE, force=False, mongo_uri=MONGO_URI):
+    """
+    Import dumps in a pool of `workers` processes, each streaming a whole
+    dump into MongoDB and returning counts only. Writes use
+    newest_wins_update(), so the outcome matches importing in path order.
+    """
+    total = 0
+    db_name = colls["iocs"].database.name
+    todo = dedupe_by_content(paths, colls, force)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(path, stat_doc, pool.submit(import_worker, path, stat_doc, mongo_uri, db_name, batch_size))
+                   for path, stat_doc in todo]
+        for path, stat_doc, future in futures:
+            try:
+                events, records = future.result()
+            except Exception as e:
+                print(f"Failed to import {path}: {e}")
+                continue
+            metrics.inc("records_total", records)
+            metrics.inc("bytes_read_total", stat_doc.get("size", 0))
+            total += events
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import ThreatFox JSON dumps into MongoDB")
+    parser.add_argument("--dir", default=VAMF_DIR, help="Directory holding ThreatFox *.json dumps")
+    parser.add_argument("--stream", action="store_true", help="Parse dumps incrementally instead of json.load")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Upserts per bulk_write")
+    parser.add_argument("--force", action="store_true", help="Re-import files already recorded in the ledger")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Import dumps in a pool of this many processes, streamed (0 = sequential)")
+    parser.add_argument("--index", default=None,
+                        help="Refresh this ioc_index.py membership index after importing")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+
+    files = [os.path.join(args.dir, f) for f in os.listdir(args.dir) if f.endswith('.json')]
+    if not files:
+        print("No JSON files found in VAMF/ to import.")
+        return
+    files.sort(key=file_sort_key)
+
+    client = MongoClient(MONGO_URI)
+    colls = get_collections(client["misp"])
+    ensure_indexes(colls)
+
+    with metrics.stage("import"):
+        if args.workers > 0:
+            import_parallel(files, colls, args.workers, args.batch_size, args.force)
+        else:
+            for path in files:
+                import_file(path, colls, args.batch_size, args.stream, args.force)
+
+    print("All ThreatFox files processed.")
+    if args.index:
+        from ioc_index import refresh
+        refresh(client["misp"], args.index)
 
-    print(f"Finished importing {fname}: events={events_written}")
 
-print("All ThreatFox files processed.")
+if __name__ == "__main__":
+    main()
@@ -2,41 +2,155 @@
 Train a RandomForest model using advanced features from processed_iocs_advanced.csv.
 Usage:
   python3 train_advanced_model.py
+  python3 train_advanced_model.py --input processed_iocs_advanced.parquet
+  python3 train_advanced_model.py --model-path models/advanced.joblib
+  python3 train_advanced_model.py --lexical --n-jobs 4
+  python3 train_advanced_model.py --lexical --no-cache
+  python3 train_advanced_model.py --lexical --mode search --cv 5
+  python3 train_advanced_model.py --mode incremental --chunk-size 200000
+  python3 train_advanced_model.py --mode incremental --no-cache
+  python3 train_advanced_model.py --metrics train.prom --profile profiles/
+
+The model is trained on a sparse matrix of the numeric features and the
+one-hot encoded IOC / threat types; --lexical adds the lexical_features.py
+columns of domain and URL values. The featurizer is saved in the model
+bundle so score_iocs.py builds the same matrix. See training.py for the
+--mode / --n-jobs options.
+
+The input is never loaded whole: a first pass over the categorical
+columns fixes the encoder's categories, then the export is read
+--chunk-size rows at a time and each chunk's label and feature matrix is
+appended to the feature_cache.py entry, keyed on the input file's size and
+mtime and the feature code, so repeated runs on the same export skip
+parsing and featurizing. With --no-cache the chunks are fed straight to
+the model instead, so --mode incremental --no-cache trains on an export
+larger than RAM.
 """
+import argparse
+import os
+import sys
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
+from sklearn.preprocessing import OneHotEncoder
+from model_store import default_path, save_model
+import feature_cache
+import feature_extraction_advanced
+import lexical_features
+import metrics
+import training
 
-# Load data
-csv_path = "processed_iocs_advanced.csv"
-df = pd.read_csv(csv_path)
+parser = argparse.ArgumentParser()
+parser.add_argument("--input", default="processed_iocs_advanced.csv",
+                    help="CSV or Parquet export from feature_extraction_advanced.py")
+parser.add_argument("--model-path", default=default_path("advanced"),
+                    help="Where to save the fitted model bundle")
+parser.add_argument("--version", default=None, help="Version tag (default advanced-<UTC timestamp>)")
+parser.add_argument("--lexical", action="store_true", help="Add hashed lexical features of domains and URLs")
+parser.add_argument("--psl", default=None, help="public_suffix_list.dat for the lexical registered-domain split")
+training.add_arguments(parser)
+feature_cache.add_arguments(parser)
+metrics.add_arguments(parser)
+args = parser.parse_args()
+metrics.configure_from_args(args)
 
-# Simple label: high risk if confidence >= 90 or has_malware == 1
-# (You can adjust this logic for your needs)
-df["high_risk"] = ((df["features.confidence"] >= 90) | (df["features.has_malware"] == 1)).astype(int)
-
-# Features and label
-feature_cols = [
+FEATURE_COLS = [
     "features.confidence", "features.has_malware", "features.ioc_type", "features.threat_type",
     "features.days_since_first_seen", "features.days_since_last_seen", "features.seen_duration_days",
     "domain_length", "domain_digits", "domain_hyphens", "ip_octets"
 ]
-X = df[feature_cols].fillna(0)
-y = df["high_risk"]
+CATEGORICAL = ["features.ioc_type", "features.threat_type"]
+NUMERIC = [c for c in FEATURE_COLS if c not in CATEGORICAL]
+# the cache key hashes this script, feature_extraction_advanced.py and lexical_features.py;
+# bump by hand when build_features() output changes for another reason (e.g. a library upgrade)
+FEATURES_VERSION = 3
+
+
+def read_chunks(columns=None):
+    """The input's rows, --chunk-size at a time (only the given columns)."""
+    if args.input.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(args.input).iter_batches(batch_size=args.chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(args.input, usecols=columns, chunksize=args.chunk_size)
+
+
+def fit_encoder():
+    """OneHotEncoder with its categories fixed by a pass over the input's categorical columns."""
+    seen = {c: {"unknown"} for c in CATEGORICAL}
+    for df in read_chunks(CATEGORICAL):
+        for c in CATEGORICAL:
+            seen[c].update(df[c].dropna().astype(str).unique())
+    categories = [sorted(seen[c]) for c in CATEGORICAL]
+    encoder = OneHotEncoder(categories=categories, handle_unknown="ignore")
+    return encoder.fit(pd.DataFrame({c: [cats[0]] for c, cats in zip(CATEGORICAL, categories)}))
 
-# Train/test split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-# Train model
-clf = RandomForestClassifier(n_estimators=100, random_state=42)
-clf.fit(X_train, y_train)
+def make_featurizer():
+    """(encoder, lexical featurizer or None, importance column names)."""
+    encoder = fit_encoder()
+    names = NUMERIC + list(encoder.get_feature_names_out(CATEGORICAL))
+    lexical = None
+    if args.lexical:
+        suffixes = lexical_features.PublicSuffixTable.from_file(args.psl) if args.psl else None
+        lexical = lexical_features.LexicalFeaturizer(suffixes=suffixes, n_jobs=args.n_jobs)
+        # importances are reported for the named columns only, not the hashed n-grams
+        names += ["lex_" + n for n in lexical_features.STAT_NAMES]
+    return encoder, lexical, names
 
-# Evaluate
-y_pred = clf.predict(X_test)
+
+def feature_chunks(encoder, lexical):
+    """(X, y) per input chunk: the sparse design matrix and the label."""
+    for df in read_chunks():
+        # Simple label: high risk if confidence >= 90 or has_malware == 1
+        # (You can adjust this logic for your needs)
+        y = ((df["features.confidence"] >= 90) | (df["features.has_malware"] == 1)).astype(int).to_numpy()
+        # Features: numeric columns, one-hot (sparse) categoricals and optionally the lexical columns
+        X = lexical_features.design_matrix(df, lexical, encoder, NUMERIC, CATEGORICAL)
+        yield X, y
+
+
+def build_features():
+    """Cache entry chunks: the encoder and featurizer first, then X / y per input chunk."""
+    encoder, lexical, names = make_featurizer()
+    yield {"feature_cols": names, "numeric": NUMERIC, "categorical": CATEGORICAL, "encoder": encoder,
+           "lexical": lexical}
+    n_rows = 0
+    for X, y in feature_chunks(encoder, lexical):
+        n_rows += len(y)
+        yield {"X": X, "y": y}
+    metrics.inc("bytes_read_total", os.path.getsize(args.input))
+    metrics.inc("records_total", n_rows)
+
+
+cache = feature_cache.from_args(args)
+if cache is None:
+    # stream straight from the input, a chunk at a time, every pass
+    encoder, lexical, feature_cols = make_featurizer()
+    data = {"numeric": NUMERIC, "categorical": CATEGORICAL, "encoder": encoder, "lexical": lexical}
+
+    def chunks():
+        return feature_chunks(encoder, lexical)
+else:
+    fingerprint = dict(feature_cache.file_fingerprint(args.input), lexical=args.lexical,
+                       code=feature_cache.code_version(sys.modules[__name__], feature_extraction_advanced,
+                                                       lexical_features, version=FEATURES_VERSION))
+    if args.lexical and args.psl:
+        fingerprint["psl"] = feature_cache.file_fingerprint(args.psl)
+    with metrics.stage("features"):
+        data = feature_cache.cached_chunks(cache, "advanced", fingerprint, build_features)
+    X, y, feature_cols = data["X"], data["y"], data["feature_cols"]
+    print(f"Feature matrix: {X.shape[0]} x {X.shape[1]}, {X.nnz} non-zeros")
+    chunks = training.row_chunks(X.shape[0], lambda start, stop: (X[start:stop], y[start:stop]), args.chunk_size)
+
+# Train on 80% (chunk by chunk for --mode incremental) and evaluate on the rest
+clf, y_test, y_pred = training.fit_model(chunks, **training.options(args))
 print(classification_report(y_test, y_pred))
 
 # Optional: show feature importances
-importances = clf.feature_importances_
-for col, imp in zip(feature_cols, importances):
-    print(f"{col}: {imp:.4f}")
+training.print_importances(clf, feature_cols, "{:.4f}")
+
+# Persist the model with its feature column order for score_iocs.py
+save_model(args.model_path, "advanced", clf, feature_cols, encoder=data["encoder"], categorical=data["categorical"],
+           numeric=data["numeric"], version=args.version, lexical=data["lexical"])
@@ -2,120 +2,297 @@
 Train a RandomForest model on processed IOCs with richer features.
 Usage:
   python3 train_baseline_model.py
+  python3 train_baseline_model.py --model-path models/baseline.joblib
+  python3 train_baseline_model.py --metrics train.prom --profile profiles/
+  python3 train_baseline_model.py --no-cache
+  python3 train_baseline_model.py --mode search --search-iter 20 --cv 5
+  python3 train_baseline_model.py --mode incremental --chunk-size 200000
+  python3 train_baseline_model.py --mode incremental --no-cache
+
+Labeling and feature assembly are whole-column operations
+(high_risk_labels() and feature_frame()), so they can be reused by other
+scripts on any DataFrame shaped like load_dataframe(coll, LOAD_FIELDS).
+The days_since_* features are derived there from first_seen / last_seen
+(see recency.py), so they are current whenever the model is trained.
+
+prepare() turns a loaded frame into the time-invariant arrays (first /
+last seen, stored numeric features, one-hot encoded categoricals), which
+are cached by feature_cache.py until processed_iocs or the feature code
+changes; a repeated run skips MongoDB and the encoding and only derives
+the labels and recency features as of now (training_data()). The
+design matrix is sparse; see training.py for the --mode / --n-jobs options.
+
+The collection is never loaded whole: the encoder's categories are fixed
+up front from the distinct IOC / threat types, then processed_iocs is read
+--chunk-size documents at a time (ioc_loader.iter_batches()) and each chunk
+is encoded and appended to the cache entry. With --no-cache the chunks are
+fed straight to the model, so --mode incremental --no-cache trains on a
+collection larger than RAM without writing anything.
+
+The fitted encoder and model are saved as a versioned bundle (see
+model_store.py) that score_iocs.py uses to score new IOCs.
 """
+import argparse
+import sys
+import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
+import scipy.sparse as sp
 from sklearn.metrics import classification_report
 from sklearn.preprocessing import OneHotEncoder
 from pymongo import MongoClient
-from datetime import datetime, timezone
+from ioc_loader import frame_from_docs, iter_batches, load_dataframe
+from model_store import default_path, save_model
+from recency import RECENCY_FIELDS, SOURCE_FIELDS as RECENCY_SOURCE, add_recency, to_utc, utc_now
+import feature_cache
+import ioc_loader
+import metrics
+import recency
+import training
 
-# ---------------------------
-# Connect to MongoDB
-# ---------------------------
-client = MongoClient("mongodb://localhost:27017/")
-db = client["misp"]
-coll = db["processed_iocs"]
+FEATURE_FIELDS = ["confidence", "has_malware", "ioc_type", "threat_type",
+                  "days_since_first_seen", "days_since_last_seen", "seen_duration_days"]
+STORED_FEATURE_FIELDS = [f for f in FEATURE_FIELDS if f not in RECENCY_FIELDS]
+LOAD_FIELDS = ["first_seen", "last_seen", "malware", "ioc_type", "threat_type"] + \
+    ["features." + f for f in STORED_FEATURE_FIELDS]
+CATEGORICAL = ["ioc_type", "threat_type"]
+NUMERIC = ["confidence", "has_malware", "days_since_first_seen", "days_since_last_seen", "seen_duration_days"]
+STORED_NUMERIC = [f for f in NUMERIC if f not in RECENCY_FIELDS]
+HIGH_RISK_WINDOW = pd.Timedelta(hours=48)
+# the cache key hashes this module, recency.py and ioc_loader.py; bump by hand when
+# prepare() output changes for another reason (e.g. a pandas / scikit-learn upgrade)
+FEATURES_VERSION = 3
 
-# ---------------------------
-# Load data from MongoDB
-# ---------------------------
-records = list(coll.find({}))
-df = pd.DataFrame(records)
-print(f"Loaded {len(df)} IOCs from MongoDB")
 
 # ---------------------------
-# Current time (UTC)
+# Preprocessing
 # ---------------------------
-now = datetime.now(timezone.utc)
+def high_risk_labels(df, now=None):
+    """
+    1 when the IOC was first seen within the last 48h or names a malware
+    family, 0 otherwise; IOCs without a parseable first_seen are always 0.
+    """
+    return recent_or_family(to_utc(df["first_seen"]), names_family(df["malware"]), now)
 
-# ---------------------------
-# Create high_risk label
-# ---------------------------
-def compute_high_risk(row):
-    first_seen = row.get("first_seen")
-    malware = row.get("malware")
-    if not first_seen:
-        return 0
-
-    # Convert to datetime
-    if isinstance(first_seen, str):
-        try:
-            first_seen_dt = datetime.strptime(first_seen, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            return 0
-    else:
-        first_seen_dt = first_seen
-
-    # Make tz-aware
-    if first_seen_dt.tzinfo is None:
-        first_seen_dt = first_seen_dt.replace(tzinfo=timezone.utc)
-
-    delta_hours = (now - first_seen_dt).total_seconds() / 3600
-    return 1 if (delta_hours <= 48 or malware) else 0
-
-df["high_risk"] = df.apply(compute_high_risk, axis=1)
 
-# ---------------------------
-# Extract features from nested "features" dict
-# ---------------------------
-features_df = pd.json_normalize(df["features"])
+def names_family(malware):
+    return malware.notna() & (malware.astype(str) != "")
 
-# Merge back into main dataframe
-for col in features_df.columns:
-    df[col] = features_df[col]
 
-# Fill missing values
-df["ioc_type"] = df["ioc_type"].fillna("unknown")
-df["threat_type"] = df["threat_type"].fillna("unknown")
-df["confidence"] = df["confidence"].fillna(0)
-df["has_malware"] = df["has_malware"].fillna(0)
-df["days_since_first_seen"] = df["days_since_first_seen"].fillna(0)
-df["days_since_last_seen"] = df["days_since_last_seen"].fillna(0)
-df["seen_duration_days"] = df["seen_duration_days"].fillna(0)
+def recent_or_family(first_seen, has_family, now=None):
+    recent = (utc_now(now) - first_seen) <= HIGH_RISK_WINDOW
+    return (first_seen.notna() & (recent | has_family)).astype(int)
 
-# ---------------------------
-# Select features
-# ---------------------------
-categorical = ["ioc_type", "threat_type"]
-numeric = ["confidence", "has_malware", "days_since_first_seen", "days_since_last_seen", "seen_duration_days"]
 
-X_cat = df[categorical]
-X_num = df[numeric]
-y = df["high_risk"]
+def feature_frame(df, now=None):
+    """
+    Flat model inputs from the projected "features.*" columns (they override
+    the top-level ioc_type/threat_type) plus the recency features as of now,
+    with missing values filled.
+    """
+    derived = add_recency(df[[c for c in RECENCY_SOURCE if c in df]].copy(), now)
+    out = pd.DataFrame({f: (derived if f in RECENCY_FIELDS else df)["features." + f] for f in FEATURE_FIELDS},
+                       index=df.index)
+    out[CATEGORICAL] = out[CATEGORICAL].astype(object).fillna("unknown")
+    out[NUMERIC] = out[NUMERIC].fillna(0)
+    return out
 
-# One-hot encode categorical features
-encoder = OneHotEncoder(sparse_output=False, handle_unknown="ignore")
-X_cat_encoded = encoder.fit_transform(X_cat)
-X_cat_df = pd.DataFrame(X_cat_encoded, columns=encoder.get_feature_names_out(categorical))
 
-# Combine numeric + encoded categorical
-X_final = pd.concat([X_num.reset_index(drop=True), X_cat_df.reset_index(drop=True)], axis=1)
+def feature_names(encoder):
+    return NUMERIC + list(encoder.get_feature_names_out(CATEGORICAL))
 
-# ---------------------------
-# Train/test split
-# ---------------------------
-X_train, X_test, y_train, y_test = train_test_split(X_final, y, test_size=0.2, random_state=42)
 
-# ---------------------------
-# Train RandomForest
-# ---------------------------
-clf = RandomForestClassifier(n_estimators=100, random_state=42)
-clf.fit(X_train, y_train)
+def design_matrix(features, encoder):
+    """Numeric columns followed by the one-hot encoded categoricals, in the encoder's column order."""
+    X_cat_encoded = encoder.transform(features[CATEGORICAL])
+    if not sp.issparse(X_cat_encoded):
+        # bundles from before sparse encoding were fitted on a named DataFrame
+        X_cat_df = pd.DataFrame(X_cat_encoded, columns=encoder.get_feature_names_out(CATEGORICAL))
+        return pd.concat([features[NUMERIC].reset_index(drop=True), X_cat_df], axis=1)
+    numeric = sp.csr_matrix(features[NUMERIC].to_numpy(dtype="float64"))
+    return sp.hstack([numeric, X_cat_encoded], format="csr")
 
-# ---------------------------
-# Evaluate
-# ---------------------------
-y_pred = clf.predict(X_test)
-print("Classification report:\n")
-print(classification_report(y_test, y_pred))
 
-# ---------------------------
-# Feature importance
-# ---------------------------
-importances = clf.feature_importances_
-feature_names = X_final.columns
-print("\nFeature importances:")
-for name, imp in zip(feature_names, importances):
-    print(f"{name}: {imp:.3f}")
+def categorical_frame(df):
+    # astype(object) first: fillna can't add "unknown" to a (Parquet) categorical column
+    categorical = pd.DataFrame({f: df["features." + f] for f in CATEGORICAL}, index=df.index).astype(object)
+    return categorical.fillna("unknown").astype(str)
+
+
+def fixed_encoder(categories):
+    """OneHotEncoder over the given categories per CATEGORICAL column ("unknown" added), fitted without data."""
+    categories = [sorted({str(c) for c in cats if c is not None} | {"unknown"}) for cats in categories]
+    encoder = OneHotEncoder(categories=categories, handle_unknown="ignore")
+    return encoder.fit(pd.DataFrame({f: [cats[0]] for f, cats in zip(CATEGORICAL, categories)}))
+
+
+def collection_encoder(coll):
+    """fixed_encoder() over the distinct IOC / threat types of processed_iocs."""
+    return fixed_encoder([coll.distinct("features." + f) for f in CATEGORICAL])
+
+
+def prepare_chunk(df, encoder):
+    """
+    Time-invariant arrays of a frame shaped like load_dataframe(coll,
+    LOAD_FIELDS), in the form feature_cache.py stores: first / last seen as
+    naive UTC datetime64, whether a malware family is named, the stored
+    numeric features and the categoricals one-hot encoded by encoder.
+    """
+    return {
+        "first_seen": to_utc(df["first_seen"]).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]"),
+        "last_seen": to_utc(df["last_seen"]).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]"),
+        "has_family": names_family(df["malware"]).to_numpy(dtype=bool),
+        "stored": df[["features." + f for f in STORED_NUMERIC]].fillna(0).to_numpy(dtype="float64"),
+        "onehot": encoder.transform(categorical_frame(df)),
+    }
+
+
+def prepare(df):
+    """prepare_chunk() of a whole frame, with the encoder fitted on its categories."""
+    categorical = categorical_frame(df)
+    encoder = fixed_encoder([categorical[f].unique() for f in CATEGORICAL])
+    return dict(prepare_chunk(df, encoder), encoder=encoder)
+
+
+def prepared_rows(prepared, start, stop):
+    """Rows [start, stop) of prepare() output; memory-mapped cache arrays are only read there."""
+    return {k: v if k == "encoder" else v[start:stop] for k, v in prepared.items()}
+
+
+def prepared_chunks(prepared, chunk_size=training.DEFAULT_CHUNK_SIZE):
+    """Callable yielding prepare() output chunk_size rows at a time."""
+    n_rows = len(prepared["first_seen"])
+
+    def chunks():
+        for start in range(0, n_rows, chunk_size):
+            yield prepared_rows(prepared, start, start + chunk_size)
+    return chunks
+
+
+def streamed_chunks(coll, encoder, chunk_size=training.DEFAULT_CHUNK_SIZE):
+    """Callable yielding prepare_chunk() of coll, read chunk_size documents at a time."""
+    def chunks():
+        for docs in iter_batches(coll, LOAD_FIELDS, chunk_size):
+            yield prepare_chunk(frame_from_docs(docs, LOAD_FIELDS), encoder)
+    return chunks
+
+
+def training_data(prepared, now=None):
+    """
+    (X, y) as of now from prepare() output: X is the CSR matrix
+    design_matrix(feature_frame(df, now), encoder) builds, y the labels of
+    high_risk_labels().
+    """
+    now = utc_now(now)
+    times = add_recency(pd.DataFrame({"first_seen": prepared["first_seen"], "last_seen": prepared["last_seen"]}),
+                        now, prefix="")
+    numeric = pd.DataFrame(prepared["stored"], columns=STORED_NUMERIC)
+    for f in RECENCY_FIELDS:
+        numeric[f] = times[f].fillna(0).astype("float64")
+    X = sp.hstack([sp.csr_matrix(numeric[NUMERIC].to_numpy()), prepared["onehot"]], format="csr")
+    y = recent_or_family(to_utc(times["first_seen"]), np.asarray(prepared["has_family"]), now)
+    return X, y.to_numpy()
+
+
+def train(df, model_path=None, version=None, **fit_options):
+    """
+    Fit, report and save a model on a load_dataframe(coll, LOAD_FIELDS)
+    frame; fit_options are training.fit_model()'s. Returns the version tag.
+    """
+    return train_prepared(prepare(df), model_path, version, **fit_options)
+
+
+def train_prepared(prepared, model_path=None, version=None, chunk_size=training.DEFAULT_CHUNK_SIZE, **fit_options):
+    """Fit, report and save a model on prepare() output (possibly from the feature cache)."""
+    return train_chunks(prepared_chunks(prepared, chunk_size), prepared["encoder"], model_path, version,
+                        **fit_options)
+
+
+def train_chunks(chunks, encoder, model_path=None, version=None, **fit_options):
+    """Fit, report and save a model on the prepare_chunk() dicts chunks() yields."""
+    # ---------------------------
+    # Label and features, one chunk at a time
+    # ---------------------------
+    now = utc_now()
+
+    def design_chunks():
+        for prepared in chunks():
+            yield training_data(prepared, now)
+
+    # ---------------------------
+    # Train and evaluate on a held-out 20%
+    # ---------------------------
+    clf, y_test, y_pred = training.fit_model(design_chunks, **fit_options)
+    print("Classification report:\n")
+    print(classification_report(y_test, y_pred))
+
+    # ---------------------------
+    # Feature importance
+    # ---------------------------
+    columns = feature_names(encoder)
+    training.print_importances(clf, columns)
+
+    return save_model(model_path or default_path("baseline"), "baseline", clf, columns, encoder=encoder,
+                      categorical=CATEGORICAL, numeric=NUMERIC, version=version)
+
+
+def load_prepared(coll, cache=None, chunk_size=training.DEFAULT_CHUNK_SIZE):
+    """
+    prepare() output for coll, from the feature cache while processed_iocs
+    is unchanged. A cache entry is built chunk by chunk, never holding the
+    collection in memory; without a cache the collection is loaded whole.
+    """
+    if cache is None:
+        with metrics.stage("load"):
+            df = load_dataframe(coll, LOAD_FIELDS)
+            metrics.inc("records_total", len(df))
+        print(f"Loaded {len(df)} IOCs from MongoDB")
+        return prepare(df)
+
+    def build():
+        encoder = collection_encoder(coll)
+        yield {"encoder": encoder}
+        n_rows = 0
+        for chunk in streamed_chunks(coll, encoder, chunk_size)():
+            n_rows += len(chunk["first_seen"])
+            yield chunk
+        metrics.inc("records_total", n_rows)
+        print(f"Loaded {n_rows} IOCs from MongoDB")
+
+    fingerprint = dict(feature_cache.mongo_fingerprint(coll),
+                       code=feature_cache.code_version(sys.modules[__name__], recency, ioc_loader,
+                                                       version=FEATURES_VERSION))
+    with metrics.stage("load"):
+        return feature_cache.cached_chunks(cache, "baseline", fingerprint, build)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-path", default=default_path("baseline"),
+                        help="Where to save the fitted encoder + model bundle")
+    parser.add_argument("--version", default=None, help="Version tag (default baseline-<UTC timestamp>)")
+    training.add_arguments(parser)
+    feature_cache.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.configure_from_args(args)
+
+    # ---------------------------
+    # Load data from MongoDB
+    # ---------------------------
+    client = MongoClient("mongodb://localhost:27017/")
+    db = client["misp"]
+    coll = db["processed_iocs"]
+
+    cache = feature_cache.from_args(args)
+    if cache is None:
+        # stream straight from MongoDB, a chunk at a time, every pass
+        encoder = collection_encoder(coll)
+        chunks = streamed_chunks(coll, encoder, args.chunk_size)
+        train_chunks(chunks, encoder, args.model_path, args.version, **training.options(args))
+        return
+    prepared = load_prepared(coll, cache, args.chunk_size)
+    train_prepared(prepared, args.model_path, args.version, args.chunk_size, **training.options(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Model fitting shared by train_baseline_model.py and train_advanced_model.py.
+
+Both scripts hand over sparse design matrices (numeric columns followed by
+CSR one-hot categoricals), so memory grows with the non-zeros rather than
+with the number of distinct IOC / threat types. --mode picks the learner:
+ - forest       RandomForestClassifier(n_estimators=100) fitted on --n-jobs cores
+ - search       randomized search over forest parameters (--search-iter
+                candidates, each scored by stratified --cv-fold
+                cross-validation on --scoring, in parallel), refit with the
+                best parameters on the training split
+ - incremental  SGDClassifier(loss="log_loss") behind a MaxAbsScaler, both
+                fitted with partial_fit one row chunk at a time for --epochs
+                passes. The scripts stream the chunks (--chunk-size rows
+                each) from the feature cache's memory-mapped files or, with
+                --no-cache, straight from the source, so only one chunk is
+                ever in memory and the data may be larger than RAM
+
+Every mode holds out 20% of the rows for the classification report (for
+--mode incremental a fixed hash of the row number picks them, so the split
+does not depend on the chunking), and prints its fit time and the process'
+peak RSS.
+"""
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import RandomizedSearchCV, StratifiedKFold, train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import MaxAbsScaler
+import metrics
+
+MODES = ("forest", "search", "incremental")
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_EPOCHS = 5
+SEARCH_SPACE = {
+    "n_estimators": [100, 200, 400],
+    "max_depth": [None, 10, 20, 40],
+    "min_samples_leaf": [1, 2, 5],
+    "max_features": ["sqrt", "log2", 0.3],
+    "class_weight": [None, "balanced"],
+}
+
+
+def add_arguments(parser):
+    parser.add_argument("--mode", choices=MODES, default="forest",
+                        help="forest, cross-validated parameter search, or incremental (out-of-core) SGD")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Cores for fitting and searching (-1 = all)")
+    parser.add_argument("--search-iter", type=int, default=10, help="Parameter candidates tried by --mode search")
+    parser.add_argument("--cv", type=int, default=3, help="Cross-validation folds for --mode search")
+    parser.add_argument("--scoring", default="roc_auc", help="Metric --mode search optimizes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Rows per partial_fit call for --mode incremental")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS,
+                        help="Passes over the data for --mode incremental")
+
+
+def options(args):
+    """fit_model() keyword arguments from add_arguments() flags."""
+    return {"mode": args.mode, "n_jobs": args.n_jobs, "search_iter": args.search_iter, "cv": args.cv,
+            "scoring": args.scoring, "epochs": args.epochs}
+
+
+def row_chunks(n_rows, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """A fit_model() chunks callable over rows(start, stop) -> (X, y) slices of n_rows rows."""
+    def chunks():
+        for start in range(0, n_rows, chunk_size):
+            yield rows(start, min(start + chunk_size, n_rows))
+    return chunks
+
+
+def held_out_rows(start, stop):
+    """Whether each row number in [start, stop) is in the held-out TEST_SIZE share (Fibonacci hashing)."""
+    rows = np.arange(start, stop, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        h = rows * np.uint64(0x9E3779B97F4A7C15)
+    return (h >> np.uint64(11)).astype(np.float64) / float(1 << 53) < TEST_SIZE
+
+
+def fit_forest(X, y, n_jobs=-1):
+    clf = RandomForestClassifier(n_estimators=100, random_state=RANDOM_STATE, n_jobs=n_jobs)
+    return clf.fit(X, y)
+
+
+def fit_search(X, y, n_jobs=-1, search_iter=10, cv=3, scoring="roc_auc"):
+    if len(np.unique(y)) < 2:
+        print("Only one class in the training labels, nothing to cross-validate; fitting the default forest")
+        return fit_forest(X, y, n_jobs)
+    # parallelism goes to the candidates x folds, not inside each forest
+    search = RandomizedSearchCV(
+        RandomForestClassifier(random_state=RANDOM_STATE, n_jobs=1), SEARCH_SPACE, n_iter=search_iter,
+        cv=StratifiedKFold(cv, shuffle=True, random_state=RANDOM_STATE), scoring=scoring, n_jobs=n_jobs,
+        random_state=RANDOM_STATE,
+    )
+    search.fit(X, y)
+    print(f"Best {scoring} {search.best_score_:.4f} with {search.best_params_}")
+    return search.best_estimator_
+
+
+def fit_incremental(chunks, epochs=DEFAULT_EPOCHS):
+    """
+    Fit scaler + SGD on the (X, y) row chunks chunks() yields, one chunk in
+    memory at a time; returns (model, training rows, y_test, y_pred) with the
+    labels and predictions of the held-out rows. Reads the data epochs + 2
+    times (scaler, training passes, evaluation).
+    """
+    def split():
+        start = 0
+        for X, y in chunks():
+            y = np.asarray(y)
+            yield X, y, held_out_rows(start, start + len(y))
+            start += len(y)
+
+    scaler = MaxAbsScaler()
+    n_train = 0
+    for X, _, test in split():
+        n_train += int((~test).sum())
+        if (~test).any():
+            scaler.partial_fit(X[~test])
+    sgd = SGDClassifier(loss="log_loss", random_state=RANDOM_STATE)
+    rng = np.random.default_rng(RANDOM_STATE)
+    for _ in range(epochs):
+        for X, y, test in split():
+            train = rng.permutation(np.flatnonzero(~test))
+            if len(train):
+                sgd.partial_fit(scaler.transform(X[train]), y[train], classes=[0, 1])
+    model = make_pipeline(scaler, sgd)
+
+    y_test, y_pred = [], []
+    for X, y, test in split():
+        if test.any():
+            y_test.append(y[test])
+            y_pred.append(model.predict(X[test]))
+    if not y_test:
+        return model, n_train, np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return model, n_train, np.concatenate(y_test), np.concatenate(y_pred)
+
+
+def stack(chunks):
+    """All (X, y) chunks as one matrix and label vector."""
+    Xs, ys = [], []
+    for X, y in chunks():
+        Xs.append(X)
+        ys.append(np.asarray(y))
+    X = sp.vstack(Xs, format="csr") if sp.issparse(Xs[0]) else np.concatenate(Xs)
+    return X, np.concatenate(ys)
+
+
+def fit_model(chunks, mode="forest", n_jobs=-1, search_iter=10, cv=3, scoring="roc_auc", epochs=DEFAULT_EPOCHS):
+    """
+    Fit a model on the (X, y) row chunks chunks() yields (a callable, as
+    --mode incremental reads them several times); returns (model, y_test,
+    y_pred). The other modes stack the chunks into one matrix first.
+    """
+    start = time.perf_counter()
+    rss_before = metrics.peak_rss_bytes()
+    with metrics.stage("train"):
+        if mode == "incremental":
+            model, n_train, y_test, y_pred = fit_incremental(chunks, epochs)
+        else:
+            X, y = stack(chunks)
+            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE)
+            if mode == "search":
+                model = fit_search(X_train, y_train, n_jobs, search_iter, cv, scoring)
+            else:
+                model = fit_forest(X_train, y_train, n_jobs)
+            y_pred = model.predict(X_test)
+            n_train = X_train.shape[0]
+        metrics.inc("records_total", n_train)
+    seconds = time.perf_counter() - start
+    rss = metrics.peak_rss_bytes()
+    memory = f", peak RSS {rss / 1e6:.0f} MB ({rss_before / 1e6:.0f} MB before fitting)" if rss else ""
+    print(f"Trained {mode} model on {n_train} rows in {seconds:.2f}s{memory}")
+    return model, y_test, y_pred
+
+
+def print_importances(model, names, fmt="{:.3f}"):
+    """Forest feature importances, or the SGD coefficients, for the named leading columns."""
+    if hasattr(model, "feature_importances_"):
+        print("\nFeature importances:")
+        values = model.feature_importances_
+    else:
+        print("\nCoefficients (scaled features):")
+        values = model[-1].coef_[0]
+    for name, value in zip(names, values):
+        print(f"{name}: {fmt.format(value)}")